@@ -1,5 +1,5 @@
 import pytest
-from authorization.password_utils import hash_password, check_password
+from authorization.password_utils import hash_password, check_password, hash_password_async, check_password_async
 from authorization.jwt_service import JWTService
 from services.redis_service import RedisService
 
@@ -17,8 +17,32 @@ def test_pw_hashing(prepared_pws):
     assert check_password(prepared_pws[0], prepared_pws[2]) == True
     assert check_password(prepared_pws[1], prepared_pws[2]) == False
 
+@pytest.mark.asyncio
+async def test_pw_hashing_async(prepared_pws):
+    hashed = await hash_password_async(prepared_pws[0])
+    assert await check_password_async(prepared_pws[0], hashed) == True
+    assert await check_password_async(prepared_pws[1], prepared_pws[2]) == False
+
 @pytest.mark.asyncio
 async def test_jwt_and_redis_jwt_saving():
     """Test JWT handling with jwt and redis async library"""
 
-    pass
\ No newline at end of file
+    pass
+
+def test_acces_token_cache_invalidation():
+    from authorization.token_cache import AccesTokenCache, hash_token
+    from pydantic_schemas.pydantic_schemas_auth import AuthorizedUser
+    import time
+
+    cache = AccesTokenCache()
+    cache.set("token-1", AuthorizedUser(user_id="user-1", username="user1"), issued_at=time.time())
+    cache.set("token-2", AuthorizedUser(user_id="user-1", username="user1"), issued_at=time.time())
+
+    assert cache.get("token-1").user_id == "user-1"
+
+    cache.invalidate_token_hash(hash_token("token-1"))
+    assert cache.get("token-1") is None
+    assert cache.get("token-2") is not None
+
+    cache.invalidate_user("user-1")
+    assert cache.get("token-2") is None
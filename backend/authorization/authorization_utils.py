@@ -4,17 +4,21 @@ from fastapi import Header, HTTPException
 
 from dotenv import load_dotenv
 from os import getenv
-from typing import Callable
+from typing import Callable, TYPE_CHECKING
 
 from exceptions.custom_exceptions import *
 from exceptions.exceptions_handler import endpoint_exception_handler
 
+if TYPE_CHECKING:
+    # pydantic_schemas_auth imports this module. Prevent circular import
+    from pydantic_schemas.pydantic_schemas_auth import AuthorizedUser
+
 PASSWORD_MIN_L = int(getenv("PASSWORD_MIN_L"))
 PASSWORD_MAX_L = int(getenv("PASSWORD_MAX_L"))
 
 @endpoint_exception_handler
-async def authorize_request_depends(token: str = Header(..., title="Authorization acces token", examples="Bearer {token}")) -> User | None:
-    """User with fastAPI Depends()"""
+async def authorize_request_depends(token: str = Header(..., title="Authorization acces token", examples="Bearer {token}")) -> "AuthorizedUser":
+    """User with fastAPI Depends() \n Returns lightweight principal, not ORM User"""
 
     # To prevent circular import
     from services.core_services import MainServiceContextManager
@@ -3,7 +3,8 @@ from dotenv import load_dotenv
 from os import getenv
 from datetime import datetime
 from services.redis_service import RedisService
-from typing import Literal
+from authorization.token_cache import AccesTokenCache, hash_token
+from typing import List, Literal
 from pydantic_schemas.pydantic_schemas_auth import (PayloadJWT,
     RefreshTokenSchema,
     AccesTokenSchema,
@@ -60,19 +61,29 @@ class JWTService:
 
     # Doesn't require error handle
     @classmethod
-    async def generate_save_token(cls, user_id: str, redis: RedisService, token_type: str) -> RefreshTokenSchema | AccesTokenSchema:
-        """Choose token type you want to generate - acces/refresh"""
+    async def generate_save_token(cls, user_id: str, redis: RedisService, token_type: str, replaces: str | None = None) -> RefreshTokenSchema | AccesTokenSchema:
+        """Choose token type you want to generate - acces/refresh. `replaces` - acces token of the same device, revoked on save"""
         encoded_jwt = cls.generate_token(user_id)
 
         if token_type == "acces":
-            expires_at = await redis.save_acces_jwt(jwt_token=encoded_jwt, user_id=user_id)
+            expires_at, evicted = await redis.save_acces_jwt(jwt_token=encoded_jwt, user_id=user_id, replaces=replaces)
+            await cls._revoke_evicted_acces_tokens(tokens=evicted, redis=redis)
             return AccesTokenSchema.model_validate({"acces_token": encoded_jwt, "expires_at_acces": expires_at})
         elif token_type == "refresh":
-            expires_at = await redis.save_refresh_jwt(jwt_token=encoded_jwt, user_id=user_id)
+            # Evicted refresh tokens and their pairs are deleted in Redis. Nothing is cached for them
+            expires_at, _ = await redis.save_refresh_jwt(jwt_token=encoded_jwt, user_id=user_id)
             return RefreshTokenSchema.model_validate({"refresh_token": encoded_jwt, "expires_at_refresh": expires_at})
         else:
             raise ValueError("Unsuported token type")
 
+    @classmethod
+    async def _revoke_evicted_acces_tokens(cls, tokens: List[str], redis: RedisService) -> None:
+        """Acces tokens over `MAX_SESSIONS_PER_USER` are already deleted in Redis. Drops them from token caches of all workers"""
+        cache = AccesTokenCache()
+        for token in tokens:
+            token_hash = hash_token(token)
+            cache.invalidate_token_hash(token_hash)
+            await redis.publish_acces_token_revocation(token_hash=token_hash)
 
     @classmethod
     @jwt_error_handler
@@ -80,6 +91,7 @@ class JWTService:
 
         acces_token = await cls.generate_save_token(user_id=user_id, redis=redis, token_type="acces")
         refresh_token = await cls.generate_save_token(user_id=user_id, redis=redis, token_type="refresh")
+        await redis.pair_tokens(refresh_token=refresh_token.refresh_token, acces_token=acces_token.acces_token)
 
 
         return RefreshAccesTokens.model_validate(
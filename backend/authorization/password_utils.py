@@ -1,6 +1,23 @@
 import bcrypt
 from exceptions.custom_exceptions import BcryptError
 
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar, Dict
+from dotenv import load_dotenv
+from os import getenv
+import asyncio
+
+load_dotenv()
+
+# bcrypt releases GIL while hashing. So threads give real parallelism here
+PASSWORD_HASHING_WORKERS = int(getenv("PASSWORD_HASHING_WORKERS", "4"))
+
+T = TypeVar("T")
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASHING_WORKERS, thread_name_prefix="bcrypt")
+_semaphore = asyncio.Semaphore(PASSWORD_HASHING_WORKERS)
+_statistics = {"queued": 0, "in_progress": 0}
+
 def hash_password(raw_pass: str) -> str:
     try:
         salt = bcrypt.gensalt()
@@ -14,4 +31,35 @@ def check_password(entered_pass: str, hashed_pass: str) -> bool:
     try:
         return bcrypt.checkpw(entered_pass.encode(), hashed_pass.encode())
     except Exception as e:
-        raise BcryptError("Bcrypt: check password failed.")
\ No newline at end of file
+        raise BcryptError("Bcrypt: check password failed.")
+
+async def _run_in_pool(func: Callable[..., T], *args) -> T:
+    """Runs blocking bcrypt call in bounded thread pool. Event loop stays free"""
+    _statistics["queued"] += 1
+    try:
+        await _semaphore.acquire()
+    finally:
+        _statistics["queued"] -= 1
+
+    _statistics["in_progress"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        _statistics["in_progress"] -= 1
+        _semaphore.release()
+
+async def hash_password_async(raw_pass: str) -> str:
+    """Use in async code instead of `hash_password`"""
+    return await _run_in_pool(hash_password, raw_pass)
+
+async def check_password_async(entered_pass: str, hashed_pass: str) -> bool:
+    """Use in async code instead of `check_password`"""
+    return await _run_in_pool(check_password, entered_pass, hashed_pass)
+
+def get_password_hashing_statistics() -> Dict[str, int]:
+    """`queued` - calls waiting for free worker, `in_progress` - calls being hashed right now"""
+    return {
+        "workers": PASSWORD_HASHING_WORKERS,
+        "queued": _statistics["queued"],
+        "in_progress": _statistics["in_progress"],
+    }
@@ -0,0 +1,127 @@
+from services.redis_service import RedisService
+from pydantic_schemas.pydantic_schemas_auth import AuthorizedUser
+
+from collections import OrderedDict
+from typing import Dict, Set, Tuple
+from dotenv import load_dotenv
+from os import getenv
+import hashlib
+import asyncio
+import logging
+import time
+
+load_dotenv()
+
+ACCES_TOKEN_CACHE_TTL_SECONDS = int(getenv("ACCES_TOKEN_CACHE_TTL_SECONDS", "60"))
+ACCES_TOKEN_CACHE_MAX_SIZE = int(getenv("ACCES_TOKEN_CACHE_MAX_SIZE", "10000"))
+ACCES_JWT_EXPIRY_SECONDS = int(getenv("ACCES_JWT_EXPIRY_SECONDS"))
+DELAY = int(getenv("DELAY", "1"))
+
+
+def hash_token(token: str) -> str:
+    """Raw tokens are never kept in memory as keys or sent through pub/sub"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class AccesTokenCache:
+    """
+    In-process bounded LRU cache of validated acces tokens. Key - token hash, value - resolved `AuthorizedUser` \n
+    Entry lives `ACCES_TOKEN_CACHE_TTL_SECONDS`, but never longer than the token itself. \n
+    Workers stay consistent by listening revocations through Redis pub/sub - run `listen_revocations()` as background task.
+    """
+
+    _instance = None
+    _isinitialized = False
+
+    def __new__(cls):
+        if not cls._instance:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if self._isinitialized:
+            return
+        self._isinitialized = True
+
+        # token hash -> (principal, expires at monotonic time)
+        self._entries: OrderedDict[str, Tuple[AuthorizedUser, float]] = OrderedDict()
+        self._user_tokens: Dict[str, Set[str]] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> AuthorizedUser | None:
+        token_hash = hash_token(token)
+        entry = self._entries.get(token_hash)
+
+        if not entry or entry[1] <= time.monotonic():
+            if entry: self._remove(token_hash)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(token_hash)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, token: str, principal: AuthorizedUser, issued_at: float) -> None:
+        """`issued_at` - token unix timestamp. Used to keep entry TTL under the token expiry"""
+        token_time_left = issued_at + ACCES_JWT_EXPIRY_SECONDS - time.time()
+        ttl = min(ACCES_TOKEN_CACHE_TTL_SECONDS, token_time_left)
+        if ttl <= 0:
+            return
+
+        token_hash = hash_token(token)
+        self._entries[token_hash] = (principal, time.monotonic() + ttl)
+        self._entries.move_to_end(token_hash)
+        self._user_tokens.setdefault(principal.user_id, set()).add(token_hash)
+
+        while len(self._entries) > ACCES_TOKEN_CACHE_MAX_SIZE:
+            oldest_hash = next(iter(self._entries))
+            self._remove(oldest_hash)
+
+    def _remove(self, token_hash: str) -> None:
+        entry = self._entries.pop(token_hash, None)
+        if not entry:
+            return
+
+        user_id = entry[0].user_id
+        user_tokens = self._user_tokens.get(user_id)
+        if user_tokens:
+            user_tokens.discard(token_hash)
+            if not user_tokens:
+                del self._user_tokens[user_id]
+
+    def invalidate_token_hash(self, token_hash: str) -> None:
+        self._remove(token_hash)
+
+    def invalidate_user(self, user_id: str) -> None:
+        for token_hash in list(self._user_tokens.get(user_id, ())):
+            self._remove(token_hash)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._user_tokens.clear()
+
+    def get_statistics(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": ACCES_TOKEN_CACHE_MAX_SIZE,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    async def listen_revocations(self, redis: RedisService) -> None:
+        """Applies revocations published by any worker. Runs until cancelled"""
+        while True:
+            try:
+                async for kind, value in redis.listen_acces_token_revocations():
+                    if kind == "token": self.invalidate_token_hash(value)
+                    elif kind == "user": self.invalidate_user(value)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.log(level=logging.ERROR, msg=f"AccesTokenCache: Revocations listener failed: {e}. Reconnecting.", exc_info=True)
+
+            # Revocations could be missed while listener was down
+            self.clear()
+            await asyncio.sleep(DELAY)
@@ -1,11 +1,15 @@
 import pytest
 from services.postgres_service import PostgresService, create_engine, create_async_engine, Base, User, Post, PostActions, create_sessionmaker, ActionType
+from services.postgres_service import PostImage, Friendship, ChatRoom, UserRoom, Message
+from services.postgres_service.pagination import hot_post_key, time_post_key, UserRankKey, HotPostKey, TimePostKey, FeedKey, encode_cursor, decode_cursor
 
 from post_popularity_rate_task.popularity_rate import POST_ACTIONS
 from services.core_services import MainServiceContextManager
 
 from main import initialize_models, drop_all
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import event, insert
+from datetime import datetime, timedelta
 from authorization.password_utils import hash_password
 from uuid import uuid4
 from pydantic_schemas.pydantic_schemas_social import PostDataSchemaID
@@ -167,3 +171,234 @@ async def test_postgres_service():
 
     # finally:
     #     await ps.close()
+
+
+# Tables that grow with usage. Sequential scan over any of them fails the test below.
+# `users` is here too - lookups go by primary key and username search must use trigram GIN index
+LARGE_TABLES = ("users", "posts", "postactions", "postimages", "friendship", "chatroom", "userroom", "message")
+
+@pytest.mark.asyncio
+async def test_hot_queries_use_indexes():
+    """Runs PostgresService queries over seeded database and checks EXPLAIN of every emitted SELECT"""
+    engine = await create_engine(mode="test")
+
+    await drop_all(engine=engine, Base=Base)
+    await initialize_models(engine=engine, Base=Base)
+
+    now = datetime.utcnow()
+    user_ids = [str(uuid4()) for _ in range(5000)]
+    post_ids = [str(uuid4()) for _ in range(5000)]
+    room_ids = [str(uuid4()) for _ in range(2000)]
+
+    session = create_sessionmaker(engine=engine)()
+    try:
+        await session.execute(insert(User), [
+            # Distinct usernames. `userN` for all would make every row trigram-similar to any `userN` prompt
+            {"user_id": user_id, "username": f"user{i}" if i % 100 == 42 else uuid4().hex[:12], "email": f"user{i}@example.com", "password_hash": "hash"}
+            for i, user_id in enumerate(user_ids)
+        ])
+        await session.execute(insert(Post), [
+            {
+                "post_id": post_id, "owner_id": user_ids[i % len(user_ids)], "title": f"Post {i}", "text": "Text",
+                # Every 10th post replies to one of 5 parents - ~100 replies each, enough for several pages
+                "parent_post_id": post_ids[9 + 10 * (i % 5)] if i % 10 == 0 and i else None, "is_reply": bool(i % 10 == 0 and i),
+                "published": now - timedelta(minutes=i), "hot_score": float(i)
+            }
+            for i, post_id in enumerate(post_ids)
+        ])
+        await session.execute(insert(PostImage), [
+            {"image_id": str(uuid4()), "post_id": post_id, "image_name": f"{post_id}_0"}
+            for post_id in post_ids[::3]
+        ])
+        await session.execute(insert(PostActions), [
+            {
+                "action_id": str(uuid4()), "owner_id": user_ids[i % len(user_ids)], "post_id": post_ids[(i * 7) % len(post_ids)],
+                "action": ActionType.view if i % 3 else ActionType.like, "date": now - timedelta(minutes=i)
+            }
+            for i in range(30000)
+        ])
+        await session.execute(insert(Friendship), [
+            {"follower_id": user_id, "followed_id": user_ids[(i + shift) % len(user_ids)]}
+            for i, user_id in enumerate(user_ids) for shift in (1, 2, 3)
+        ])
+        await session.execute(insert(ChatRoom), [
+            {"room_id": room_id, "is_group": False, "approved": bool(i % 2), "creator_id": user_ids[i % len(user_ids)], "last_message_time": now - timedelta(minutes=i), "last_message_seq": 10}
+            for i, room_id in enumerate(room_ids)
+        ])
+        await session.execute(insert(UserRoom), [
+            {"user_id": user_ids[(i + shift) % len(user_ids)], "room_id": room_id}
+            for i, room_id in enumerate(room_ids) for shift in (0, 1)
+        ])
+        await session.execute(insert(Message), [
+            {"message_id": str(uuid4()), "room_id": room_id, "owner_id": user_ids[i % len(user_ids)], "text": "Hi", "seq": seq}
+            for i, room_id in enumerate(room_ids) for seq in range(1, 11)
+        ])
+        await session.commit()
+    finally:
+        await session.aclose()
+
+    # VACUUM flushes GIN pending lists left by bulk insert - as autovacuum does on live database. Otherwise planner avoids trigram index
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.exec_driver_sql("VACUUM ANALYZE")
+
+    statements = []
+    def capture_select(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", capture_select)
+
+    session = create_sessionmaker(engine=engine)()
+    ps = PostgresService(postgres_session=session)
+    try:
+        user = await ps.get_user_by_id(user_id=user_ids[0])
+        other_user = await ps.get_user_by_id(user_id=user_ids[1])
+        await ps.get_user_principal_columns(user_id=user.user_id)
+        await ps.get_entry_by_id(id_=user.user_id, ModelType=User)
+        found_users = await ps.get_users_by_username(prompt="user42", n=5, exclude_user_id=user.user_id)
+        assert found_users[0].username == "user42"
+        await ps.get_users_by_username(prompt="user42", n=5, after=UserRankKey(rank=found_users[-1].rank, user_id=found_users[-1].user_id))
+
+        fresh = await ps.get_fresh_posts(user=user, n=10, exclude_ids=[post_ids[0]])
+        await ps.get_fresh_posts(user=user, n=10, exclude_ids=[], after=hot_post_key(fresh[-1]))
+        followed = await ps.get_followed_posts(user=user, n=10)
+        await ps.get_followed_posts(user=user, n=10, after=hot_post_key(followed[-1]))
+        timeline = await ps.get_followed_posts_by_time(follower_id=user.user_id, n=10)
+        await ps.get_followed_posts_by_time(follower_id=user.user_id, n=10, after=time_post_key(timeline[-1]), owner_ids=user_ids[1:3])
+        await ps.get_follower_ids(user_id=user.user_id)
+        await ps.count_followers(user_id=user.user_id)
+
+        user_posts = await ps.get_user_posts(user_id=user.user_id, n=5)
+        await ps.get_user_posts(user_id=user.user_id, n=5, after=time_post_key(user_posts[-1]))
+        replies = await ps.get_post_replies(post_id=post_ids[9], n=5)
+        assert len(replies) == 5
+        next_replies = await ps.get_post_replies(post_id=post_ids[9], n=5, after=time_post_key(replies[-1]))
+        assert next_replies and not {reply.post_id for reply in replies} & {reply.post_id for reply in next_replies}
+
+        await ps.get_entry_by_id(id_=post_ids[42], ModelType=Post)
+        await ps.get_entries_by_ids(ids=post_ids[100:110], ModelType=Post)
+        await ps.get_actions(user_id=user.user_id, post_id=post_ids[0], action_type=ActionType.like)
+        await ps.get_post_action_by_type(post_id=post_ids[7], action_type=ActionType.view)
+        await ps.get_user_actions(user_id=user.user_id, action_type=ActionType.view, n_most_fresh=30, return_posts=True)
+
+        await ps.get_chat_room(room_id=room_ids[0])
+        await ps.get_dialogue_by_users(user_1=user, user_2=other_user)
+        await ps.get_n_user_chats(user=user, n=10, page=0, chat_type="chat")
+        messages = await ps.get_chat_messages_before(room_id=room_ids[0], n=5)
+        await ps.get_chat_messages_before(room_id=room_ids[0], n=5, before_seq=messages[-1].seq)
+        await ps.get_message_by_id(message_id=messages[0].message_id)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capture_select)
+        await ps.close()
+
+    try:
+        assert statements
+        sequential_scans = []
+        async with engine.connect() as conn:
+            for statement, parameters in statements:
+                plan = "\n".join(row[0] for row in await conn.exec_driver_sql(f"EXPLAIN {statement}", parameters))
+                for table in LARGE_TABLES:
+                    if f"Seq Scan on {table} " in plan:
+                        sequential_scans.append(f"Sequential scan on {table}:\n{statement}\n{plan}")
+        assert not sequential_scans, "\n\n".join(sequential_scans)
+    finally:
+        await drop_all(engine=engine, Base=Base)
+        await engine.dispose()
+
+
+def test_cursor_round_trip():
+    published = datetime(2026, 1, 2, 3, 4, 5, 678901)
+    keys = [
+        HotPostKey(hot_score=1234.5, published=published, post_id="post-1"),
+        TimePostKey(published=published, post_id="post-1"),
+        UserRankKey(rank=0.75, user_id="user-1"),
+        FeedKey(related_page=2, followed=HotPostKey(hot_score=3.0, published=published, post_id="post-2"), fresh=None, snapshot_id="123", snapshot_offset=30),
+    ]
+    for key in keys:
+        cursor = encode_cursor(key)
+        assert "=" not in cursor
+        assert decode_cursor(cursor=cursor, KeyType=type(key)) == key
+
+    assert encode_cursor(None) is None
+    assert decode_cursor(cursor=None, KeyType=TimePostKey) is None
+
+def _raw_cursor(raw: str) -> str:
+    import base64
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor!",
+    encode_cursor(TimePostKey(published=datetime(2026, 1, 1), post_id="post-1"))[:-6],
+    encode_cursor(HotPostKey(hot_score=1.0, published=datetime(2026, 1, 1), post_id="post-1")),
+    _raw_cursor('["yesterday","post-1"]'),
+    _raw_cursor('[1.5,"post-1"]'),
+    _raw_cursor('["2026-01-01T00:00:00",42]'),
+    _raw_cursor('{"published":"2026-01-01T00:00:00","post_id":"post-1"}'),
+])
+def test_tampered_cursor_rejected(cursor):
+    from services.core_services.main_services import MainServiceSocial
+    from exceptions.custom_exceptions import InvalidResourceProvided
+
+    with pytest.raises(ValueError):
+        decode_cursor(cursor=cursor, KeyType=TimePostKey)
+    with pytest.raises(InvalidResourceProvided):
+        MainServiceSocial._decode_cursor(cursor=cursor, KeyType=TimePostKey, user_id="user-1")
+
+def test_cursor_validator():
+    from fastapi import FastAPI, Depends
+    from fastapi.testclient import TestClient
+    from routes.query_utils import cursor_validator, CURSOR_MAX_L
+    from exceptions.custom_exceptions import BadRequestExc
+
+    assert cursor_validator(cursor=None) is None
+    assert cursor_validator(cursor="abc") == "abc"
+    with pytest.raises(BadRequestExc):
+        cursor_validator(cursor="   ")
+
+    app = FastAPI()
+    @app.get("/page")
+    async def page(cursor: str | None = Depends(cursor_validator)) -> str | None:
+        return cursor
+
+    client = TestClient(app)
+    assert client.get("/page", params={"cursor": "a" * CURSOR_MAX_L}).status_code == 200
+    assert client.get("/page", params={"cursor": "a" * (CURSOR_MAX_L + 1)}).status_code == 422
+
+@pytest.mark.asyncio
+async def test_keyset_pages_with_equal_timestamps():
+    """Posts published at the same moment are split by post id. Pages must not repeat or skip any of them"""
+    engine = await create_engine(mode="test")
+
+    await drop_all(engine=engine, Base=Base)
+    await initialize_models(engine=engine, Base=Base)
+
+    published = datetime(2026, 1, 1, 12, 0, 0)
+    user_id = str(uuid4())
+    session = create_sessionmaker(engine=engine)()
+    try:
+        await session.execute(insert(User), [{"user_id": user_id, "username": "user1", "email": "user1@example.com", "password_hash": "hash"}])
+        await session.execute(insert(Post), [
+            {"post_id": str(uuid4()), "owner_id": user_id, "title": f"Post {i}", "text": "Text", "published": published - timedelta(minutes=i // 10), "hot_score": 1.0}
+            for i in range(25)
+        ])
+        await session.commit()
+
+        ps = PostgresService(postgres_session=session)
+        pages, after = [], None
+        while True:
+            page = await ps.get_user_posts(user_id=user_id, n=10, after=after)
+            if not page:
+                break
+            pages.append(page)
+            # Key goes through cursor, as it does between requests
+            after = decode_cursor(cursor=encode_cursor(time_post_key(page[-1])), KeyType=TimePostKey)
+
+        posts = [post for page in pages for post in page]
+        assert [len(page) for page in pages] == [10, 10, 5]
+        assert len({post.post_id for post in posts}) == 25
+        assert [time_post_key(post) for post in posts] == sorted((time_post_key(post) for post in posts), reverse=True)
+    finally:
+        await session.aclose()
+        await drop_all(engine=engine, Base=Base)
+        await engine.dispose()
@@ -1,11 +1,14 @@
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.ext.asyncio import AsyncEngine
-from routes import auth_router, social_router, media_router
+from routes import auth_router, social_router, media_router, metrics_router
 from services.postgres_service import Base
-from services.postgres_service import get_engine, initialize_models, drop_all, get_session
+from services.postgres_service import init_engine, dispose_engine, initialize_models, drop_all, get_session
 from services.core_services.main_services import MainServiceSocial
-from services.core_services import MainServiceContextManager
+from services.core_services import MainServiceContextManager, BackendsRegistry
+from services.redis_service import RedisService, get_redis_pool, close_redis_pools
+from services.image_storage_service import shutdown_image_processing
+from authorization.token_cache import AccesTokenCache
 from websockets_chat.chat import chat
 
 from exceptions.custom_exceptions import EmptyPostsError
@@ -14,9 +17,12 @@ from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 import redis.asyncio as async_redis
 import uvicorn
+import asyncio
 from os import getenv, mkdir
 from dotenv import load_dotenv
-from post_popularity_rate_task.popularity_rate import update_post_rates
+from post_popularity_rate_task.popularity_rate import update_post_rates, POPULARITY_RECOMPUTE_INTERVAL_SECONDS
+from post_popularity_rate_task.post_counters import reconcile_post_counters, POST_COUNTERS_RECONCILE_INTERVAL_SECONDS
+from post_popularity_rate_task.feed_precompute import precompute_feeds, FEED_PRECOMPUTE_INTERVAL_SECONDS
 
 from post_popularity_rate_task.popularity_rate import scheduler
 
@@ -30,16 +36,11 @@ logging.basicConfig(
 )
 
 load_dotenv()
-POST_RATING_EXPIRATION = int(getenv("POST_RATING_EXPIRATION_SECONDS"))
 
 engine = None
 
 async def drop_redis() -> None:
-    client = async_redis.Redis(
-        host="localhost",
-        port=int(getenv("REDIS_PORT")),
-        db=0
-    )
+    client = async_redis.Redis(connection_pool=get_redis_pool(db=0))
     await client.flushall()
     await client.aclose()
 
@@ -59,9 +60,10 @@ async def sync_chroma_postgres_data() -> None:
 async def lifespan(app: FastAPI):
     # await drop_all(engine=engine, Base=Base)    
     global engine
-    engine = await get_engine()
+    engine = await init_engine(mode="prod")
 
     await initialize_models(engine=engine, Base=Base)
+    await BackendsRegistry().open()
     await sync_chroma_postgres_data()
     # await drop_redis()
 
@@ -69,14 +71,39 @@ async def lifespan(app: FastAPI):
         scheduler.add_job(
             update_post_rates,
             "interval",
-            seconds=POST_RATING_EXPIRATION
+            seconds=POPULARITY_RECOMPUTE_INTERVAL_SECONDS,
+            max_instances=1,
+            coalesce=True
+        )
+        scheduler.add_job(
+            reconcile_post_counters,
+            "interval",
+            seconds=POST_COUNTERS_RECONCILE_INTERVAL_SECONDS,
+            max_instances=1,
+            coalesce=True
+        )
+        scheduler.add_job(
+            precompute_feeds,
+            "interval",
+            seconds=FEED_PRECOMPUTE_INTERVAL_SECONDS,
+            max_instances=1,
+            coalesce=True
         )
         scheduler.start()
     except Exception as e:
         scheduler.shutdown()
         raise e("Scheduler initializtion failed")
+
+    token_revocations_listener = asyncio.create_task(AccesTokenCache().listen_revocations(redis=RedisService(db_pool="prod")))
     yield
 
+    token_revocations_listener.cancel()
+    scheduler.shutdown()
+    await BackendsRegistry().close()
+    shutdown_image_processing()
+    await close_redis_pools()
+    await dispose_engine()
+
 
 app = FastAPI(lifespan=lifespan)
 
@@ -97,6 +124,7 @@ app.include_router(auth_router.auth)
 app.include_router(social_router.social)
 app.include_router(media_router.media_router)
 app.include_router(chat)
+app.include_router(metrics_router.metrics)
 
 try:
     mkdir("images")
@@ -0,0 +1,76 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+import os
+
+from routes.media_router import _media_file_response, MEDIA_CACHE_CONTROL
+from services.core_services.main_services.main_media_service import MediaFile
+from services.image_storage_service.variants import render_variants, variant_name, IMAGE_VARIANT_SIZES, IMAGE_VARIANT_FORMAT, VARIANT_FORMATS, VARIANT_EXTENSION
+from PIL import Image
+import io
+
+@pytest.fixture
+def media_client(tmp_path) -> TestClient:
+    """Serves one 100 bytes file the same way media router does"""
+    filepath = tmp_path / "image.png"
+    filepath.write_bytes(bytes(range(100)))
+
+    app = FastAPI()
+    @app.get("/media")
+    async def get_media(request: Request):
+        media_file = MediaFile(filepath=str(filepath), content_type="image/png", stat=os.stat(filepath))
+        return _media_file_response(media_file=media_file, request=request)
+
+    return TestClient(app)
+
+def test_media_response_headers(media_client):
+    response = media_client.get("/media")
+    assert response.status_code == 200
+    assert response.content == bytes(range(100))
+    assert response.headers["cache-control"] == MEDIA_CACHE_CONTROL
+    assert response.headers["etag"]
+    assert response.headers["last-modified"]
+
+def test_media_conditional_get(media_client):
+    etag = media_client.get("/media").headers["etag"]
+
+    not_modified = media_client.get("/media", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+    assert not_modified.headers["cache-control"] == MEDIA_CACHE_CONTROL
+
+    assert media_client.get("/media", headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+
+    modified = media_client.get("/media", headers={"If-None-Match": '"other"'})
+    assert modified.status_code == 200
+    assert modified.content == bytes(range(100))
+
+def test_media_range_request(media_client):
+    response = media_client.get("/media", headers={"Range": "bytes=0-9"})
+    assert response.status_code == 206
+    assert response.content == bytes(range(10))
+    assert response.headers["content-range"] == "bytes 0-9/100"
+
+def _png(width: int, height: int) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 100, 50)).save(output, format="PNG")
+    return output.getvalue()
+
+def test_render_variants():
+    """Every size is produced, smallest first. Image smaller than variant size isn't upscaled"""
+    original_size = (IMAGE_VARIANT_SIZES[0] * 2, IMAGE_VARIANT_SIZES[0])
+    variants = render_variants(_png(*original_size))
+
+    assert [width for width, _ in variants] == IMAGE_VARIANT_SIZES
+    for width, contents in variants:
+        with Image.open(io.BytesIO(contents)) as image:
+            assert image.format == IMAGE_VARIANT_FORMAT
+            assert max(image.size) <= width
+            assert image.size[0] <= original_size[0] and image.size[1] <= original_size[1]
+            if width >= max(original_size):
+                assert image.size == original_size
+
+def test_variant_naming():
+    assert variant_name(image_name="image", width=160) == "image_160"
+    assert VARIANT_EXTENSION == VARIANT_FORMATS[IMAGE_VARIANT_FORMAT][0]
@@ -0,0 +1,66 @@
+from datetime import datetime
+from dotenv import load_dotenv
+from os import getenv
+from typing import Dict
+
+from services.postgres_service import get_session
+from services.redis_service import RedisService
+from services.core_services import MainServiceContextManager
+from services.core_services.main_services.main_social_service import MainServiceSocial
+
+import logging
+import time
+
+load_dotenv()
+DATETIME_BASE_FORMAT = getenv("DATETIME_BASE_FORMAT")
+
+FEED_PRECOMPUTE_INTERVAL_SECONDS = int(getenv("FEED_PRECOMPUTE_INTERVAL_SECONDS", "60"))
+FEED_PRECOMPUTE_MAX_FEEDS_PER_RUN = int(getenv("FEED_PRECOMPUTE_MAX_FEEDS_PER_RUN", "500"))
+FEED_ACTIVE_USER_WINDOW_SECONDS = int(getenv("FEED_ACTIVE_USER_WINDOW_SECONDS", "1800"))
+
+# Last run report. Exposed in /metrics
+last_precompute_statistics: Dict[str, float | int | str | None] = {
+    "started_at": None,
+    "runtime_seconds": None,
+    "feeds_built": 0,
+    "feeds_failed": 0,
+}
+
+
+async def precompute_feeds() -> None:
+    """
+    Rebuilds feeds of users that requested feed recently and got stale - by own activity or by snapshot TTL. \n
+    Feeds that don't fit into `FEED_PRECOMPUTE_MAX_FEEDS_PER_RUN` are left for next run.
+    """
+    started = time.monotonic()
+    now = datetime.utcnow()
+    feeds_built = 0
+    feeds_failed = 0
+
+    Redis = RedisService(db_pool="prod")
+    try:
+        user_ids = await Redis.get_feed_users_to_refresh(active_since=time.time() - FEED_ACTIVE_USER_WINDOW_SECONDS, count=FEED_PRECOMPUTE_MAX_FEEDS_PER_RUN)
+
+        for user_id in user_ids:
+            # Session per feed. Failed query mustn't break the rest of the run
+            session = await get_session()
+            try:
+                async with await MainServiceContextManager[MainServiceSocial].create(MainServiceType=MainServiceSocial, postgres_session=session, mode="prod") as social:
+                    if await social.materialize_feed(user_id=user_id):
+                        feeds_built += 1
+                    else:
+                        # User was deleted. Otherwise it's picked on every run till it leaves active window
+                        await Redis.forget_feed_users(user_ids=[user_id])
+            except Exception as e:
+                feeds_failed += 1
+                await Redis.mark_feeds_stale(user_ids=[user_id])
+                logging.log(level=logging.ERROR, msg=f"FeedPrecompute: Failed to build feed of user: {user_id}. {e}", exc_info=True)
+            finally:
+                await session.aclose()
+    finally:
+        await Redis.finish()
+
+        last_precompute_statistics["started_at"] = now.strftime(DATETIME_BASE_FORMAT)
+        last_precompute_statistics["runtime_seconds"] = round(time.monotonic() - started, 3)
+        last_precompute_statistics["feeds_built"] = feeds_built
+        last_precompute_statistics["feeds_failed"] = feeds_failed
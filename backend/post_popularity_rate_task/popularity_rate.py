@@ -1,15 +1,17 @@
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from os import getenv
-from typing import List
-from asgiref.sync import async_to_sync
+from typing import List, Dict
 
 from services.postgres_service import *
+from services.redis_service import RedisService
 
-from sqlalchemy import select, text, and_
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, update, and_, case, func
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+import logging
+import time
 
 load_dotenv()
 DATETIME_BASE_FORMAT = getenv("DATETIME_BASE_FORMAT")
@@ -27,44 +29,90 @@ POST_ACTIONS = {
 POST_RATING_EXPIRATION_SECONDS = int(getenv("POST_RATING_EXPIRATION_SECONDS"))
 EXPIRATION_INTERVAL = timedelta(seconds=POST_RATING_EXPIRATION_SECONDS)
 
+POPULARITY_RECOMPUTE_INTERVAL_SECONDS = int(getenv("POPULARITY_RECOMPUTE_INTERVAL_SECONDS", "600"))
+POPULARITY_RECOMPUTE_CHUNK_SIZE = int(getenv("POPULARITY_RECOMPUTE_CHUNK_SIZE", getenv("YIELD_PER_LIMIT", "1000")))
+
+# SQL side mapping of action -> cost. Actions that aren't in POST_ACTIONS cost nothing
+# Comparisons, not `case(value=...)` - only they bind enum with column type, so asyncpg gets its name
+ACTION_COST = case(
+    *[(PostActions.action == ActionType(action), cost) for action, cost in POST_ACTIONS.items()],
+    else_=0
+)
+
 scheduler = AsyncIOScheduler()
 
+# Last tick report. Exposed in /metrics
+last_tick_statistics: Dict[str, float | int | str | None] = {
+    "started_at": None,
+    "runtime_seconds": None,
+    "posts_updated": 0,
+}
+
+
+async def _mark_expired_actions_posts_dirty(session: AsyncSession, Redis: RedisService, since: datetime, until: datetime) -> None:
+    """Posts don't gain or lose actions when their actions leave rating window. But rate still must be recomputed"""
+    result = await session.stream_scalars(
+        select(PostActions.post_id)
+        .where(and_(PostActions.date > since, PostActions.date <= until))
+        .distinct()
+        .execution_options(yield_per=POPULARITY_RECOMPUTE_CHUNK_SIZE)
+    )
+    async for post_ids in result.partitions(POPULARITY_RECOMPUTE_CHUNK_SIZE):
+        await Redis.mark_posts_dirty(post_ids=list(post_ids))
+
+async def _recompute_chunk(session: AsyncSession, post_ids: List[str], window_start: datetime, now: datetime) -> int:
+    """One UPDATE for whole chunk. Rate - sum of actions costs inside rating window. Returns number of updated posts"""
+    window_rate = (
+        select(func.coalesce(func.sum(ACTION_COST), 0))
+        .where(and_(PostActions.post_id == Post.post_id, PostActions.date > window_start))
+        .scalar_subquery()
+    )
+
+    result = await session.execute(
+        update(Post)
+        .where(Post.post_id.in_(post_ids))
+        # Setting last_updated to itself. Otherwise onupdate marks every recomputed post as edited
+        .values(popularity_rate=window_rate, last_rate_calculated=now, last_updated=Post.last_updated)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
 async def update_post_rates() -> None:
-    """Calculates new rate, shitfing out old actions."""
+    """Recalculates rate of posts that gained, lost or shifted out actions since last run. Processes them in chunks"""
     print("Task started")
+    started = time.monotonic()
+    now = datetime.utcnow()
+    window_start = now - EXPIRATION_INTERVAL
+    posts_updated = 0
+
+    Redis = RedisService(db_pool="prod")
     session = await get_session()
     try:
-        engine = await get_engine()
-        await initialize_models(engine=engine, Base=Base)
-        now = datetime.utcnow()
-
-        posts_raw = await session.execute(
-            select(Post)
-            .where((now - Post.last_updated) > EXPIRATION_INTERVAL)
-        )
-        posts = posts_raw.scalars().all()
-
-        for post in posts:
-            actions_raw = await session.execute(
-                select(PostActions)
-                .where(and_((now - PostActions.date) > EXPIRATION_INTERVAL), PostActions.post_id == post.post_id)
-            )
-            actions = actions_raw.scalars().all()
-            post.popularity_rate = calculate_new_rate(actions=actions)
-            post.last_rate_calculated = now
-
-        await session.commit()
-        print("Task finished")
-    except Exception as e:
-        await session.rollback()
-        raise e
+        last_run_timestamp = await Redis.get_popularity_last_run()
+        last_run = datetime.fromtimestamp(last_run_timestamp) if last_run_timestamp else now - timedelta(seconds=POPULARITY_RECOMPUTE_INTERVAL_SECONDS)
+
+        await _mark_expired_actions_posts_dirty(session=session, Redis=Redis, since=last_run - EXPIRATION_INTERVAL, until=window_start)
+
+        while True:
+            post_ids = await Redis.pop_dirty_posts(count=POPULARITY_RECOMPUTE_CHUNK_SIZE)
+            if not post_ids:
+                break
+
+            try:
+                posts_updated += await _recompute_chunk(session=session, post_ids=post_ids, window_start=window_start, now=now)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                # Return chunk back. It'll be retried on next tick
+                await Redis.mark_posts_dirty(post_ids=post_ids)
+                raise e
+
+        await Redis.set_popularity_last_run(timestamp=now.timestamp())
     finally:
-        await engine.dispose()
         await session.aclose()
+        await Redis.finish()
 
-
-def calculate_new_rate(actions: List[PostActions]) -> int:
-    rate = 0
-    for action in actions:
-        rate += POST_ACTIONS[action.action.value]
-    return rate
+        last_tick_statistics["started_at"] = now.strftime(DATETIME_BASE_FORMAT)
+        last_tick_statistics["runtime_seconds"] = round(time.monotonic() - started, 3)
+        last_tick_statistics["posts_updated"] = posts_updated
+        logging.log(level=logging.INFO, msg=f"PopularityRate: Task finished. Posts updated: {posts_updated}. Runtime: {last_tick_statistics['runtime_seconds']}s")
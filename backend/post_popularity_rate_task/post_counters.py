@@ -0,0 +1,93 @@
+from datetime import datetime
+from dotenv import load_dotenv
+from os import getenv
+from typing import Dict
+
+from services.postgres_service import *
+
+from sqlalchemy import select, update, and_, or_, func
+from sqlalchemy.orm import aliased
+import logging
+import time
+
+load_dotenv()
+DATETIME_BASE_FORMAT = getenv("DATETIME_BASE_FORMAT")
+
+POST_COUNTERS_RECONCILE_INTERVAL_SECONDS = int(getenv("POST_COUNTERS_RECONCILE_INTERVAL_SECONDS", "3600"))
+POST_COUNTERS_RECONCILE_CHUNK_SIZE = int(getenv("POST_COUNTERS_RECONCILE_CHUNK_SIZE", "1000"))
+
+Reply = aliased(Post)
+
+# Last run report. Exposed in /metrics
+last_reconcile_statistics: Dict[str, float | int | str | None] = {
+    "started_at": None,
+    "runtime_seconds": None,
+    "posts_checked": 0,
+    "posts_repaired": 0,
+}
+
+
+def _count_actions(action_type: ActionType):
+    return (
+        select(func.count())
+        .where(and_(PostActions.post_id == Post.post_id, PostActions.action == action_type))
+        .scalar_subquery()
+    )
+
+def _count_replies():
+    return (
+        select(func.count())
+        .where(Reply.parent_post_id == Post.post_id)
+        .scalar_subquery()
+    )
+
+async def reconcile_post_counters() -> None:
+    """
+    Repairs drift of denormalized post counters against `postactions` and replies. \n
+    Walks posts by primary key in chunks, so each chunk holds row locks only for a short time.
+    """
+    started = time.monotonic()
+    now = datetime.utcnow()
+    posts_checked = 0
+    posts_repaired = 0
+
+    session = await get_session()
+    try:
+        last_post_id = ""
+        while True:
+            # Chunk rows stay locked till commit. Action changing counter waits, so it's never overwritten by count taken before it.
+            # Counts below are read after the lock is taken - actions committed before it are in them
+            post_ids = (await session.execute(
+                select(Post.post_id)
+                .where(Post.post_id > last_post_id)
+                .order_by(Post.post_id)
+                .limit(POST_COUNTERS_RECONCILE_CHUNK_SIZE)
+                .with_for_update()
+            )).scalars().all()
+
+            if not post_ids:
+                break
+            last_post_id = post_ids[-1]
+            posts_checked += len(post_ids)
+
+            likes, views, replies = _count_actions(ActionType.like), _count_actions(ActionType.view), _count_replies()
+            result = await session.execute(
+                update(Post)
+                .where(and_(
+                    Post.post_id.in_(post_ids),
+                    or_(Post.likes_count != likes, Post.views_count != views, Post.replies_count != replies)
+                ))
+                # Setting last_updated to itself. Otherwise onupdate marks every repaired post as edited
+                .values(likes_count=likes, views_count=views, replies_count=replies, last_updated=Post.last_updated)
+                .execution_options(synchronize_session=False)
+            )
+            posts_repaired += result.rowcount
+            await session.commit()
+    finally:
+        await session.aclose()
+
+        last_reconcile_statistics["started_at"] = now.strftime(DATETIME_BASE_FORMAT)
+        last_reconcile_statistics["runtime_seconds"] = round(time.monotonic() - started, 3)
+        last_reconcile_statistics["posts_checked"] = posts_checked
+        last_reconcile_statistics["posts_repaired"] = posts_repaired
+        logging.log(level=logging.INFO, msg=f"PostCounters: Reconciled. Checked: {posts_checked}. Repaired: {posts_repaired}")
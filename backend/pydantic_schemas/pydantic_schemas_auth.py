@@ -39,6 +39,16 @@ class PayloadJWT(BaseModel):
         return value
 
 
+class AuthorizedUser(BaseModel):
+    """
+    Lightweight principal returned by `authorize_request_depends`. Does NOT hold ORM relationships. \n
+    If you need full User model - load it by `user_id` in service layer.
+    """
+    user_id: str
+    username: str
+    has_avatar: bool = False
+
+
 # Body forms
 # ==============
 class LoginSchema(BaseModel):
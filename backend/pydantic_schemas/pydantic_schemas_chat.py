@@ -32,6 +32,7 @@ class MessageSchemaShort(BaseModel):
 
 class MessageSchema(MessageSchemaShort):
     "Use in main http endpoints"
+    seq: int
     text: str
     sent: datetime = Field(default=datetime.utcnow)
     owner: UserShortSchema
@@ -48,21 +48,33 @@ class PostBase(PostBaseShort):
 
     pictures_urls: List[str]
 
-class PostLiteSchema(PostBase):
+class PostCountersSchema(BaseModel):
+    likes: int = 0
+    views: int = 0
+    replies: int = 0
+
+class PostLiteSchema(PostBase, PostCountersSchema):
     parent_post: PostBase | None
 
 # TODO: Separate urls field to diferent models
-class PostSchema(PostBase):
+class PostSchema(PostBase, PostCountersSchema):
     text: str
 
-    likes: int = 0
-    views: int = 0
-
     last_updated: datetime
 
     parent_post: PostBase | None
 
 
+class PostsCursorPage(BaseModel):
+    """Send `next_cursor` back to get next page. None - no more posts"""
+    posts: List[PostLiteSchema]
+    next_cursor: str | None = None
+
+class RepliesCursorPage(BaseModel):
+    replies: List[PostBase]
+    next_cursor: str | None = None
+
+
 # =====================
 
 class UserShortSchema(UserIDValidate):
@@ -83,6 +95,14 @@ class UserSchema(UserLiteSchema):
     followed: List[UserShortSchema]
     avatar_url: str | None
 
+class UserSearchSchema(UserShortSchema):
+    """Search result. Only followers count - lists are loaded with profile"""
+    followers_count: int
+
+class UsersCursorPage(BaseModel):
+    users: List[UserSearchSchema]
+    next_cursor: str | None = None
+
 # =================
 # Body data structure
 class PostDataSchemaBase(BaseModel):
@@ -11,7 +11,8 @@ from pydantic_schemas.pydantic_schemas_auth import (
     AccesTokenSchema,
     RefreshAccesTokensProvided,
     OldNewPassword,
-    NewUsername
+    NewUsername,
+    AuthorizedUser
 )
 from pydantic_schemas.pydantic_schemas_social import UserSchema
 
@@ -63,10 +64,9 @@ async def refresh_token(
 @endpoint_exception_handler
 async def change_password(
     credentials: OldNewPassword = Body(...),
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
 ) -> UserSchema:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainServiceAuth].create(postgres_session=session, MainServiceType=MainServiceAuth) as auth:
         await auth.change_password(user=user, credentials=credentials)
 
@@ -74,10 +74,9 @@ async def change_password(
 @endpoint_exception_handler
 async def change_username(
     credentials: NewUsername = Body(...),
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
 ) -> UserSchema:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainServiceAuth].create(postgres_session=session, MainServiceType=MainServiceAuth) as auth:
         await auth.change_username(user=user, credentials=credentials)
  
@@ -85,9 +84,8 @@ async def change_username(
 @endpoint_exception_handler
 async def delete_profile(
     password: str = Header(...),
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
 ) -> None:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainServiceAuth].create(postgres_session=session, MainServiceType=MainServiceAuth) as auth:
         await auth.delete_user(password=password, user=user)
\ No newline at end of file
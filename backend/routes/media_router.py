@@ -1,41 +1,84 @@
-from fastapi import APIRouter, Depends, UploadFile, File
-from fastapi.responses import Response
+from fastapi import APIRouter, Depends, UploadFile, File, Request
+from fastapi.responses import Response, FileResponse
+from email.utils import parsedate_to_datetime
+from dotenv import load_dotenv
+from os import getenv
 
 from authorization.authorization_utils import authorize_request_depends
 from services.postgres_service.models import User
+from pydantic_schemas.pydantic_schemas_auth import AuthorizedUser
 from services.postgres_service.database_utils import *
 from sqlalchemy.ext.asyncio import AsyncSession
 from services.core_services import MainServiceContextManager
-from services.core_services.main_services.main_media_service import MainMediaService
+from services.core_services.main_services.main_media_service import MainMediaService, MediaFile
 
 from exceptions.exceptions_handler import endpoint_exception_handler
 
+load_dotenv()
+# Image behind URL token never changes. Token itself expires, so client re-requests with new URL anyway
+MEDIA_CACHE_CONTROL = getenv("MEDIA_CACHE_CONTROL", "private, max-age=86400, immutable")
+
 media_router = APIRouter()
 
 """
 This router is only for case when the application use Local image storage.
 """
 
-# https://stackoverflow.com/questions/55873174/how-do-i-return-an-image-in-fastapi
+def _is_not_modified(response_headers, request_headers) -> bool:
+    """Conditional GET. `If-None-Match` wins over `If-Modified-Since` (RFC 9110)"""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match:
+        etag = response_headers["etag"]
+        return if_none_match.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(response_headers["last-modified"]) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+def _media_file_response(media_file: MediaFile, request: Request) -> Response:
+    """
+    Streams file from disk in chunks (or sendfile, if server supports it) - it's never loaded into memory. \n
+    `Range` requests get 206 from FileResponse itself. Matching validators get bodiless 304.
+    """
+    response = FileResponse(
+        path=media_file.filepath,
+        media_type=media_file.content_type,
+        stat_result=media_file.stat,
+        headers={"Cache-Control": MEDIA_CACHE_CONTROL},
+    )
+
+    if _is_not_modified(response_headers=response.headers, request_headers=request.headers):
+        headers = {key: response.headers[key] for key in ("etag", "last-modified", "cache-control")}
+        return Response(status_code=304, headers=headers)
+
+    return response
+
 @media_router.get("/media/users/{token}", response_class=Response)
 @endpoint_exception_handler
 async def get_image_user(
     token: str,
+    request: Request,
     session: AsyncSession = Depends(get_session_depends)
-) -> str:
+) -> Response:
     async with await MainServiceContextManager[MainMediaService].create(MainServiceType=MainMediaService, postgres_session=session) as media:  
-        file_contents, mime_type = await media.get_user_avatar_by_token(token=token)
-        return Response(content=file_contents, media_type=mime_type)
+        media_file = await media.get_user_avatar_by_token(token=token)
+        return _media_file_response(media_file=media_file, request=request)
 
 @media_router.get("/media/posts/{token}", response_class=Response)
 @endpoint_exception_handler
 async def get_image_post(
     token: str,
+    request: Request,
     session: AsyncSession = Depends(get_session_depends)
-) -> str:
+) -> Response:
     async with await MainServiceContextManager[MainMediaService].create(MainServiceType=MainMediaService, postgres_session=session) as media:  
-        file_contents, mime_type = await media.get_post_image_by_token(token=token)
-        return Response(content=file_contents, media_type=mime_type)
+        media_file = await media.get_post_image_by_token(token=token)
+        return _media_file_response(media_file=media_file, request=request)
 
 # TODO: Implement file passing.
 @media_router.post("/media/posts/{post_id}")
@@ -43,10 +86,9 @@ async def get_image_post(
 async def upload_post_picture(
     post_id: str,
     file_: UploadFile = File(...),
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
 ) -> None:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainMediaService].create(MainServiceType=MainMediaService, postgres_session=session) as media:
         file_contents = await file_.read()
         await media.upload_post_image(post_id=post_id, user=user, image_contents=file_contents, specified_mime=file_.content_type)
@@ -56,10 +98,9 @@ async def upload_post_picture(
 # @endpoint_exception_handler
 async def upload_user_avatar(
     file: UploadFile = File(...),
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
 ) -> None:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainMediaService].create(MainServiceType=MainMediaService, postgres_session=session) as media:
         file_contents = await file.read()
         await media.upload_user_avatar(user=user, image_contents=file_contents, specified_mime=file.content_type)
\ No newline at end of file
@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, Header
+from typing import Dict
+from dotenv import load_dotenv
+from os import getenv
+import secrets
+
+from services.postgres_service import get_pool_statistics
+from services.redis_service import get_redis_pool_statistics
+from authorization.token_cache import AccesTokenCache
+from services.image_storage_service import PresignedURLCache, get_image_processing_statistics
+from authorization.password_utils import get_password_hashing_statistics
+from post_popularity_rate_task.popularity_rate import last_tick_statistics
+from post_popularity_rate_task.post_counters import last_reconcile_statistics
+from post_popularity_rate_task.feed_precompute import last_precompute_statistics
+from exceptions.custom_exceptions import NotFoundExc, UnauthorizedExc
+from exceptions.exceptions_handler import endpoint_exception_handler
+
+load_dotenv()
+METRICS_ENABLED = getenv("METRICS_ENABLED", "False").lower().strip() == "true"
+METRICS_TOKEN = getenv("METRICS_TOKEN", "")
+
+metrics = APIRouter()
+
+"""
+Internal runtime statistics. Connection pools, caches, queues.
+Pool sizes and queue depths help to plan load attacks - endpoint is off by default and can require a token.
+"""
+
+@endpoint_exception_handler
+async def metrics_access_depends(token: str | None = Header(default=None, alias="X-Metrics-Token")) -> None:
+    if not METRICS_ENABLED:
+        raise NotFoundExc(dev_log_detail="MetricsRouter: /metrics requested, but METRICS_ENABLED is off.", client_safe_detail="Not Found")
+    if METRICS_TOKEN and not secrets.compare_digest((token or "").encode(), METRICS_TOKEN.encode()):
+        raise UnauthorizedExc(dev_log_detail="MetricsRouter: /metrics requested with missing or wrong X-Metrics-Token.", client_safe_detail="Invalid or missing metrics token")
+
+@metrics.get("/metrics", dependencies=[Depends(metrics_access_depends)])
+async def get_metrics() -> Dict[str, Dict]:
+    return {
+        "postgres_pool": get_pool_statistics(),
+        "redis_pools": get_redis_pool_statistics(),
+        "acces_token_cache": AccesTokenCache().get_statistics(),
+        "presigned_url_cache": PresignedURLCache().get_statistics(),
+        "password_hashing": get_password_hashing_statistics(),
+        "image_processing": get_image_processing_statistics(),
+        "popularity_recompute": last_tick_statistics,
+        "post_counters_reconcile": last_reconcile_statistics,
+        "feed_precompute": last_precompute_statistics,
+    }
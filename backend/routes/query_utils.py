@@ -7,6 +7,7 @@ from exceptions.custom_exceptions import BadRequestExc
 
 load_dotenv()
 QUERY_PARAM_MAX_L = int(getenv("QUERY_PARAM_MAX_L"))
+CURSOR_MAX_L = int(getenv("CURSOR_MAX_L", "512"))
 
 
 def query_prompt_required(prompt: str = Query(..., max_length=QUERY_PARAM_MAX_L)):
@@ -18,4 +19,11 @@ def query_prompt_required(prompt: str = Query(..., max_length=QUERY_PARAM_MAX_L)
 def page_validator(page: int):
     if not page >= 0:
         raise BadRequestExc(dev_log_detail=f"PageValidator (query_utils): Received page value that is less or equal than 0.", client_safe_detail=f"Invalid page value")
-    return int(page)
\ No newline at end of file
+    return int(page)
+
+
+def cursor_validator(cursor: str | None = Query(default=None, max_length=CURSOR_MAX_L)) -> str | None:
+    """Opaque pagination cursor from previous page `next_cursor`. None - first page"""
+    if cursor is not None and not cursor.strip():
+        raise BadRequestExc(dev_log_detail=f"CursorValidator (query_utils): Received empty cursor.", client_safe_detail=f"Invalid cursor value")
+    return cursor
@@ -3,13 +3,16 @@ from fastapi import APIRouter, Depends, Body, Query, HTTPException
 from posthog import page
 from services.postgres_service.database_utils import *
 from services.postgres_service.models import User
+from pydantic_schemas.pydantic_schemas_auth import AuthorizedUser
 from services.core_services import MainServiceContextManager
 from services.core_services.main_services.main_social_service import MainServiceSocial
 from authorization.authorization_utils import authorize_request_depends
 from pydantic_schemas.pydantic_schemas_social import (
-    UserLiteSchema,
+    UsersCursorPage,
     PostBase,
     PostLiteSchema,
+    PostsCursorPage,
+    RepliesCursorPage,
     PostSchema,
     MakePostDataSchema,
     PostDataSchemaBase,
@@ -24,7 +27,7 @@ from os import getenv
 
 from exceptions.exceptions_handler import endpoint_exception_handler
 
-from .query_utils import page_validator, query_prompt_required
+from .query_utils import page_validator, cursor_validator, query_prompt_required
 
 social = APIRouter()
 
@@ -32,60 +35,55 @@ load_dotenv()
 QUERY_PARAM_MAX_L = int(getenv("QUERY_PARAM_MAX_L"))
 
 
-@social.get("/posts/feed/{page}")
+@social.get("/posts/feed")
 @endpoint_exception_handler
 async def get_feed(
-    page: int = Depends(page_validator),
-    user_: User = Depends(authorize_request_depends),
+    cursor: str | None = Depends(cursor_validator),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends),
-    ) -> List[PostLiteSchema]:
-    user = await merge_model(postgres_session=session, model_obj=user_)
+    ) -> PostsCursorPage:
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
-        return await social.get_feed(user=user, page=page)
+        return await social.get_feed(user=user, cursor=cursor)
 
 @social.get("/posts/following")
 @endpoint_exception_handler
 async def get_followed_posts(
-    page: int = Depends(page_validator),
-    user_: User = Depends(authorize_request_depends),
+    cursor: str | None = Depends(cursor_validator),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
-    ) -> List[PostLiteSchema]:
-    user = await merge_model(postgres_session=session, model_obj=user_)
+    ) -> PostsCursorPage:
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
-        return await social.get_followed_posts(user=user, page=page)
+        return await social.get_followed_posts(user=user, cursor=cursor)
 
 @social.get("/search/posts")
 # @endpoint_exception_handler
 async def search_posts(
     page: int = Depends(page_validator),
     prompt: str = Depends(query_prompt_required),
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
     ) -> List[PostLiteSchema]:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
         return await social.search_posts(prompt=prompt, user=user, page=page)
 
-@social.get("/search/users/{page}")
-# @endpoint_exception_handler
+@social.get("/search/users")
+@endpoint_exception_handler
 async def search_users(
     prompt: str = Depends(query_prompt_required),
-    page: str = Depends(page_validator),
-    user_: User = Depends(authorize_request_depends),
-    session = Depends(get_session_depends)
-    ) -> List[UserLiteSchema]:
-    user = await merge_model(postgres_session=session, model_obj=user_)
+    cursor: str | None = Depends(cursor_validator),
+    user: AuthorizedUser = Depends(authorize_request_depends),
+    session: AsyncSession = Depends(get_session_depends)
+    ) -> UsersCursorPage:
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
-        return await social.search_users(prompt=prompt, request_user=user, page=page)
+        return await social.search_users(prompt=prompt, request_user=user, cursor=cursor)
 
 @social.post("/posts")
 @endpoint_exception_handler
 async def make_post(
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends),
     post_data: MakePostDataSchema = Body(...)
     ) -> None:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
         await social.make_post(data=post_data, user=user)
 
@@ -93,10 +91,9 @@ async def make_post(
 @endpoint_exception_handler
 async def load_post(
     post_id: str,
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
 ) -> PostSchema:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
         return await social.load_post(user=user, post_id=post_id)
 
@@ -104,23 +101,21 @@ async def load_post(
 @endpoint_exception_handler
 async def load_comments(
     post_id: str,
-    page: int = Depends(page_validator),
-    user_: User = Depends(authorize_request_depends),
+    cursor: str | None = Depends(cursor_validator),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
-) -> List[PostBase]:
-    user = await merge_model(postgres_session=session, model_obj=user_)
+) -> RepliesCursorPage:
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
-        return await social.load_replies(post_id=post_id, user_id=user.user_id, page=page)
+        return await social.load_replies(post_id=post_id, user=user, cursor=cursor)
 
 @social.patch("/posts/{post_id}")
 @endpoint_exception_handler
 async def change_post(
     post_id: str,
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends),
     post_data: PostDataSchemaBase = Body(...),
 ) -> PostSchema:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
         return await social.change_post(post_data=post_data, user=user, post_id=post_id)
 
@@ -128,10 +123,9 @@ async def change_post(
 @endpoint_exception_handler
 async def delete_post(
     post_id: str,
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends),
 ) -> None:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
         print(post_id)
         await social.delete_post(post_id=post_id, user=user)
@@ -140,10 +134,9 @@ async def delete_post(
 @endpoint_exception_handler
 async def like_post(
     post_id: str | None,
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
 ):
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
         await social.like_post_action(post_id=post_id, user=user, like=True)
 
@@ -151,10 +144,9 @@ async def like_post(
 @endpoint_exception_handler
 async def unlike_post(
     post_id: str,
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
 ) -> None:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
         await social.like_post_action(post_id=post_id, user=user, like=False)
 
@@ -162,10 +154,9 @@ async def unlike_post(
 @endpoint_exception_handler
 async def follow(
     follow_to_id: str,
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends),
 ) -> None:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
         await social.friendship_action(user=user, other_user_id=follow_to_id, follow=True)
 
@@ -173,20 +164,18 @@ async def follow(
 @endpoint_exception_handler
 async def unfollow(
     unfollow_from_id: str,
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends),
 ) -> None:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
         await social.friendship_action(user=user, other_user_id=unfollow_from_id, follow=False)
 
 @social.get("/users/my-profile")
 @endpoint_exception_handler
 async def get_my_profile(
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends),
     ) -> UserSchema:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
         return await social.get_my_profile(user=user)
 
@@ -194,20 +183,19 @@ async def get_my_profile(
 @endpoint_exception_handler
 async def get_user_profile(
     user_id: str | None,
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends),
     )-> UserSchema:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
         return await social.get_user_profile(user_id=user.user_id, other_user_id=user_id)
     
-@social.get("/users/{user_id}/posts/{page}")
+@social.get("/users/{user_id}/posts")
 @endpoint_exception_handler
 async def get_users_posts(
     user_id: str,
-    page: int = Depends(page_validator),
-    user_: User = Depends(authorize_request_depends),
+    cursor: str | None = Depends(cursor_validator),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
-) -> List[PostLiteSchema]:
+) -> PostsCursorPage:
     async with await MainServiceContextManager[MainServiceSocial].create(postgres_session=session, MainServiceType=MainServiceSocial) as social:
-        return await social.get_user_posts(user_id, page)
\ No newline at end of file
+        return await social.get_users_posts(user_id=user_id, request_user=user, cursor=cursor)
\ No newline at end of file
@@ -1 +1 @@
-from .service import ChromaService
\ No newline at end of file
+from .service import ChromaService, ChromaConnection
\ No newline at end of file
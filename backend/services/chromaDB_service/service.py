@@ -1,10 +1,13 @@
 from chromadb import AsyncHttpClient, Collection
 from chromadb.api.async_api import AsyncClientAPI
-from chromadb.errors import ChromaError
+from chromadb.errors import ChromaError, NotFoundError
 from dotenv import load_dotenv
 from os import getenv
-from typing import List
+from typing import List, Dict, Callable, Awaitable, TypeVar
 from functools import wraps
+import asyncio
+import httpx
+import time
 from services.postgres_service import Post, User
 from fastapi import HTTPException
 from exceptions.custom_exceptions import EmptyPostsError, ChromaDBError
@@ -22,6 +25,13 @@ HISTORY_POSTS_TO_TAKE_INTO_RELATED = int(getenv("HISTORY_POSTS_TO_TAKE_INTO_RELA
 
 GET_EXTRA_CHROMADB_RELATED_RESULTS = int(getenv("GET_EXTRA_CHROMADB_RELATED_RESULTS"))
 
+CHROMADB_HEALTH_CHECK_INTERVAL_SECONDS = int(getenv("CHROMADB_HEALTH_CHECK_INTERVAL_SECONDS", "30"))
+
+# Errors after which client or collection handle considered stale
+RECONNECT_ON_ERRORS = (httpx.TransportError, ConnectionError, NotFoundError)
+
+T = TypeVar("T")
+
 
 def chromaDB_error_handler(func):
     @wraps(func)
@@ -36,54 +46,125 @@ def chromaDB_error_handler(func):
             raise ChromaDBError(f"Uknown exception occured: {e}") from e
     return wrapper
 
-class ChromaService:
-    @staticmethod
-    def extract_ids_from_metadata(metadatas, page: int, pagination: int) -> List[str]:
-        # TODO: !!!!!!!
-        all_ids = [str(meta["post_id"]) for batch in metadatas["metadatas"] for meta in batch]
-        return all_ids[pagination*page:(pagination*page)+pagination]
-        
-    def __init__(self, client: AsyncClientAPI, collection: Collection, mode: str):
-        """To create class object. Use **async** method connect!"""
-        self.__collection: Collection = collection
-        self.__client: AsyncClientAPI = client
-        self._datetime_format = getenv('DATETIME_BASE_FORMAT')
-        self.__mode = mode
+class ChromaConnection:
+    """
+    App-lifetime ChromaDB client and cached collection handle. One per mode. \n
+    Checks server heartbeat not more often than `CHROMADB_HEALTH_CHECK_INTERVAL_SECONDS` and reconnects transparently. \n
+    Use `ChromaConnection.get(mode)` to get shared instance.
+    """
+
+    _connections: Dict[str, "ChromaConnection"] = {}
 
     @classmethod
-    @chromaDB_error_handler
-    async def connect(cls, mode: str = "prod") -> "ChromaService":
+    def get(cls, mode: str = "prod") -> "ChromaConnection":
         if not mode in ("prod", "test"):
             raise ValueError("Invalid chromaDB database mode")
-        
+
+        if mode not in cls._connections:
+            cls._connections[mode] = cls(mode=mode)
+        return cls._connections[mode]
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.collection_name = PROD_COLLECTION_NAME if mode == "prod" else TEST_COLLECTION_NAME
+
+        self._client: AsyncClientAPI | None = None
+        self._collection: Collection | None = None
+        self._last_health_check = 0.0
+        self._lock = asyncio.Lock()
+
+        # Test collection gets dropped only once, on first connection
+        self._first_connection = True
+
+    async def _connect(self) -> None:
         try:
             client = await AsyncHttpClient(port=PORT, host=CHROMADB_HOST)
         except ChromaError:
             raise HTTPException(status_code=500, detail="Connection to chromaDB failed")
 
-        if mode == "prod":
-            collection = await client.get_or_create_collection(name=PROD_COLLECTION_NAME)
-        elif mode == "test":
+        if self.mode == "test" and self._first_connection:
             # In case if test-collection exists. Dropping it
             try:
-                await client.delete_collection(name=TEST_COLLECTION_NAME)
+                await client.delete_collection(name=self.collection_name)
             except Exception:
                 pass
-            
-            collection = await client.get_or_create_collection(name=TEST_COLLECTION_NAME)
 
-        return cls(client=client, collection=collection, mode=mode)
+        self._collection = await client.get_or_create_collection(name=self.collection_name)
+        self._client = client
+        self._first_connection = False
+        self._last_health_check = time.monotonic()
+
+    async def _is_healthy(self) -> bool:
+        try:
+            await self._client.heartbeat()
+            return True
+        except Exception:
+            return False
+
+    async def reconnect(self) -> None:
+        async with self._lock:
+            self._client = None
+            self._collection = None
+            await self._connect()
+
+    async def get_client(self) -> AsyncClientAPI:
+        await self.get_collection()
+        return self._client
+
+    async def get_collection(self) -> Collection:
+        """Returns cached collection handle. Connects on first call and reconnects if heartbeat failed"""
+        if self._collection is not None and time.monotonic() - self._last_health_check < CHROMADB_HEALTH_CHECK_INTERVAL_SECONDS:
+            return self._collection
+
+        async with self._lock:
+            if self._collection is None:
+                await self._connect()
+            elif time.monotonic() - self._last_health_check >= CHROMADB_HEALTH_CHECK_INTERVAL_SECONDS:
+                if await self._is_healthy(): self._last_health_check = time.monotonic()
+                else: await self._connect()
+        return self._collection
+
+    def set_collection(self, collection: Collection) -> None:
+        self._collection = collection
+
+    async def execute(self, operation: Callable[[Collection], Awaitable[T]]) -> T:
+        """Runs operation on collection. If connection or collection handle turned out stale - reconnects and retries once"""
+        collection = await self.get_collection()
+        try:
+            return await operation(collection)
+        except RECONNECT_ON_ERRORS:
+            await self.reconnect()
+            return await operation(self._collection)
+
+
+class ChromaService:
+    @staticmethod
+    def extract_ids_from_metadata(metadatas, page: int, pagination: int) -> List[str]:
+        # TODO: !!!!!!!
+        all_ids = [str(meta["post_id"]) for batch in metadatas["metadatas"] for meta in batch]
+        return all_ids[pagination*page:(pagination*page)+pagination]
+        
+    def __init__(self, connection: ChromaConnection):
+        """Cheap view over shared ChromaConnection. To create class object - use **async** method connect!"""
+        self.__connection = connection
+        self._datetime_format = getenv('DATETIME_BASE_FORMAT')
+
+    @classmethod
+    @chromaDB_error_handler
+    async def connect(cls, mode: str = "prod") -> "ChromaService":
+        """Connects shared client only first time. Next calls reuse it"""
+        connection = ChromaConnection.get(mode=mode)
+        await connection.get_collection()
+        return cls(connection=connection)
 
     @chromaDB_error_handler
     async def drop_all(self):
         """Drops all embeddings."""
-        
-        if self.__mode == "prod":
-            await self.__client.delete_collection(name=PROD_COLLECTION_NAME)
-            self.__collection = await self.__client.create_collection(name=PROD_COLLECTION_NAME)
-        elif self.__mode == "test":
-            await self.__client.delete_collection(name=TEST_COLLECTION_NAME)
-            self.__collection = await self.__client.create_collection(name=TEST_COLLECTION_NAME)
+        client = await self.__connection.get_client()
+        collection_name = self.__connection.collection_name
+
+        await client.delete_collection(name=collection_name)
+        self.__connection.set_collection(await client.create_collection(name=collection_name))
         
 
     @chromaDB_error_handler
@@ -93,9 +174,11 @@ class ChromaService:
         if not post_relation:
             return []
         
-        related_posts_metadatas = await self.__collection.query(
-            query_texts=[f"{post.title} {post.text} {post.published.strftime(self._datetime_format)}" for post in post_relation],
-            n_results=((pagination * page) + pagination + GET_EXTRA_CHROMADB_RELATED_RESULTS),
+        related_posts_metadatas = await self.__connection.execute(
+            lambda collection: collection.query(
+                query_texts=[f"{post.title} {post.text} {post.published.strftime(self._datetime_format)}" for post in post_relation],
+                n_results=((pagination * page) + pagination + GET_EXTRA_CHROMADB_RELATED_RESULTS),
+            )
         )
 
         return self.extract_ids_from_metadata(metadatas=related_posts_metadatas, page=page, pagination=pagination)
@@ -113,22 +196,28 @@ class ChromaService:
             raise EmptyPostsError("Posts list empty. Nothing to sync")
 
         # Adding only field that CAN'T be nullable to prevent crash
-        await self.__collection.upsert(
-            ids=[str(post.post_id) for post in filtered_posts],
-            documents=[f"{post.title} {post.text} {post.published.strftime(self._datetime_format)}" for post in filtered_posts],
-            metadatas=[{"post_id": str(post.post_id), "published": int(post.published.timestamp()), "user_id": str(post.owner_id)} for post in filtered_posts]
+        await self.__connection.execute(
+            lambda collection: collection.upsert(
+                ids=[str(post.post_id) for post in filtered_posts],
+                documents=[f"{post.title} {post.text} {post.published.strftime(self._datetime_format)}" for post in filtered_posts],
+                metadatas=[{"post_id": str(post.post_id), "published": int(post.published.timestamp()), "user_id": str(post.owner_id)} for post in filtered_posts]
+            )
         )
 
     # @chromaDB_error_handler
     async def search_posts_by_prompt(self, prompt: str, page: int, n: int) -> List[str]:
-        search_result = await self.__collection.query(
-            query_texts=[prompt.strip()],
-            n_results=((n * page) + n + GET_EXTRA_CHROMADB_RELATED_RESULTS)
+        search_result = await self.__connection.execute(
+            lambda collection: collection.query(
+                query_texts=[prompt.strip()],
+                n_results=((n * page) + n + GET_EXTRA_CHROMADB_RELATED_RESULTS)
+            )
         )
         return self.extract_ids_from_metadata(metadatas=search_result, page=page, pagination=n)
     
     @chromaDB_error_handler
     async def delete_by_ids(self, ids: List[str]):
-        await self.__collection.delete(
-            ids=ids
-        )
\ No newline at end of file
+        await self.__connection.execute(
+            lambda collection: collection.delete(
+                ids=ids
+            )
+        )
@@ -1,4 +1,5 @@
 from .core_services import MainServiceContextManager, MainServiceBase
+from .backends_registry import BackendsRegistry
 
 from .main_services.main_auth_service import *
 from .main_services.main_media_service import *
@@ -0,0 +1,106 @@
+from services.redis_service import RedisService
+from services.chromaDB_service import ChromaService
+from services.image_storage_service import ImageStorageABC, S3Storage, LocalStorage, open_s3_client, close_s3_client, PRESIGNED_URL_CACHE_USE_REDIS
+
+from typing import Dict, Literal, Any
+from dotenv import load_dotenv
+from os import getenv
+import asyncio
+
+load_dotenv()
+USE_S3_BOOL_STRING = getenv("USE_S3", "True")
+
+Mode = Literal["prod", "test"]
+
+
+class BackendsRegistry:
+    """
+    App-scoped registry of backend clients (Redis, ChromaDB, image storage) \n
+    Each client gets created only on first request and then reused by all MainService instances. \n
+    Call async method `open()` on app startup and `close()` on app shutdown.
+    """
+
+    _instance = None
+    _isinitialized = False
+
+    def __new__(cls):
+        if not cls._instance:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if self._isinitialized:
+            return
+        self._isinitialized = True
+
+        self._redis: Dict[Mode, RedisService] = {}
+        self._chroma: Dict[Mode, ChromaService] = {}
+        self._storage: Dict[Mode, ImageStorageABC] = {}
+
+        self._chroma_lock = asyncio.Lock()
+
+    @staticmethod
+    def _use_s3() -> bool:
+        prepared_env_use_s3 = USE_S3_BOOL_STRING.lower().strip()
+
+        if prepared_env_use_s3 == "true": return True
+        elif prepared_env_use_s3 == "false": return False
+        else: raise ValueError("Invalid USE_S3 dotenv variable value. Read comment #")
+
+    async def open(self) -> None:
+        """Opens clients that are too costly to create on first request. Call on app startup"""
+        if self._use_s3():
+            await open_s3_client()
+
+    def get_redis(self, mode: Mode = "prod") -> RedisService:
+        if mode not in self._redis:
+            self._redis[mode] = RedisService(db_pool=mode)
+        return self._redis[mode]
+
+    async def get_chroma(self, mode: Mode = "prod") -> ChromaService:
+        """ChromaDB client requires await to connect. So only this getter is async"""
+        if mode in self._chroma:
+            return self._chroma[mode]
+
+        async with self._chroma_lock:
+            # Other coroutine could connect while we were waiting for the lock
+            if mode not in self._chroma:
+                self._chroma[mode] = await ChromaService.connect(mode=mode)
+        return self._chroma[mode]
+
+    def get_image_storage(self, mode: Mode = "prod") -> ImageStorageABC:
+        if mode in self._storage:
+            return self._storage[mode]
+
+        if self._use_s3(): Storage = S3Storage(mode=mode, Redis=self.get_redis(mode=mode) if PRESIGNED_URL_CACHE_USE_REDIS else None)
+        else: Storage = LocalStorage(mode=mode, Redis=self.get_redis(mode=mode))
+
+        self._storage[mode] = Storage
+        return Storage
+
+    async def close(self) -> None:
+        """Closes all created clients. Call on app shutdown"""
+        for redis in self._redis.values():
+            await redis.finish()
+        await close_s3_client()
+
+        self._redis.clear()
+        self._chroma.clear()
+        self._storage.clear()
+
+
+class LazyChromaService:
+    """
+    Stand-in for ChromaService. Connects to ChromaDB through registry only when any method gets awaited first time. \n
+    Services that never touch ChromaDB never pay for connection.
+    """
+
+    def __init__(self, registry: BackendsRegistry, mode: Mode):
+        self._registry = registry
+        self._mode = mode
+
+    def __getattr__(self, name: str) -> Any:
+        async def method(*args, **kwargs):
+            chroma = await self._registry.get_chroma(mode=self._mode)
+            return await getattr(chroma, name)(*args, **kwargs)
+        return method
@@ -7,9 +7,10 @@ from authorization import jwt_service
 from services.image_storage_service import ImageStorageABC
 
 from abc import ABC, abstractmethod
-from typing import Type, Literal
+from typing import Awaitable, Callable, List, Type, Literal
 from dotenv import load_dotenv
 from os import getenv
+import logging
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import TypeVar, Generic
@@ -18,12 +19,11 @@ from typing import TypeVar, Generic
 ServiceType = TypeVar("Services", bound="MainServiceBase")
 
 load_dotenv()
-USE_S3_BOOL_STRING = getenv("USE_S3", "True")
 
 class MainServiceABC(ABC):
     @classmethod
     @abstractmethod
-    async def create(cls, postgres_session: AsyncSession, mode: str = "prod") -> "MainServiceABC":
+    async def create(cls, postgres_session: AsyncSession, mode: str = "prod", registry: "BackendsRegistry | None" = None) -> "MainServiceABC":
         """
         Async method that creates class object
         Choose mode - "prod"/"test"
@@ -62,46 +62,73 @@ async def create():
 from services.redis_service import RedisService
 from services.chromaDB_service import ChromaService
 from services.postgres_service import PostgresService
+from .backends_registry import BackendsRegistry, LazyChromaService
 
 class MainServiceBase(MainServiceABC):
 
 
     """
-    To create obj - use async method `initialize()` *Reason - chromaDB async client requires await. But `__init__` can't be async* \n
+    To create obj - use async method `create()` \n
     Requires created SQLalchemy AsyncSession \n
     Select mode - `"prod"` | `"test"` \n
+    Redis, ChromaDB and image storage are taken from app-scoped `BackendsRegistry` lazily - only when service method touches them first time \n
     After you finish your work with service - AlWAYS call async method finish to commit and close all connections \n
     Take into account that SQLalchemy AsyncSession requires outer close handling - THIS CLASS DOESN'T CLOSE SQLalhemy AsyncSession.
     """
 
-    def __init__(self, Chroma: ChromaService, Redis: RedisService, Postgres: PostgresService, ImageStorage: ImageStorageABC):
+    def __init__(self, Postgres: PostgresService, registry: BackendsRegistry, mode: Literal["prod", "test"] = "prod"):
         self._PostgresService = Postgres
-        self._RedisService = Redis
-        self._ChromaService = Chroma
-        self._ImageStorage = ImageStorage
+        self._registry = registry
+        self._mode = mode
+
+        self._chroma_service = LazyChromaService(registry=registry, mode=mode)
 
         self._JWT = jwt_service.JWTService
 
+        self._after_commit_callbacks: List[Callable[[], Awaitable[None]]] = []
+
+    @property
+    def _RedisService(self) -> RedisService:
+        return self._registry.get_redis(mode=self._mode)
+
+    @property
+    def _ChromaService(self) -> ChromaService:
+        return self._chroma_service
+
+    @property
+    def _ImageStorage(self) -> ImageStorageABC:
+        return self._registry.get_image_storage(mode=self._mode)
+
     @classmethod
-    async def create(cls, postgres_session: AsyncSession, mode: Literal["prod", "test"] = "prod") -> "MainServiceABC":
-        """Postgres AsyncSession needs to be closed manualy!"""
+    async def create(cls, postgres_session: AsyncSession, mode: Literal["prod", "test"] = "prod", registry: BackendsRegistry | None = None) -> "MainServiceABC":
+        """Postgres AsyncSession needs to be closed manualy! If `registry` not provided - app-scoped one is used"""
         Postgres = PostgresService(postgres_session=postgres_session)
-        Redis = RedisService(db_pool=mode)
-        ChromaDB = await ChromaService.connect(mode=mode)
+        return cls(Postgres=Postgres, registry=registry or BackendsRegistry(), mode=mode)
     
-        prepared_env_use_s3 = USE_S3_BOOL_STRING.lower().strip()
+    def _after_commit(self, callback: Callable[[], Awaitable[None]]) -> None:
+        """
+        `callback` runs in `finish()` after postgres commit, dropped on rollback. \n
+        For side effects that must not point at rows before they exist - Redis timelines, caches. Don't pass ORM models into it - commit expires them
+        """
+        self._after_commit_callbacks.append(callback)
+
+    async def _run_after_commit_callbacks(self) -> None:
+        # Data is already committed. Failed side effect is logged, request still succeeds
+        for callback in self._after_commit_callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                logging.log(level=logging.WARNING, msg=f"MainService: After commit callback failed. {e!r}")
+        self._after_commit_callbacks.clear()
 
-        if prepared_env_use_s3 == "true": Storage = S3Storage(mode=mode)
-        elif prepared_env_use_s3 == "false": Storage = LocalStorage(mode=mode, Redis=Redis)
-        else: raise ValueError("Invalid USE_S3 dotenv variable value. Read comment #")
-        
-        return cls(Chroma=ChromaDB, Redis=Redis, Postgres=Postgres, ImageStorage=Storage)
-    
     async def finish(self, commit_postgres: bool = True) -> None:
-        # If i'm not mistaken, chromaDB doesn't require connection close
-        await self._RedisService.finish()
-        if commit_postgres: await self._PostgresService.commit_changes()
-        else: await self._PostgresService.rollback()
+        # Registry clients are app-scoped. They get closed on app shutdown, not here
+        if commit_postgres:
+            await self._PostgresService.commit_changes()
+            await self._run_after_commit_callbacks()
+        else:
+            await self._PostgresService.rollback()
+            self._after_commit_callbacks.clear()
         await self._PostgresService.close()
 
     
@@ -116,8 +143,8 @@ class MainServiceContextManager(Generic[ServiceType], MainServiceContextManagerA
         self.main_service = main_service
 
     @classmethod
-    async def create(cls, MainServiceType: Type[ServiceType], postgres_session: AsyncSession, mode: str = "prod") -> "MainServiceContextManager[ServiceType]":
-        main_service = await MainServiceType.create(postgres_session=postgres_session, mode=mode)
+    async def create(cls, MainServiceType: Type[ServiceType], postgres_session: AsyncSession, mode: str = "prod", registry: BackendsRegistry | None = None) -> "MainServiceContextManager[ServiceType]":
+        main_service = await MainServiceType.create(postgres_session=postgres_session, mode=mode, registry=registry)
         return cls(main_service=main_service)
     
     async def __aenter__(self) -> ServiceType:
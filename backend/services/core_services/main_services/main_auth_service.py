@@ -1,7 +1,9 @@
 from authorization import jwt_service
 from services.core_services import MainServiceBase
 from services.postgres_service import Post, User
+from services.image_storage_service import ImageRef
 from authorization import password_utils
+from authorization.token_cache import AccesTokenCache, hash_token
 from pydantic_schemas.pydantic_schemas_auth import (
     RegisterSchema,
     RefreshTokenSchema,
@@ -9,7 +11,8 @@ from pydantic_schemas.pydantic_schemas_auth import (
     LoginSchema,
     RefreshAccesTokens,
     OldNewPassword,
-    NewUsername
+    NewUsername,
+    AuthorizedUser
 )
 
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -24,21 +27,43 @@ from exceptions.custom_exceptions import *
 POST_IMAGE_MAX_SIZE_MB = int(os.getenv("POST_IMAGE_MAX_SIZE_MB", "25"))
 
 class MainServiceAuth(MainServiceBase):
+    def _revoke_cached_tokens(self, acces_token: str | None = None, user_id: str | None = None) -> None:
+        """
+        Drops principal from local token cache and notifies other workers through Redis - after commit. \n
+        Before it, cache miss on any worker would read not yet changed user row and cache old principal again
+        """
+        token_hash = hash_token(acces_token) if acces_token else None
+
+        async def revoke() -> None:
+            cache = AccesTokenCache()
+            if token_hash: cache.invalidate_token_hash(token_hash)
+            if user_id: cache.invalidate_user(user_id)
+
+            await self._RedisService.publish_acces_token_revocation(token_hash=token_hash, user_id=user_id)
+
+        self._after_commit(revoke)
+
     @web_exceptions_raiser
-    async def authorize_request(self, token: str, return_user: bool = True) -> User | None:
-        """Can be used in fastAPI Depends() \n Prepares and authorizes token"""
+    async def authorize_request(self, token: str, return_user: bool = True) -> AuthorizedUser | None:
+        """Can be used in fastAPI Depends() \n Prepares and authorizes token \n Returns lightweight principal. User's relationships are NOT loaded"""
         
         valid_token = self._JWT.prepare_token(jwt_token=token)
 
+        cached_user = AccesTokenCache().get(valid_token)
+        if cached_user:
+            return cached_user if return_user else None
+
         if not await self._RedisService.check_jwt_existence(jwt_token=valid_token, token_type="acces"):
             raise Unauthorized(detail=f"AuthService: User tried to authrorize request by expired token: {token}", client_safe_detail="Invalid or expired token")
         
         if return_user:
             payload = self._JWT.extract_jwt_payload(jwt_token=valid_token)
-            user = await self._PostgresService.get_user_by_id(payload.user_id)
-            if not user:
+            user_row = await self._PostgresService.get_user_principal_columns(user_id=payload.user_id)
+            if not user_row:
                 raise Unauthorized(detail=f"AuthService: User tried to authorize request by token: {token}, but specified user id does not exist.", client_safe_detail="Invalid or expired token")
-            return user
+            principal = AuthorizedUser(user_id=user_row.user_id, username=user_row.username, has_avatar=bool(user_row.avatar_image_name))
+            AccesTokenCache().set(valid_token, principal=principal, issued_at=payload.issued_at.timestamp())
+            return principal
         
         return None
 
@@ -61,7 +86,7 @@ class MainServiceAuth(MainServiceBase):
             user_id=str(uuid4()),
             username=credentials.username, 
             email=credentials.email,
-            password_hash=password_utils.hash_password(credentials.password)
+            password_hash=await password_utils.hash_password_async(credentials.password)
         )
 
         await self._PostgresService.insert_models_and_flush(new_user)
@@ -74,24 +99,17 @@ class MainServiceAuth(MainServiceBase):
         if not potential_user:
             raise InvalidResourceProvided(detail=f"AuthService: User tried to login to not existing account with credentials: {credentials.username}", client_safe_detail="Account with these credentials does not exist. You may need to sign up first")
         
-        if not password_utils.check_password(credentials.password, potential_user.password_hash):
+        if not await password_utils.check_password_async(credentials.password, potential_user.password_hash):
             raise Unauthorized(detail=f"AuthService: User with credentials: {credentials.username} tried to login with wrong password.", client_safe_detail="Password didn't match")
         
-        user_id = potential_user.user_id
-        potential_refresh_token = await self._RedisService.get_token_by_user_id(user_id=user_id, token_type="refresh")
-        potential_acces_token = await self._RedisService.get_token_by_user_id(user_id=user_id, token_type="acces")
-
-        if potential_acces_token:
-            await self._RedisService.delete_jwt(jwt_token=potential_acces_token, token_type="acces")
-        if potential_refresh_token:
-            await self._RedisService.delete_jwt(jwt_token=potential_refresh_token, token_type="refresh")
-        
-        return await self._JWT.generate_save_refresh_acces_token(user_id=user_id, redis=self._RedisService)
+        # Each login is a separate device session. Sessions over MAX_SESSIONS_PER_USER limit get revoked in Redis and dropped from token caches of all workers
+        return await self._JWT.generate_save_refresh_acces_token(user_id=potential_user.user_id, redis=self._RedisService)
 
     @web_exceptions_raiser
     async def logout(self, tokens: RefreshAccesTokens) -> None:
         await self._RedisService.delete_jwt(jwt_token=tokens.acces_token, token_type="acces")
         await self._RedisService.delete_jwt(jwt_token=tokens.refresh_token, token_type="refresh")
+        self._revoke_cached_tokens(acces_token=tokens.acces_token)
 
     @web_exceptions_raiser
     async def refresh_token(self, refresh_token: str) -> AccesTokenSchema:
@@ -103,34 +121,48 @@ class MainServiceAuth(MainServiceBase):
         payload = self._JWT.extract_jwt_payload(jwt_token=prepared_token)
         user_id = payload.user_id
 
-        old_acces_token = await self._RedisService.get_token_by_user_id(user_id=user_id, token_type="acces")
-        new_acces_token = await self._JWT.generate_save_token(user_id=user_id, redis=self._RedisService, token_type="acces")
+        # Acces token issued together with this refresh token. Other devices' tokens stay untouched
+        old_acces_token = await self._RedisService.get_paired_acces_token(refresh_token=prepared_token)
+        # Old token is replaced in the same transaction - device at sessions limit doesn't evict other device
+        new_acces_token = await self._JWT.generate_save_token(user_id=user_id, redis=self._RedisService, token_type="acces", replaces=old_acces_token)
 
-        await self._RedisService.refresh_acces_token(old_token=old_acces_token, new_token=new_acces_token.acces_token, user_id=user_id)
+        await self._RedisService.pair_tokens(refresh_token=prepared_token, acces_token=new_acces_token.acces_token)
+        if old_acces_token:
+            self._revoke_cached_tokens(acces_token=old_acces_token)
         return new_acces_token
     
     @web_exceptions_raiser
-    async def change_password(self, user: User, credentials: OldNewPassword) -> None:
-        if not password_utils.check_password(entered_pass=credentials.old_password, hashed_pass=user.password_hash):
+    async def change_password(self, user: AuthorizedUser, credentials: OldNewPassword) -> None:
+        user = await self._PostgresService.get_user_by_id(user_id=user.user_id)
+
+        if not await password_utils.check_password_async(entered_pass=credentials.old_password, hashed_pass=user.password_hash):
             raise InvalidResourceProvided(detail=f"AuthService: User: {user.user_id} tried to change password, but old password didn't match.", client_safe_detail="Password didn't match")
 
-        new_password_hashed = password_utils.hash_password(raw_pass=credentials.new_password)
+        new_password_hashed = await password_utils.hash_password_async(raw_pass=credentials.new_password)
         await self._PostgresService.change_field_and_flush(model=user, password_hash=new_password_hashed)
+        self._revoke_cached_tokens(user_id=user.user_id)
 
     @web_exceptions_raiser
-    async def change_username(self, user: User, credentials: NewUsername) -> None:
+    async def change_username(self, user: AuthorizedUser, credentials: NewUsername) -> None:
         new_username = credentials.new_username
 
         if user.username == credentials.new_username:
             raise InvalidResourceProvided(detail=f"AuthService: User: {user.user_id} tried to change username to identical to his old one.", client_safe_detail="New username can't the same as old one")
 
-        await self._PostgresService.change_field_and_flush(model=User, username=new_username)
+        db_user = await self._PostgresService.get_user_by_id(user_id=user.user_id)
+        await self._PostgresService.change_field_and_flush(model=db_user, username=new_username)
+
+        # Cached principals hold old username
+        self._revoke_cached_tokens(user_id=user.user_id)
 
     @web_exceptions_raiser
-    async def delete_user(self, password: str, user: User) -> None:
-        if not password_utils.check_password(entered_pass=password, hashed_pass=user.password_hash):
+    async def delete_user(self, password: str, user: AuthorizedUser) -> None:
+        user = await self._PostgresService.get_user_by_id(user_id=user.user_id)
+
+        if not await password_utils.check_password_async(entered_pass=password, hashed_pass=user.password_hash):
             raise InvalidResourceProvided(detail=f"AuthService: User: {user.user_id} tried to delete his profile, but password didn't match.", client_safe_detail="Password didn't match")
         
         await self._PostgresService.delete_models_and_flush(user)
         await self._RedisService.deactivate_tokens_by_id(user_id=user.user_id)
-        await self._ImageStorage.delete_avatar_user(user_id=user.user_id)
+        self._revoke_cached_tokens(user_id=user.user_id)
+        await self._ImageStorage.delete_avatar_user(user_id=user.user_id, image=ImageRef.of_avatar(user))
@@ -1,9 +1,11 @@
 from services.core_services import MainServiceBase
 from services.postgres_service.models import *
+from services.image_storage_service import ImageRef, IMAGE_SIZE_AVATAR
 from exceptions.custom_exceptions import *
 from exceptions.exceptions_handler import web_exceptions_raiser
 from pydantic_schemas.pydantic_schemas_chat import Chat, MessageSchema, MessageSchemaShort, ExpectedWSData, ChatJWTPayload, CreateDialoqueRoomBody, ChatTokenResponse, CreateGroupRoomBody, MessageSchemaActionIncluded, MessageSchemaShortActionIncluded
 from pydantic_schemas.pydantic_schemas_social import UserShortSchema
+from pydantic_schemas.pydantic_schemas_auth import AuthorizedUser
 from post_popularity_rate_task.popularity_rate import scheduler
 from uuid import uuid4
 
@@ -21,8 +23,8 @@ SMALL_PAGINATION = int(getenv("SMALL_PAGINATION"))
 
 class MainChatService(MainServiceBase):
     @staticmethod
-    def _create_message(text: str, room_id: str, owner_id: str) -> Message:
-        return Message(message_id=str(uuid4()), room_id=room_id, owner_id=owner_id, text=text)
+    def _create_message(text: str, room_id: str, owner_id: str, seq: int) -> Message:
+        return Message(message_id=str(uuid4()), room_id=room_id, owner_id=owner_id, text=text, seq=seq)
 
     @staticmethod
     def _check_if_users_are_friends(user: User, other_user: User) -> bool:
@@ -52,26 +54,22 @@ class MainChatService(MainServiceBase):
             return await self.delete_message(message_data=request_data, user_data=connection_data)
 
     # @web_exceptions_raiser
-    async def get_chat_token_participants_avatar_urls(self, room_id: str, user: User) -> ChatTokenResponse:
+    async def get_chat_token_participants_avatar_urls(self, room_id: str, user: AuthorizedUser) -> ChatTokenResponse:
         chat_room = await self._get_and_authorize_chat_room(room_id=room_id, user_id=user.user_id, return_chat_room=True)
         chat_token = await self._JWT.generate_save_chat_token(room_id=room_id, user_id=user.user_id, redis=self._RedisService)
 
-        avatar_urls = []
-
-        for participant in chat_room.participants:
-            url = await self._ImageStorage.get_user_avatar_url(participant.user_id)
-            if url:
-                avatar_urls.append(url)
+        participant_ids = [participant.user_id for participant in chat_room.participants]
+        media_urls = await self._ImageStorage.get_media_urls(avatars={participant.user_id: ImageRef.of_avatar(participant) for participant in chat_room.participants}, size=IMAGE_SIZE_AVATAR)
+        avatar_urls = [media_urls.avatars[user_id] for user_id in participant_ids if user_id in media_urls.avatars]
 
         return ChatTokenResponse(token=chat_token, participants_avatar_urls=avatar_urls)
 
     @web_exceptions_raiser
-    async def get_messages_batch(self, room_id: str, user: User, page: int) -> List[MessageSchema]:
+    async def get_messages_batch(self, room_id: str, user: AuthorizedUser, before_seq: int | None) -> List[MessageSchema]:
+        """Pass smallest `seq` of already loaded messages to get older ones. None - latest messages"""
         await self._get_and_authorize_chat_room(room_id=room_id, user_id=user.user_id, return_chat_room=False)
 
-        pagination_normalization = await self._RedisService.get_user_chat_pagination(user_id=user.user_id)
-        print(pagination_normalization)
-        message_batch = await self._PostgresService.get_chat_n_fresh_chat_messages(room_id=room_id, page=page, n=BASE_PAGINATION, pagination_normalization=pagination_normalization)
+        message_batch = await self._PostgresService.get_chat_messages_before(room_id=room_id, n=BASE_PAGINATION, before_seq=before_seq)
 
         return [
             MessageSchema.model_validate(message, from_attributes=True)
@@ -79,16 +77,14 @@ class MainChatService(MainServiceBase):
         ]
         
     @web_exceptions_raiser
-    async def get_chat_batch(self, user: User, page: int, chat_type: Literal["chat", "noе-approved"]) -> List[Chat]:
-        
-        pagination_normalization = await self._RedisService.get_user_chat_pagination(user_id=user.user_id)
-        chat_batch = await self._PostgresService.get_n_user_chats(user=user, page=page, n=BASE_PAGINATION, pagination_normalization=pagination_normalization, chat_type=chat_type)
+    async def get_chat_batch(self, user: AuthorizedUser, page: int, chat_type: Literal["chat", "noе-approved"]) -> List[Chat]:
+        chat_batch = await self._PostgresService.get_n_user_chats(user=user, page=page, n=BASE_PAGINATION, chat_type=chat_type)
 
         return [Chat(chat_id=chat.room_id, participants=len(chat.participants)) for chat in chat_batch]
 
 
     @web_exceptions_raiser
-    async def approve_chat(self, room_id: str, user: User) -> None:
+    async def approve_chat(self, room_id: str, user: AuthorizedUser) -> None:
         chat_room = await self._get_and_authorize_chat_room(room_id=room_id, user_id=user.user_id, return_chat_room=True)
 
         if chat_room.approved:
@@ -100,7 +96,7 @@ class MainChatService(MainServiceBase):
         chat_room.approved = True
     
     @web_exceptions_raiser
-    async def disapprove_chat(self, room_id: str, user: User) -> None:
+    async def disapprove_chat(self, room_id: str, user: AuthorizedUser) -> None:
         chat_room = await self._get_and_authorize_chat_room(room_id=room_id, user_id=user.user_id, return_chat_room=True)
 
         if chat_room.approved:
@@ -112,7 +108,7 @@ class MainChatService(MainServiceBase):
         await self._PostgresService.delete_models_and_flush(chat_room)
 
     @web_exceptions_raiser
-    async def disconnect(self, user: User) -> None:
+    async def disconnect(self, user: AuthorizedUser) -> None:
         """Necessarily call this methods when error occured or user disconnected from websocket to clear all excluding."""
         await self._RedisService.clear_exclude_chat_ids(user_id=user.user_id, exclude_type="message")
 
@@ -120,18 +116,13 @@ class MainChatService(MainServiceBase):
     async def send_message(self, message_data: ExpectedWSData, user_data: ChatJWTPayload) -> MessageSchemaActionIncluded:
         await self._get_and_authorize_chat_room(room_id=user_data.room_id, user_id=user_data.user_id, return_chat_room=False)
 
-        new_message = Message(message_id=str(uuid4()), room_id=user_data.room_id, owner_id=user_data.user_id, text=message_data.message)
+        seq = await self._PostgresService.next_message_seq(room_id=user_data.room_id)
+        new_message = self._create_message(text=message_data.message, room_id=user_data.room_id, owner_id=user_data.user_id, seq=seq)
 
         await self._PostgresService.insert_models_and_flush(new_message)
 
-        # To prevent Missing Greenlet error
-        await self._PostgresService.refresh_model(new_message)
-
-        connections = await self._RedisService.get_chat_connections(room_id=user_data.room_id)
-        print(connections)
-        for conn in connections:
-            print(conn)
-            await self._RedisService.user_chat_pagination_action(user_id=conn, room_id=user_data.room_id, increment=True)
+        # To prevent Missing Greenlet error. Owner relationship is loaded explicitly - it never loads implicitly
+        await self._PostgresService.refresh_model(new_message, attribute_names=["sent", "owner"])
 
         return MessageSchemaActionIncluded.model_validate(new_message, from_attributes=True)
 
@@ -147,11 +138,6 @@ class MainChatService(MainServiceBase):
 
         await self._PostgresService.delete_models_and_flush(message)
 
-        connections = await self._RedisService.get_chat_connections(room_id=user_data.room_id)
-        for conn in connections:
-            await self._RedisService.user_chat_pagination_action(user_id=conn, room_id=user_data.room_id, increment=False)
-
-
         return MessageSchemaShortActionIncluded(message_id=message.message_id, action="delete")
 
     @web_exceptions_raiser
@@ -169,7 +155,7 @@ class MainChatService(MainServiceBase):
         return MessageSchemaShortActionIncluded(action="change", message_id=message.message_id, text=message_data.message)
 
     @web_exceptions_raiser
-    async def create_dialogue_chat(self, data: CreateDialoqueRoomBody, user: User) -> None:
+    async def create_dialogue_chat(self, data: CreateDialoqueRoomBody, user: AuthorizedUser) -> None:
         other_user = await self._PostgresService.get_user_by_id(data.other_participant_id)
 
         if other_user.user_id == user.user_id:
@@ -195,24 +181,27 @@ class MainChatService(MainServiceBase):
         
         chat_room_id = str(uuid4())
 
-        chat_room = ChatRoom(room_id=chat_room_id, is_group=False, approved=False, creator_id=user.user_id)
+        chat_room = ChatRoom(room_id=chat_room_id, is_group=False, approved=False, creator_id=user.user_id, last_message_seq=1)
 
-        chat_room.participants.append(user)
+        # Principal isn't ORM model. Relationship requires loaded User
+        db_user = await self._PostgresService.get_user_by_id(user_id=user.user_id)
+        chat_room.participants.append(db_user)
         chat_room.participants.append(other_user)
 
-        message = self._create_message(text=data.message, room_id=chat_room_id, owner_id=user.user_id)
+        message = self._create_message(text=data.message, room_id=chat_room_id, owner_id=user.user_id, seq=1)
 
         await self._PostgresService.insert_models_and_flush(chat_room, message)
 
 
 
     @web_exceptions_raiser
-    async def create_group_chat(self, data: CreateGroupRoomBody, user: User) -> None:
+    async def create_group_chat(self, data: CreateGroupRoomBody, user: AuthorizedUser) -> None:
         # Adding one to include creator
         if not MIN_CHAT_GROUP_PARTICIPANTS <= len(data.other_participants_ids) + 1 <= MAX_CHAT_GROUP_PARTICIPANTS:
             raise InvalidResourceProvided(detail=f"ChatService: User: {user.user_id} triedt to create chat with {len(data.other_participants_ids)} participants, which isn't allowed.", client_safe_detail=f"You can't create group with more than {MAX_CHAT_GROUP_PARTICIPANTS} or fewer than {MIN_CHAT_GROUP_PARTICIPANTS} members")
 
         participants = await self._PostgresService.get_entries_by_ids(ids=data.other_participants_ids, ModelType=User)
+        user = await self._PostgresService.get_user_by_id(user_id=user.user_id)
 
         if not participants:
             raise ResourceNotFound(detail=f"ChatService: User: {user.user_id} tried to create group chat with some of participants that don't exist.", client_safe_detail="You're trying to create group with people that aren't exist")
@@ -227,13 +216,13 @@ class MainChatService(MainServiceBase):
         chat_room_id = str(uuid4())
         participants.append(user)
 
-        chat_room = ChatRoom(room_id=chat_room_id, created=datetime.utcnow(), is_group=True, approved=True, participants=participants, creator_id=user.user_id)
-        message = self._create_message(text=data.message, room_id=chat_room_id, owner_id=user.user_id)
+        chat_room = ChatRoom(room_id=chat_room_id, created=datetime.utcnow(), is_group=True, approved=True, participants=participants, creator_id=user.user_id, last_message_seq=1)
+        message = self._create_message(text=data.message, room_id=chat_room_id, owner_id=user.user_id, seq=1)
 
         await self._PostgresService.insert_models_and_flush(chat_room, message)
 
     @web_exceptions_raiser
-    async def add_participant_to_group(self, room_id: str, participant_id: str, user: User) -> None:
+    async def add_participant_to_group(self, room_id: str, participant_id: str, user: AuthorizedUser) -> None:
         chat_room = await self._get_and_authorize_chat_room(room_id=room_id, user_id=user.user_id, return_chat_room=True)
 
         if len(chat_room.participants) >= MAX_CHAT_GROUP_PARTICIPANTS:
@@ -3,11 +3,13 @@ from fastapi import HTTPException
 from services.core_services import MainServiceBase
 from services.postgres_service import User, Post, PostImage
 from services_types import ImageType
+from services.image_storage_service import ImageRef
+from pydantic_schemas.pydantic_schemas_auth import AuthorizedUser
 from exceptions.custom_exceptions import EmptyPostsError
-from typing import Tuple, Literal
+from typing import Tuple, Literal, NamedTuple
 import mimetypes
 import os
-import aiofiles
+import aiofiles.os
 from uuid import uuid4
 
 from exceptions.exceptions_handler import web_exceptions_raiser
@@ -23,6 +25,13 @@ MEDIA_AVATAR_PATH_TEST = os.getenv("MEDIA_AVATAR_PATH_TEST", "media/testing_medi
 MEDIA_POST_IMAGE_PATH_TEST = os.getenv("MEDIA_POST_IMAGE_PATH_TEST", "media/testing_media/posts")
 
 
+class MediaFile(NamedTuple):
+    """Image on local disk ready to be streamed. `stat` is taken once - for both validators and response length"""
+    filepath: str
+    content_type: str
+    stat: os.stat_result
+
+
 class MainMediaService(MainServiceBase):
     @staticmethod
     def _define_image_name(id_: str, image_type: ImageType, n_image: int = None) -> str:
@@ -34,18 +43,20 @@ class MainMediaService(MainServiceBase):
         else: raise ValueError("Unsupported image type!")
 
     @staticmethod
-    async def _read_contents_and_mimetype_by_filepath(filepath: str) -> Tuple[bytes, str]:
-        """Returns (`bytes`, `str`) where `bytes` - image contents, `str` - mimetype"""
-        async with aiofiles.open(file=filepath, mode="rb") as file_:
-            contents = await file_.read()
-        
+    async def _get_media_file(filepath: str) -> MediaFile:
+        """File isn't read here. Content type comes from stored extension - contents aren't sniffed"""
         # Return value is a tuple (type, encoding) where type is None if the type can't be guessed
         content_type = mimetypes.guess_type(filepath)[0]
 
         if not content_type:
-            raise MediaError(f"MediaService: Can't guess image type by it's contents.")
+            raise MediaError(f"MediaService: Can't guess image type by it's extension. Filepath: {filepath}")
+
+        try:
+            stat = await aiofiles.os.stat(filepath)
+        except FileNotFoundError:
+            raise ResourceNotFound(detail=f"MediaService: Image with granted token is missing on disk. Filepath: {filepath}", client_safe_detail="Image not found")
 
-        return (contents, content_type)
+        return MediaFile(filepath=filepath, content_type=content_type, stat=stat)
 
     async def get_name_and_check_token(self, token: str, image_type: ImageType):
         """
@@ -57,7 +68,7 @@ class MainMediaService(MainServiceBase):
         raise Unauthorized(detail=f"MediaService: User with media token: {token} (image type: {image_type}) that does not exist tried to get image.", client_safe_detail="Invalid or expired token")
     
     @web_exceptions_raiser
-    async def upload_post_image(self, post_id: str, user: User, image_contents: bytes, specified_mime: str) -> None:
+    async def upload_post_image(self, post_id: str, user: AuthorizedUser, image_contents: bytes, specified_mime: str) -> None:
         if image_contents and specified_mime:
             post = await self._PostgresService.get_entry_by_id(id_=post_id, ModelType=Post)
 
@@ -74,19 +85,30 @@ class MainMediaService(MainServiceBase):
             image_entry = PostImage(image_id=str(uuid4()), post_id=post_id, image_name=image_name)
             await self._PostgresService.insert_models_and_flush(image_entry)
 
-            await self._ImageStorage.upload_images_post(contents=image_contents, content_type=specified_mime, image_name=image_name)
+            stored_image = await self._ImageStorage.upload_images_post(contents=image_contents, content_type=specified_mime, image_name=image_name)
+
+            image_entry.image_filename = stored_image.filename
+            image_entry.image_extension = stored_image.extension
+            image_entry.image_size = stored_image.size
+            image_entry.image_variants = stored_image.variants
+            await self._PostgresService.flush()
         else:
             raise InvalidResourceProvided(detail=f"MediaService: User: {user.user_id} tried to upload image to post: {post_id} with missing image contents: {image_contents[:10]} or mime type: {specified_mime}")
 
     @web_exceptions_raiser
-    async def upload_user_avatar(self, user: User, image_contents: bytes, specified_mime: str):
+    async def upload_user_avatar(self, user: AuthorizedUser, image_contents: bytes, specified_mime: str):
         if image_contents and specified_mime:
+            user = await self._PostgresService.get_user_by_id(user_id=user.user_id)
+
             if user.avatar_image_name:
-                    await self._ImageStorage.delete_avatar_user(user_id=user.user_id)
+                    await self._ImageStorage.delete_avatar_user(user_id=user.user_id, image=ImageRef.of_avatar(user))
  
-            await self._ImageStorage.upload_avatar_user(contents=image_contents, content_type=specified_mime, image_name=user.user_id)
+            stored_image = await self._ImageStorage.upload_avatar_user(contents=image_contents, content_type=specified_mime, image_name=user.user_id)
 
-            user.avatar_image_name = user.user_id
+            user.avatar_image_name = stored_image.filename
+            user.avatar_image_extension = stored_image.extension
+            user.avatar_image_size = stored_image.size
+            user.avatar_image_variants = stored_image.variants
             await self._PostgresService.flush()
 
         else:
@@ -94,20 +116,13 @@ class MainMediaService(MainServiceBase):
        
 
     @web_exceptions_raiser
-    async def get_user_avatar_by_token(self, token: str) -> Tuple[bytes, str]:
-        """Returns single image (contents, mime_type) from granted token"""
-        avatar_name = await self.get_name_and_check_token(token=token, image_type="user")
-
-        filepath = f"{MEDIA_AVATAR_PATH}{avatar_name}"
-        return await self._read_contents_and_mimetype_by_filepath(filepath=filepath)
+    async def get_user_avatar_by_token(self, token: str) -> MediaFile:
+        """Returns single image file from granted token"""
+        avatar_path = await self.get_name_and_check_token(token=token, image_type="user")
+        return await self._get_media_file(filepath=os.path.join(MEDIA_AVATAR_PATH, avatar_path))
 
     @web_exceptions_raiser
-    async def get_post_image_by_token(self, token: str) -> Tuple[bytes, str]:
-        """Returns single image (contents, mime_type) from granted token"""
-
-        image_name = await self.get_name_and_check_token(token=token, image_type="post")
-
-        filepath = f"{MEDIA_POST_IMAGE_PATH}{image_name}"
-
-        return await self._read_contents_and_mimetype_by_filepath(filepath=filepath)
-    
\ No newline at end of file
+    async def get_post_image_by_token(self, token: str) -> MediaFile:
+        """Returns single image file from granted token"""
+        image_path = await self.get_name_and_check_token(token=token, image_type="post")
+        return await self._get_media_file(filepath=os.path.join(MEDIA_POST_IMAGE_PATH, image_path))
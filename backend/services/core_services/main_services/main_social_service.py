@@ -1,23 +1,34 @@
 from services.core_services import MainServiceBase
 from services.postgres_service.models import *
+from services.postgres_service import PostgresService
+from services.image_storage_service import MediaURLs, ImageRef, IMAGE_SIZE_AVATAR, IMAGE_SIZE_POST_CARD, IMAGE_SIZE_POST_DETAIL
 from post_popularity_rate_task.popularity_rate import POST_ACTIONS
+from services.postgres_service.hotness import hot_score_exponent
+from services.postgres_service.pagination import HotPostKey, TimePostKey, UserRankKey, FeedKey, Key, hot_post_key, time_post_key, timeline_score, encode_cursor, decode_cursor
 from mix_posts_consts import *
 
 from dotenv import load_dotenv
 from os import getenv
-from typing import List, TypeVar, Type, Literal, Iterable, NamedTuple, Union
+from datetime import datetime
+from typing import List, Dict, TypeVar, Type, Iterable, Callable, Awaitable, Tuple
+import asyncio
+import logging
 from pydantic_schemas.pydantic_schemas_social import (
     PostBaseShort,
     PostSchema,
     PostDataSchemaID,
     MakePostDataSchema,
     PostLiteSchema,
-    UserLiteSchema,
+    PostsCursorPage,
+    RepliesCursorPage,
     UserSchema,
+    UserSearchSchema,
+    UsersCursorPage,
     UserShortSchema,
     PostBase
 )
 
+from pydantic_schemas.pydantic_schemas_auth import AuthorizedUser
 from exceptions.exceptions_handler import web_exceptions_raiser
 from exceptions.custom_exceptions import *
 
@@ -33,9 +44,6 @@ REPLY_COST_DEVALUATION = float(getenv("REPLY_COST_DEVALUATION")) # TODO: Devalua
 FEED_MAX_POSTS_LOAD = int(getenv("FEED_MAX_POSTS_LOAD"))
 MINIMUM_USER_HISTORY_LENGTH = int(getenv("MINIMUM_USER_HISTORY_LENGTH"))
 
-SHUFFLE_BY_RATE = float(getenv("SHUFFLE_BY_RATE", "0.7"))
-SHUFFLE_BY_TIMESTAMP = float(getenv("SHUFFLE_BY_TIMESTAMP", "0.3"))
-
 REPLY_COST_DEVALUATION = float(getenv("REPLY_COST_DEVALUATION", "0.5"))
 MAX_REPLIES_THAT_GIVE_POPULARITY_RATE = int(getenv("MAX_REPLIES_THAT_GIVE_POPULARITY_RATE", "3"))
 
@@ -43,11 +51,28 @@ BASE_PAGINATION = int(getenv("BASE_PAGINATION"))
 DIVIDE_BASE_PAG_BY = int(getenv("DIVIDE_BASE_PAG_BY"))
 SMALL_PAGINATION = int(getenv("SMALL_PAGINATION"))
 
+FEED_EACH_SOURCE_PAGINATION = int(BASE_PAGINATION / DIVIDE_BASE_PAG_BY)
+FEED_PAGINATION = FEED_EACH_SOURCE_PAGINATION * DIVIDE_BASE_PAG_BY
+# Feed pages that background worker precomputes for active user at once
+FEED_PRECOMPUTED_PAGES = int(getenv("FEED_PRECOMPUTED_PAGES", "10"))
+
+# Feed sources run concurrently. Source that doesn't fit into its timeout gives nothing
+FEED_HISTORY_TIMEOUT_SECONDS = float(getenv("FEED_HISTORY_TIMEOUT_SECONDS", "1"))
+FEED_RELATED_TIMEOUT_SECONDS = float(getenv("FEED_RELATED_TIMEOUT_SECONDS", "2"))
+FEED_FOLLOWED_TIMEOUT_SECONDS = float(getenv("FEED_FOLLOWED_TIMEOUT_SECONDS", "1"))
+FEED_FRESH_TIMEOUT_SECONDS = float(getenv("FEED_FRESH_TIMEOUT_SECONDS", "1"))
+
+TIMELINE_MAX_LENGTH = int(getenv("TIMELINE_MAX_LENGTH", "800"))
+# Posts of users with more followers aren't pushed to timelines. Followers pull them on read
+TIMELINE_CELEBRITY_FOLLOWERS = int(getenv("TIMELINE_CELEBRITY_FOLLOWERS", "5000"))
+
 T = TypeVar("T", bound=Base)
 
-class IdsPostTuple(NamedTuple):
-    ids: List[str]
-    posts: List[Post]
+# Action -> Post counter that it changes. Keyword of `PostgresService.change_post_counters()`
+ACTION_COUNTERS = {
+    ActionType.like: "likes",
+    ActionType.view: "views",
+}
 
 
 class MainServiceSocial(MainServiceBase):
@@ -65,29 +90,75 @@ class MainServiceSocial(MainServiceBase):
         to_return = []
         for lst in lists:
             to_return.extend(lst)
-        print(to_return)
         return to_return
 
     @staticmethod
     def _shuffle_posts(posts: List[Post]) -> List[Post]:
-        return sorted(posts, key=lambda post: (post.popularity_rate * SHUFFLE_BY_RATE, int(post.published.timestamp()) * SHUFFLE_BY_TIMESTAMP), reverse=True)
+        """Hot score already includes post age"""
+        return sorted(posts, key=lambda post: post.hot_score, reverse=True)
 
     @staticmethod
-    def check_post_user_id(post: Post, user: User) -> None:
+    def check_post_user_id(post: Post, user: AuthorizedUser) -> None:
         """If ids doesn't match - raises HTTPException 401"""
         if post.owner_id != user.user_id:
             raise Unauthorized(detail=f"SocialService: User: {user.user_id} tried to access post: {post.post_id}", client_safe_detail="You are not owner of this post!")
 
-    async def _get_ids_by_query_type(self, page: int, user: User, n: int, id_type: Literal["followed", "fresh"], return_posts_too: bool = False, exclude_ids: List[str] = []) -> Union[List[str], NamedTuple]:
-        if id_type == "fresh": posts = await self._PostgresService.get_fresh_posts(user=user, exclude_ids=exclude_ids, n=n, page=page)
-        elif id_type == "followed": posts = await self._PostgresService.get_followed_posts(user=user, exclude_ids=exclude_ids, n=n, page=page)
+    @staticmethod
+    def _decode_cursor(cursor: str | None, KeyType: Type[Key], user_id: str) -> Key | None:
+        try:
+            return decode_cursor(cursor=cursor, KeyType=KeyType)
+        except ValueError as e:
+            raise InvalidResourceProvided(detail=f"SocialService: User: {user_id} provided invalid cursor: {cursor}. {e}", client_safe_detail="Invalid cursor")
 
-        ids = [post.post_id for post in posts]
+    @staticmethod
+    def _next_cursor(posts: List[Post], n: int, post_key: Callable[[Post], Key]) -> str | None:
+        """Full page - there might be more posts. Otherwise it was the last one"""
+        if len(posts) < n:
+            return None
+        return encode_cursor(post_key(posts[-1]))
 
-        if return_posts_too: return (ids, posts)
-        else: return ids
-        
-    async def _construct_and_flush_action(self, action_type: ActionType, user: User, post: Post = None) -> None:
+    @staticmethod
+    def _post_images(posts: Iterable[Post], with_parents: bool = True) -> Dict[str, ImageRef]:
+        """Images of all posts of response page (image name -> persisted image). To resolve their URLs in one batch"""
+        post_images = {}
+        for post in posts:
+            post_images.update((post_image.image_name, ImageRef.of_post_image(post_image)) for post_image in post.images)
+            if with_parents and post.parent_post:
+                post_images.update((post_image.image_name, ImageRef.of_post_image(post_image)) for post_image in post.parent_post.images)
+        return post_images
+
+    @staticmethod
+    def _pictures_urls(post: Post, media_urls: MediaURLs) -> List[str]:
+        return [media_urls.post_images[post_image.image_name] for post_image in post.images if post_image.image_name in media_urls.post_images]
+
+    def _to_post_base_schema(self, post: Post, media_urls: MediaURLs) -> PostBase:
+        return PostBase(
+            post_id=post.post_id,
+            title=post.title,
+            published=post.published,
+            is_reply=post.is_reply,
+            owner=UserShortSchema.model_validate(post.owner, from_attributes=True) if post.owner else None,
+            pictures_urls=self._pictures_urls(post=post, media_urls=media_urls)
+        )
+
+    async def _to_post_lite_schemas(self, posts: List[Post]) -> List[PostLiteSchema]:
+        media_urls = await self._ImageStorage.get_media_urls(post_images=self._post_images(posts=posts), size=IMAGE_SIZE_POST_CARD)
+        return [
+            PostLiteSchema(
+                post_id=post.post_id,
+                title=post.title,
+                published=post.published,
+                is_reply=post.is_reply,
+                likes=post.likes_count,
+                views=post.views_count,
+                replies=post.replies_count,
+                owner=UserShortSchema.model_validate(post.owner, from_attributes=True) if post.owner else None,
+                pictures_urls=self._pictures_urls(post=post, media_urls=media_urls),
+                parent_post=self._to_post_base_schema(post=post.parent_post, media_urls=media_urls) if post.parent_post else None
+            ) for post in posts
+            ]
+
+    async def _construct_and_flush_action(self, action_type: ActionType, user: AuthorizedUser, post: Post = None) -> None:
         """Protected method. Do NOT call this method outside the class"""
         actions = await self._PostgresService.get_actions(user_id=user.user_id, post_id=post.post_id, action_type=action_type)
         cost = POST_ACTIONS[action_type.value]
@@ -116,6 +187,14 @@ class MainServiceSocial(MainServiceBase):
             action=action_type,
         )
         await self._PostgresService.insert_models_and_flush(action)
+        if action_type in ACTION_COUNTERS:
+            await self._PostgresService.change_post_counters(post_id=post.post_id, **{ACTION_COUNTERS[action_type]: 1})
+        if cost > 0:
+            await self._PostgresService.add_post_hot_score(post_id=post.post_id, exponent=hot_score_exponent(weight=cost, at=datetime.utcnow()))
+        await self._RedisService.mark_posts_dirty(post_ids=[post.post_id])
+        # History changed - related part of user's feed too. Views come on every read - they wait for snapshot TTL
+        if action_type != ActionType.view:
+            await self._RedisService.mark_feeds_stale(user_ids=[user.user_id])
 
     @web_exceptions_raiser
     async def sync_postgres_chroma_DEV_METHOD(self) -> None:
@@ -128,85 +207,212 @@ class MainServiceSocial(MainServiceBase):
     async def _get_all_from_specific_model(self, ModelType: Type[T]) -> List[T]:
         return await self._PostgresService.get_all_from_model(ModelType=ModelType)
 
-    @web_exceptions_raiser
-    async def get_feed(self, user: User, page: int) -> List[PostLiteSchema]:
-        """`
-        Returns related posts to provided User table object view history \n
-        It mixes history rated with most popular posts, and newest ones.
-        """
+    async def _hydrate_posts(self, post_ids: List[str]) -> List[Post]:
+        """Loads posts keeping ids order. Deleted posts are skipped"""
+        posts_by_id = {post.post_id: post for post in await self._PostgresService.get_entries_by_ids(ids=post_ids, ModelType=Post)}
+        return [posts_by_id[post_id] for post_id in post_ids if post_id in posts_by_id]
 
-        # TODO: KISS THIS MOTHERFUCKER
+    async def _in_own_session(self, query: Callable[[PostgresService], Awaitable[T]]) -> T:
+        Postgres = self._PostgresService.fork()
+        try:
+            return await query(Postgres)
+        finally:
+            await Postgres.close()
 
-        EACH_SOURCE_PAGINATION = int(BASE_PAGINATION / DIVIDE_BASE_PAG_BY)
+    @staticmethod
+    async def _feed_source(source: str, fetch: Awaitable[List], timeout: float, user_id: str) -> List:
+        """Failed or timed out source gives nothing - feed is built from the rest"""
+        try:
+            return await asyncio.wait_for(fetch, timeout=timeout)
+        except (asyncio.TimeoutError, PostgresError, ChromaDBError) as e:
+            logging.log(level=logging.WARNING, msg=f"SocialService: Feed source: {source} of user: {user_id} gave nothing. {e!r}")
+            return []
+
+    async def _fetch_related_posts(self, user: AuthorizedUser, feed_key: FeedKey, pages: int, each_source_pagination: int) -> List[Post]:
+        """History related mix. ChromaDB has no keyset, so this source keeps page number (in single page units)"""
+        views_history, liked_history = await asyncio.gather(
+            self._feed_source(
+                "views history",
+                self._in_own_session(lambda Postgres: Postgres.get_user_actions(user_id=user.user_id, action_type=ActionType.view, n_most_fresh=HISTORY_POSTS_TO_TAKE_INTO_RELATED, return_posts=True)),
+                timeout=FEED_HISTORY_TIMEOUT_SECONDS, user_id=user.user_id
+            ),
+            self._feed_source(
+                "liked history",
+                self._in_own_session(lambda Postgres: Postgres.get_user_actions(user_id=user.user_id, action_type=ActionType.like, n_most_fresh=LIKED_POSTS_TO_TAKE_INTO_RELATED, return_posts=True)),
+                timeout=FEED_HISTORY_TIMEOUT_SECONDS, user_id=user.user_id
+            )
+        )
+        if len(views_history) <= MINIMUM_USER_HISTORY_LENGTH:
+            return []
 
+        related_ids = await self._feed_source(
+            "related",
+            self._ChromaService.get_n_related_posts_ids(user=user, page=feed_key.related_page // pages, post_relation=views_history + liked_history, pagination=each_source_pagination),
+            timeout=FEED_RELATED_TIMEOUT_SECONDS, user_id=user.user_id
+        )
+        return await self._feed_source(
+            "related posts",
+            self._in_own_session(lambda Postgres: Postgres.get_entries_by_ids(ids=related_ids, ModelType=Post)),
+            timeout=FEED_RELATED_TIMEOUT_SECONDS, user_id=user.user_id
+        )
 
-        views_history = await self._PostgresService.get_user_actions(user_id=user.user_id, action_type=ActionType.view, n_most_fresh=HISTORY_POSTS_TO_TAKE_INTO_RELATED, return_posts=True)
-        liked_history = await self._PostgresService.get_user_actions(user_id=user.user_id, action_type=ActionType.like, n_most_fresh=LIKED_POSTS_TO_TAKE_INTO_RELATED, return_posts=True)
-        history_posts_relation = views_history + liked_history
+    async def _collect_feed_posts(self, user: AuthorizedUser, feed_key: FeedKey, pages: int = 1) -> Tuple[List[Post], FeedKey | None]:
+        """
+        Live feed pipeline. Collects `pages` feed pages at once \n
+        Sources are fetched concurrently, each in own session. Duplicates are dropped on merge: related > followed > fresh. \n
+        Returns posts ranked by hot score and key to continue from. None key - nothing was found
+        """
+        each_source_pagination = FEED_EACH_SOURCE_PAGINATION * pages
+        feed_pagination = FEED_PAGINATION * pages
+
+        related_posts, followed_posts, fresh_posts = await asyncio.gather(
+            self._fetch_related_posts(user=user, feed_key=feed_key, pages=pages, each_source_pagination=each_source_pagination),
+            self._feed_source(
+                "followed",
+                self._in_own_session(lambda Postgres: Postgres.get_followed_posts(user=user, n=each_source_pagination, after=feed_key.followed)),
+                timeout=FEED_FOLLOWED_TIMEOUT_SECONDS, user_id=user.user_id
+            ),
+            # Fresh fills what the others didn't. Their sizes aren't known yet - so it takes full page
+            self._feed_source(
+                "fresh",
+                self._in_own_session(lambda Postgres: Postgres.get_fresh_posts(user=user, n=feed_pagination, exclude_ids=[], after=feed_key.fresh)),
+                timeout=FEED_FRESH_TIMEOUT_SECONDS, user_id=user.user_id
+            )
+        )
 
+        # Merge
+        seen_ids = {post.post_id for post in related_posts}
+        used_followed = [post for post in followed_posts if post.post_id not in seen_ids]
+        seen_ids.update(post.post_id for post in used_followed)
+
+        fresh_to_take = feed_pagination - len(seen_ids)
+        used_fresh = []
+        for post in fresh_posts:
+            if len(used_fresh) >= fresh_to_take:
+                break
+            if post.post_id not in seen_ids:
+                used_fresh.append(post)
+
+        posts = self._shuffle_posts(posts=self.combine_lists(related_posts, used_followed, used_fresh))
+
+        if not posts:
+            return posts, None
+        return posts, FeedKey(
+            related_page=feed_key.related_page + pages if related_posts else feed_key.related_page,
+            followed=hot_post_key(followed_posts[-1]) if followed_posts else feed_key.followed,
+            # Next page continues right after the last fresh post that got into this one
+            fresh=hot_post_key(used_fresh[-1]) if used_fresh else feed_key.fresh
+        )
 
+    async def materialize_feed(self, user_id: str) -> bool:
+        """
+        Background worker only. Runs live pipeline for `FEED_PRECOMPUTED_PAGES` pages and stores result as user's current feed snapshot \n
+        Returns False if user doesn't exist
+        """
+        user_row = await self._PostgresService.get_user_principal_columns(user_id=user_id)
+        if not user_row:
+            return False
+        user = AuthorizedUser(user_id=user_row.user_id, username=user_row.username, has_avatar=bool(user_row.avatar_image_name))
+
+        posts, continuation_key = await self._collect_feed_posts(user=user, feed_key=FeedKey(related_page=0, followed=None, fresh=None), pages=FEED_PRECOMPUTED_PAGES)
+        await self._RedisService.save_feed_snapshot(
+            user_id=user_id,
+            post_ids=[post.post_id for post in posts],
+            continuation_cursor=encode_cursor(continuation_key)
+        )
+        return True
 
-        # History related mix
-        if len(views_history) > MINIMUM_USER_HISTORY_LENGTH:
-            related_ids = await self._ChromaService.get_n_related_posts_ids(user=user, page=page, post_relation=history_posts_relation, pagination=EACH_SOURCE_PAGINATION)
+    @web_exceptions_raiser
+    async def get_feed(self, user: AuthorizedUser, cursor: str | None) -> PostsCursorPage:
+        """`
+        Returns related posts to provided User table object view history \n
+        It mixes history rated with most popular posts, and newest ones. Sources that gave nothing are filled with fresh posts. \n
+        Pages come from snapshot precomputed by background worker. If there is no snapshot - live pipeline runs.
+        """
 
-            # Following mix
-            followed_ids =  await self._get_ids_by_query_type(exclude_ids=related_ids, user=user, page=page, n=EACH_SOURCE_PAGINATION, id_type="followed")
-            if not followed_ids:
-                followed_ids = await self._get_ids_by_query_type(exclude_ids=related_ids, user=user, page=page, n=EACH_SOURCE_PAGINATION, id_type="fresh")
+        feed_key = self._decode_cursor(cursor=cursor, KeyType=FeedKey, user_id=user.user_id) or FeedKey(related_page=0, followed=None, fresh=None)
+        await self._RedisService.touch_feed_user(user_id=user.user_id)
 
-            unrelevant_ids = await self._get_ids_by_query_type(exclude_ids=followed_ids + related_ids, user=user, page=page, n=EACH_SOURCE_PAGINATION, id_type="fresh")
-            
-        else:
-            related_ids = await self._get_ids_by_query_type(page=page, user=user, n=EACH_SOURCE_PAGINATION, id_type="fresh")
+        snapshot_id = feed_key.snapshot_id
+        if not cursor:
+            snapshot_id = await self._RedisService.get_current_feed_snapshot(user_id=user.user_id)
 
-            # Following mix
-            followed_ids =  await self._get_ids_by_query_type(exclude_ids=related_ids, user=user, page=page, n=EACH_SOURCE_PAGINATION, id_type="followed")
-            if not followed_ids:
-                followed_ids = await self._get_ids_by_query_type(exclude_ids=related_ids, user=user, page=page+1, n=EACH_SOURCE_PAGINATION, id_type="fresh")
-                unrelevant_ids = await self._get_ids_by_query_type(exclude_ids=followed_ids + related_ids, user=user, page=page+2, n=EACH_SOURCE_PAGINATION, id_type="fresh")
-            else:
-                unrelevant_ids = await self._get_ids_by_query_type(exclude_ids=followed_ids + related_ids, user=user, page=page+1, n=EACH_SOURCE_PAGINATION, id_type="fresh")
+        if snapshot_id:
+            snapshot_page = await self._RedisService.get_feed_snapshot_page(user_id=user.user_id, snapshot_id=snapshot_id, offset=feed_key.snapshot_offset, n=FEED_PAGINATION)
+            if snapshot_page:
+                post_ids, snapshot_size, continuation_cursor = snapshot_page
+                next_offset = feed_key.snapshot_offset + len(post_ids)
 
+                # After snapshot end live pipeline continues where worker stopped
+                next_cursor = continuation_cursor
+                if next_offset < snapshot_size:
+                    next_cursor = encode_cursor(feed_key._replace(snapshot_id=snapshot_id, snapshot_offset=next_offset))
 
-        all_ids = self.combine_lists(related_ids, followed_ids, unrelevant_ids)
+                posts = await self._hydrate_posts(post_ids=post_ids)
+                return PostsCursorPage(posts=await self._to_post_lite_schemas(posts=posts), next_cursor=next_cursor)
 
+        # No snapshot yet or it expired while user was paging it
+        posts, next_key = await self._collect_feed_posts(user=user, feed_key=feed_key._replace(snapshot_id=None, snapshot_offset=0))
+        return PostsCursorPage(posts=await self._to_post_lite_schemas(posts=posts), next_cursor=encode_cursor(next_key))
 
-        posts = await self._PostgresService.get_entries_by_ids(ids=all_ids, ModelType=Post)
-        posts = self._shuffle_posts(posts=posts)
+    async def _fan_out_post(self, owner_id: str, post_id: str, published: datetime) -> None:
+        """Pushes new post to followers timelines. Celebrity posts are only marked to be pulled on read. Run it after commit"""
+        is_celebrity = await self._PostgresService.count_followers(user_id=owner_id) > TIMELINE_CELEBRITY_FOLLOWERS
+        await self._RedisService.set_timeline_celebrity(user_id=owner_id, is_celebrity=is_celebrity)
+        if is_celebrity:
+            return
 
-        return [
-            PostLiteSchema(
-                post_id=post.post_id,
-                title=post.title,
-                published=post.published,
-                is_reply=post.is_reply,
-                owner=UserShortSchema.model_validate(post.owner, from_attributes=True),
-                pictures_urls= await self._ImageStorage.get_post_image_urls(images_names=[post_image.image_name for post_image in post.images]),
-                parent_post=post.parent_post
-            ) for post in posts
-            ]
+        follower_ids = await self._PostgresService.get_follower_ids(user_id=owner_id)
+        await self._RedisService.push_to_timelines(user_ids=follower_ids, post_id=post_id, score=timeline_score(published))
 
-    @web_exceptions_raiser
-    async def get_followed_posts(self, user: User, page: int) -> List[PostLiteSchema]:        
-        post_ids, posts = await self._get_ids_by_query_type(page=page, n=BASE_PAGINATION, user=user, id_type="followed", return_posts_too=True)
+    async def _read_timeline(self, user: AuthorizedUser, n: int, after: TimePostKey | None) -> List[Post]:
+        """Pushed part of following tab. Not built timeline gets backfilled from database"""
+        timeline_page = await self._RedisService.get_timeline_page(
+            user_id=user.user_id,
+            n=n,
+            before=(timeline_score(after.published), after.post_id) if after else None
+        )
 
-        posts = self._shuffle_posts(posts=posts)
+        if timeline_page is None:
+            backfill = await self._PostgresService.get_followed_posts_by_time(follower_id=user.user_id, n=TIMELINE_MAX_LENGTH)
+            await self._RedisService.save_timeline(user_id=user.user_id, posts={post.post_id: timeline_score(post.published) for post in backfill})
+            if not after:
+                return backfill[:n]
+            return await self._PostgresService.get_followed_posts_by_time(follower_id=user.user_id, n=n, after=after)
+
+        items, timeline_size = timeline_page
+        posts = await self._hydrate_posts(post_ids=[post_id for post_id, _ in items])
+
+        # Timeline keeps only newest posts. Older pages are read from database
+        if len(items) < n and timeline_size >= TIMELINE_MAX_LENGTH:
+            posts += await self._PostgresService.get_followed_posts_by_time(
+                follower_id=user.user_id,
+                n=n - len(posts),
+                after=time_post_key(posts[-1]) if posts else after
+            )
+        return posts
 
-        return [
-            PostLiteSchema(
-                post_id=post.post_id,
-                title=post.title,
-                published=post.published,
-                is_reply=post.is_reply,
-                owner=post.owner,
-                pictures_urls= await self._ImageStorage.get_post_image_urls(images_names=[post_image.image_name for post_image in post.images]),
-                parent_post=post.parent_post
-            ) for post in posts
-            ]
-    
     @web_exceptions_raiser
-    async def search_posts(self, prompt: str, user: User, page: int) -> List[PostLiteSchema]:
+    async def get_followed_posts(self, user: AuthorizedUser, cursor: str | None) -> PostsCursorPage:
+        """Newest posts of followed users. Fan-out timeline merged with posts of followed celebrities"""
+        after = self._decode_cursor(cursor=cursor, KeyType=TimePostKey, user_id=user.user_id)
+        posts = await self._read_timeline(user=user, n=BASE_PAGINATION, after=after)
+
+        celebrity_ids = await self._RedisService.get_timeline_celebrities()
+        if celebrity_ids:
+            posts += await self._PostgresService.get_followed_posts_by_time(follower_id=user.user_id, n=BASE_PAGINATION, after=after, owner_ids=celebrity_ids)
+
+        # Backfilled timeline can contain celebrity posts too
+        posts = list({post.post_id: post for post in posts}.values())
+        posts = sorted(posts, key=time_post_key, reverse=True)[:BASE_PAGINATION]
+
+        return PostsCursorPage(
+            posts=await self._to_post_lite_schemas(posts=posts),
+            next_cursor=self._next_cursor(posts=posts, n=BASE_PAGINATION, post_key=time_post_key)
+        )
+
+    @web_exceptions_raiser
+    async def search_posts(self, prompt: str, user: AuthorizedUser, page: int) -> List[PostLiteSchema]:
         """
         Search posts that similar with meaning to prompt
         """
@@ -214,25 +420,31 @@ class MainServiceSocial(MainServiceBase):
         post_ids = await self._ChromaService.search_posts_by_prompt(prompt=prompt, page=page, n=BASE_PAGINATION)
         posts = await self._PostgresService.get_entries_by_ids(ids=post_ids, ModelType=Post)
 
-        return [
-            PostLiteSchema(
-                post_id=post.post_id,
-                title=post.title,
-                published=post.published,
-                is_reply=post.is_reply,
-                owner=UserShortSchema.model_validate(post.owner, from_attributes=True),
-                pictures_urls= await self._ImageStorage.get_post_image_urls(images_names=[post_image.image_name for post_image in post.images]),
-                parent_post=post.parent_post
-            ) for post in posts
-            ]
+        return await self._to_post_lite_schemas(posts=posts)
 
-    # @web_exceptions_raiser
-    async def search_users(self, prompt: str,  request_user: User, page: int) -> List[UserLiteSchema]:
-        users = await self._PostgresService.get_users_by_username(prompt=prompt, page=page, n=BASE_PAGINATION)
-        return [UserLiteSchema.model_validate(user, from_attributes=True) for user in users if user.user_id != request_user.user_id]
+    @web_exceptions_raiser
+    async def search_users(self, prompt: str, request_user: AuthorizedUser, cursor: str | None = None) -> UsersCursorPage:
+        """Usernames similar to prompt. Exact prefix matches go first"""
+        after = self._decode_cursor(cursor=cursor, KeyType=UserRankKey, user_id=request_user.user_id)
+
+        users = await self._PostgresService.get_users_by_username(
+            prompt=prompt,
+            n=BASE_PAGINATION,
+            exclude_user_id=request_user.user_id,
+            after=after
+        )
+
+        next_cursor = None
+        if len(users) == BASE_PAGINATION:
+            next_cursor = encode_cursor(UserRankKey(rank=users[-1].rank, user_id=users[-1].user_id))
+
+        return UsersCursorPage(
+            users=[UserSearchSchema(user_id=user.user_id, username=user.username, followers_count=user.followers_count) for user in users],
+            next_cursor=next_cursor
+        )
 
     @web_exceptions_raiser  
-    async def make_post(self, data: MakePostDataSchema, user: User) -> None:
+    async def make_post(self, data: MakePostDataSchema, user: AuthorizedUser) -> None:
         if data.parent_post_id:
             if not await self._PostgresService.get_entry_by_id(id_=data.parent_post_id, ModelType=Post):
                 raise InvalidAction(detail=f"SocialService: User: {user.user_id} tried to reply to post: {data.parent_post_id} that does not exists.", client_safe_detail="Post that you are replying does not exist.")
@@ -247,20 +459,31 @@ class MainServiceSocial(MainServiceBase):
         )
 
         await self._PostgresService.insert_models_and_flush(post)
+        if data.parent_post_id:
+            await self._PostgresService.change_post_counters(post_id=data.parent_post_id, replies=1)
         await self._PostgresService.refresh_model(post)
+        # Followers read timelines right away. Post must be committed before its id gets there
+        owner_id, post_id, published = post.owner_id, post.post_id, post.published
+        self._after_commit(lambda: self._fan_out_post(owner_id=owner_id, post_id=post_id, published=published))
         await self._ChromaService.add_posts_data(posts=[post])
 
     @web_exceptions_raiser
-    async def remove_action(self, user: User, post: Post, action_type: ActionType) -> None:
+    async def remove_action(self, user: AuthorizedUser, post: Post, action_type: ActionType) -> None:
         potential_action = await self._PostgresService.get_actions(user_id=user.user_id, post_id=post.post_id, action_type=action_type)
         if not potential_action:
             raise InvalidAction(detail=f"SocialService: User: {user.user_id} tried to reply to post: {post.post_id} that does not exists.")
         
-        await self._PostgresService.delete_models_and_flush(potential_action)
+        await self._PostgresService.delete_models_and_flush(*potential_action)
         self.change_post_rate(post=post, action_type=action_type, add=False)
+        if action_type in ACTION_COUNTERS:
+            await self._PostgresService.change_post_counters(post_id=post.post_id, **{ACTION_COUNTERS[action_type]: -len(potential_action)})
+        for action in potential_action:
+            await self._PostgresService.add_post_hot_score(post_id=post.post_id, exponent=hot_score_exponent(weight=POST_ACTIONS[action_type.value], at=action.date), add=False)
+        await self._RedisService.mark_posts_dirty(post_ids=[post.post_id])
+        await self._RedisService.mark_feeds_stale(user_ids=[user.user_id])
     
     @web_exceptions_raiser
-    async def delete_post(self, post_id: str, user: User) -> None:
+    async def delete_post(self, post_id: str, user: AuthorizedUser) -> None:
         post = await self._PostgresService.get_entry_by_id(id_=post_id, ModelType=Post)
 
         if not post:
@@ -269,11 +492,17 @@ class MainServiceSocial(MainServiceBase):
         self.check_post_user_id(post=post, user=user)
 
         await self._PostgresService.delete_post_by_id(id_=post.post_id)
-        await self._ImageStorage.delete_post_images(base_name=post.post_id)
+        if post.parent_post_id:
+            await self._PostgresService.change_post_counters(post_id=post.parent_post_id, replies=-1)
+        await self._ImageStorage.delete_post_images(post_images=self._post_images(posts=[post], with_parents=False))
         await self._ChromaService.delete_by_ids(ids=[post.post_id])
 
+        if post.owner_id not in await self._RedisService.get_timeline_celebrities():
+            follower_ids = await self._PostgresService.get_follower_ids(user_id=post.owner_id)
+            await self._RedisService.remove_from_timelines(user_ids=follower_ids, post_id=post.post_id)
+
     @web_exceptions_raiser
-    async def like_post_action(self, post_id: str, user: User, like: bool = True) -> None:
+    async def like_post_action(self, post_id: str, user: AuthorizedUser, like: bool = True) -> None:
         """Set 'like' param to True to leave like. To remove like - set to False"""
         post = await self._PostgresService.get_entry_by_id(id_=post_id, ModelType=Post)
         if like:
@@ -282,7 +511,7 @@ class MainServiceSocial(MainServiceBase):
             await self.remove_action(user=user, post=post, action_type=ActionType.like)
 
     @web_exceptions_raiser
-    async def change_post(self, post_data: PostDataSchemaID, user: User, post_id: str) -> PostSchema:
+    async def change_post(self, post_data: PostDataSchemaID, user: AuthorizedUser, post_id: str) -> PostSchema:
         post = await self._PostgresService.get_entry_by_id(id_=post_id, ModelType=Post)
 
         if not post:
@@ -296,7 +525,7 @@ class MainServiceSocial(MainServiceBase):
         return PostSchema.model_validate(updated_post, from_attributes=True)
 
     @web_exceptions_raiser
-    async def friendship_action(self, user: User, other_user_id: str, follow: bool) -> None:
+    async def friendship_action(self, user: AuthorizedUser, other_user_id: str, follow: bool) -> None:
         """To follow user - set follow to True. To unfollow - False"""
 
         if user.user_id == other_user_id:
@@ -315,6 +544,9 @@ class MainServiceSocial(MainServiceBase):
             if other_user not in fresh_user.followed:
                 raise InvalidAction(detail=f"SocialService: User: {user.user_id} tried to unfollow user: {other_user.user_id} not following him", client_safe_detail="You are not following this user. You can't unfollow him")
             fresh_user.followed.remove(other_user)
+
+        await self._RedisService.mark_feeds_stale(user_ids=[user.user_id])
+        await self._RedisService.delete_timeline(user_id=user.user_id)
     
     @web_exceptions_raiser
     async def get_user_profile(self, user_id: str, other_user_id: str) -> UserSchema:
@@ -323,7 +555,7 @@ class MainServiceSocial(MainServiceBase):
         if not other_user: 
             raise ResourceNotFound(detail=f"User: {user_id} tried to get user: {other_user_id} profile that does not exist.", client_safe_detail="User profile that you trying to get does not exist.")
 
-        avatar_token = await self._ImageStorage.get_user_avatar_url(user_id=other_user.user_id)
+        avatar_token = await self._ImageStorage.get_user_avatar_url(user_id=other_user.user_id, image=ImageRef.of_avatar(other_user), size=IMAGE_SIZE_AVATAR)
 
         return UserSchema(
             user_id=other_user.user_id,
@@ -334,58 +566,46 @@ class MainServiceSocial(MainServiceBase):
         )
     
     @web_exceptions_raiser
-    async def get_users_posts(self, user_id: str, page: int) -> PostLiteSchema:
-        posts = await self._PostgresService.get_user_posts(user_id=user_id, page=page, n=SMALL_PAGINATION)
+    async def get_users_posts(self, user_id: str, request_user: AuthorizedUser, cursor: str | None) -> PostsCursorPage:
+        after = self._decode_cursor(cursor=cursor, KeyType=TimePostKey, user_id=request_user.user_id)
+        posts = await self._PostgresService.get_user_posts(user_id=user_id, n=SMALL_PAGINATION, after=after)
 
-        return [
-            PostLiteSchema(
-                post_id=post.post_id,
-                title=post.title,
-                published=post.published,
-                is_reply=post.is_reply,
-                owner=post.owner,
-                pictures_urls= await self._ImageStorage.get_post_image_urls(images_names=[post_image.image_name for post_image in post.images]),
-                parent_post=post.parent_post
-            ) for post in posts
-            ]
+        return PostsCursorPage(
+            posts=await self._to_post_lite_schemas(posts=posts),
+            next_cursor=self._next_cursor(posts=posts, n=SMALL_PAGINATION, post_key=time_post_key)
+        )
     
     @web_exceptions_raiser
-    async def get_my_profile(self, user: User) -> UserSchema:
+    async def get_my_profile(self, user: AuthorizedUser) -> UserSchema:
         """To use this method you firstly need to get User instance by Bearer token"""
 
         # To prever SQLalechemy missing greenlet_spawn error. Cause merged model loses relationships
         user = await self._PostgresService.get_entry_by_id(id_=user.user_id, ModelType=User)
 
-        avatar_token = await self._ImageStorage.get_user_avatar_url(user_id=user.user_id)
+        avatar_token = await self._ImageStorage.get_user_avatar_url(user_id=user.user_id, image=ImageRef.of_avatar(user), size=IMAGE_SIZE_AVATAR)
 
         return UserSchema(
             user_id=user.user_id,
             username=user.username,
             followers=user.followers,
             followed=user.followed,
-            posts=user.posts,
             avatar_url=avatar_token
         )
 
     @web_exceptions_raiser
-    async def load_post(self, user: User, post_id: str) -> PostSchema:
+    async def load_post(self, user: AuthorizedUser, post_id: str) -> PostSchema:
         post = await self._PostgresService.get_entry_by_id(id_=post_id, ModelType=Post)
 
         if not post:
             raise ResourceNotFound(detail=f"SocialService: User: {user.user_id} tried to load post: {post_id} that does not exist.", client_safe_detail="This post does not exist.")
 
-        if post.parent_post: parent_post = PostBase.model_validate(post.parent_post, from_attributes=True)
-        else: parent_post = None
-
         await self._construct_and_flush_action(action_type=ActionType.view, post=post, user=user)
 
-        await self._PostgresService.refresh_model(model_obj=post)
-
-        post_likes = await self._PostgresService.get_actions(user_id=user.user_id, post_id=post.post_id, action_type=ActionType.like)
-        post_views = await self._PostgresService.get_actions(user_id=user.user_id, post_id=post.post_id, action_type=ActionType.view)
+        # Counters were changed by database side UPDATE
+        await self._PostgresService.refresh_model(model_obj=post, attribute_names=["likes_count", "views_count", "replies_count"])
 
-        filenames = [filename.image_name for filename in post.images]
-        images_temp_urls = await self._ImageStorage.get_post_image_urls(image_names=filenames)
+        media_urls = await self._ImageStorage.get_media_urls(post_images=self._post_images(posts=[post]), size=IMAGE_SIZE_POST_DETAIL)
+        parent_post = self._to_post_base_schema(post=post.parent_post, media_urls=media_urls) if post.parent_post else None
 
         return PostSchema(
             post_id=post.post_id,
@@ -393,29 +613,23 @@ class MainServiceSocial(MainServiceBase):
             text=post.text,
             published=post.published,
             owner=UserShortSchema.model_validate(post.owner, from_attributes=True),
-            likes=len(post_likes),
-            views=len(post_views),
+            likes=post.likes_count,
+            views=post.views_count,
+            replies=post.replies_count,
             parent_post=parent_post,
             last_updated=post.last_updated,
-            pictures_urls=images_temp_urls,
+            pictures_urls=self._pictures_urls(post=post, media_urls=media_urls),
             is_reply=post.is_reply
         )
 
     @web_exceptions_raiser
-    async def load_replies(self, post_id: str, page: int) -> List[PostBase]:
-        replies = await self._PostgresService.get_post_replies(post_id=post_id, page=page, n=SMALL_PAGINATION)
-        return [PostBase.model_validate(reply, from_attributes=True) for reply in replies]        
-    
-    @web_exceptions_raiser
-    async def get_user_posts(self, user_id: str, page: int) -> List[PostLiteSchema]:
-        user_posts = await self._PostgresService.get_user_posts(user_id=user_id, page=page, n=SMALL_PAGINATION)
+    async def load_replies(self, post_id: str, user: AuthorizedUser, cursor: str | None) -> RepliesCursorPage:
+        after = self._decode_cursor(cursor=cursor, KeyType=TimePostKey, user_id=user.user_id)
+        replies = await self._PostgresService.get_post_replies(post_id=post_id, n=SMALL_PAGINATION, after=after)
 
-        return [PostLiteSchema(
-            post_id=post.post_id,
-            title=post.title,
-            published=post.published,
-            is_reply=post.is_reply,
-            pictures_urls=[await self._ImageStorage.get_post_image_urls(images_names=image.image_name) for image in post.images],
-            owner=UserShortSchema.model_validate(post.owner, from_attributes=True),
-            parent_post=PostBase.model_validate(post.parent_post, from_attributes=True) if post.parent_post else None
-        ) for post in user_posts]
\ No newline at end of file
+        media_urls = await self._ImageStorage.get_media_urls(post_images=self._post_images(posts=replies, with_parents=False), size=IMAGE_SIZE_POST_CARD)
+
+        return RepliesCursorPage(
+            replies=[self._to_post_base_schema(post=reply, media_urls=media_urls) for reply in replies],
+            next_cursor=self._next_cursor(posts=replies, n=SMALL_PAGINATION, post_key=time_post_key)
+        )
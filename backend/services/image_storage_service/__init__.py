@@ -1 +1,3 @@
-from .services import *
\ No newline at end of file
+from .services import *
+from .url_cache import PresignedURLCache, PRESIGNED_URL_CACHE_USE_REDIS
+from .variants import IMAGE_SIZE_AVATAR, IMAGE_SIZE_POST_CARD, IMAGE_SIZE_POST_DETAIL, shutdown_image_processing, get_image_processing_statistics
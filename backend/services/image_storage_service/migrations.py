@@ -0,0 +1,115 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from typing import Dict, List, Literal, Tuple
+from dotenv import load_dotenv
+import aiofiles.os
+import asyncio
+import os
+import sys
+
+from services.postgres_service import create_engine, create_sessionmaker, PostImage, User
+from .services import fanout_path, ALLOWED_EXTENSIONS, MEDIA_AVATAR_PATH, MEDIA_POST_IMAGE_PATH, MEDIA_AVATAR_PATH_TEST, MEDIA_POST_IMAGE_PATH_TEST
+
+# Moves local media from flat directories into hashed subdirectories and persists stored filename, extension and size.
+# Rows uploaded before these columns existed aren't served by local storage until this runs.
+# Run after `python -m services.postgres_service.migrations` added the columns:
+# python -m services.image_storage_service.migrations prod
+
+load_dotenv()
+USE_S3 = os.getenv("USE_S3", "True").lower().strip() == "true"
+
+# Flat directories are listed once per run. Serving never lists directories
+LEGACY_EXTENSIONS = [f".{extension}" for extension in ALLOWED_EXTENSIONS] + [".jpg"]
+
+
+async def _legacy_files(root: str) -> Dict[str, str]:
+    """Name without extension -> filename of every file lying directly in `root`"""
+    if not await aiofiles.os.path.isdir(root):
+        return {}
+
+    entries = await asyncio.to_thread(lambda: [entry.name for entry in os.scandir(root) if entry.is_file()])
+    return {os.path.splitext(filename)[0]: filename for filename in entries if not filename.endswith(".tmp")}
+
+async def _migrate_file(root: str, name: str, legacy_files: Dict[str, str]) -> Tuple[str, str, int] | None:
+    """Returns (filename, extension, size) of image moved into fan-out layout. None - no file for this name"""
+    filename = legacy_files.get(name)
+
+    if filename:
+        filepath = os.path.join(root, fanout_path(filename=filename))
+        await aiofiles.os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        await aiofiles.os.replace(os.path.join(root, filename), filepath)
+    else:
+        # Previous run could move file and fail before commit
+        for extension in LEGACY_EXTENSIONS:
+            filename = f"{name}{extension}"
+            filepath = os.path.join(root, fanout_path(filename=filename))
+            if await aiofiles.os.path.isfile(filepath):
+                break
+        else:
+            return None
+
+    stat = await aiofiles.os.stat(filepath)
+    return (filename, os.path.splitext(filename)[1], stat.st_size)
+
+async def migrate_post_images(session: AsyncSession, root: str) -> Tuple[int, int]:
+    """Returns (migrated, missing) numbers of post images"""
+    legacy_files = await _legacy_files(root=root)
+    images = (await session.execute(select(PostImage).where(PostImage.image_filename.is_(None)))).scalars().all()
+    migrated = missing = 0
+
+    for image in images:
+        stored = await _migrate_file(root=root, name=image.image_name, legacy_files=legacy_files)
+        if not stored:
+            missing += 1
+            continue
+
+        image.image_filename, image.image_extension, image.image_size = stored
+        migrated += 1
+
+    await session.commit()
+    return (migrated, missing)
+
+async def migrate_avatars(session: AsyncSession, root: str) -> Tuple[int, int]:
+    """Returns (migrated, missing) numbers of avatars. Legacy `avatar_image_name` is user id without extension"""
+    legacy_files = await _legacy_files(root=root)
+    users = (await session.execute(
+        select(User).where(User.avatar_image_name.is_not(None), User.avatar_image_extension.is_(None))
+    )).scalars().all()
+    migrated = missing = 0
+
+    for user in users:
+        stored = await _migrate_file(root=root, name=user.user_id, legacy_files=legacy_files)
+        if not stored:
+            # Avatar is gone. Don't keep pointing at it
+            user.avatar_image_name = None
+            missing += 1
+            continue
+
+        user.avatar_image_name, user.avatar_image_extension, user.avatar_image_size = stored
+        migrated += 1
+
+    await session.commit()
+    return (migrated, missing)
+
+async def main(mode: Literal["prod", "test"]) -> None:
+    if USE_S3:
+        # S3 object keys are image names and user ids already. Nothing to move
+        print("USE_S3 is set. Local media migration skipped")
+        return
+
+    posts_root, avatars_root = (MEDIA_POST_IMAGE_PATH, MEDIA_AVATAR_PATH) if mode == "prod" else (MEDIA_POST_IMAGE_PATH_TEST, MEDIA_AVATAR_PATH_TEST)
+
+    engine = await create_engine(mode=mode)
+    try:
+        async with create_sessionmaker(engine=engine)() as session:
+            report: List[str] = []
+            for kind, migrate, root in (("post images", migrate_post_images, posts_root), ("avatars", migrate_avatars, avatars_root)):
+                migrated, missing = await migrate(session=session, root=root)
+                report.append(f"{kind}: {migrated} migrated, {missing} without file")
+            print(" | ".join(report))
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(mode=sys.argv[1] if len(sys.argv) > 1 else "prod"))
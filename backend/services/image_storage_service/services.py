@@ -3,25 +3,40 @@ import mimetypes
 from abc import ABC, abstractmethod
 
 from services.redis_service import RedisService
+from .url_cache import PresignedURLCache
+from .variants import generate_variants, variant_name, pick_variant_width, IMAGE_VARIANT_SIZES, VARIANT_EXTENSION, VARIANT_CONTENT_TYPE
 
 from aiobotocore.session import get_session
+from aiobotocore.config import AioConfig
 from botocore.exceptions import HTTPClientError
 import os
 from dotenv import load_dotenv
-from contextlib import asynccontextmanager
-from typing import List, Literal, Dict
-import glob
+from contextlib import asynccontextmanager, AsyncExitStack
+from typing import List, Literal, Dict, Any, Iterable, Mapping, NamedTuple, Tuple
+import hashlib
+import logging
+import asyncio
+import time
 
 from exceptions.custom_exceptions import *
 
 # LocalStorage service can't be async. So I use aiofiles's run_in_executor() wrap
 import aiofiles
+import aiofiles.os
 
 load_dotenv()
 POST_IMAGE_MAX_SIZE_MB = int(os.getenv("POST_IMAGE_MAX_SIZE_MB", "25"))
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
 S3_BUCKET_NAME_TEST = os.getenv("S3_BUCKET_NAME_TEST")
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))
+S3_CONNECT_TIMEOUT_SECONDS = float(os.getenv("S3_CONNECT_TIMEOUT_SECONDS", "5"))
+S3_READ_TIMEOUT_SECONDS = float(os.getenv("S3_READ_TIMEOUT_SECONDS", "30"))
+S3_KEEPALIVE_TIMEOUT_SECONDS = float(os.getenv("S3_KEEPALIVE_TIMEOUT_SECONDS", "60"))
+S3_RETRY_MAX_ATTEMPTS = int(os.getenv("S3_RETRY_MAX_ATTEMPTS", "3"))
+S3_RETRY_MODE = os.getenv("S3_RETRY_MODE", "standard")
 IMAGE_VIEW_ACCES_SECONDS = int(os.getenv("IMAGE_VIEW_ACCES_SECONDS", "180"))
+# Presigned URLs are cached and reused, so they live longer than local storage tokens
+S3_PRESIGNED_URL_EXPIRY_SECONDS = int(os.getenv("S3_PRESIGNED_URL_EXPIRY_SECONDS", "3600"))
 MAX_NUMBER_POST_IMAGES = int(os.getenv("MAX_NUMBER_POST_IMAGES", "3"))
 
 MEDIA_AVATAR_PATH = os.getenv("MEDIA_AVATAR_PATH", "media/users/")
@@ -44,11 +59,86 @@ for i, ext in enumerate(ALLOWED_EXTENSIONS):
 class DuplicateImagesExists(Exception):
     pass
 
+class StoredImage(NamedTuple):
+    """What storage actually wrote. Persist it - storage never searches for files later. `variants` - extension of size variants, None - not generated"""
+    filename: str
+    extension: str
+    size: int
+    variants: str | None = None
+
+class ImageRef(NamedTuple):
+    """Persisted columns storage needs to address image and its variants. Values of URL and delete APIs mappings"""
+    filename: str | None
+    variants: str | None = None
+
+    @classmethod
+    def of_post_image(cls, post_image: Any) -> "ImageRef":
+        return cls(filename=post_image.image_filename, variants=post_image.image_variants)
+
+    @classmethod
+    def of_avatar(cls, user: Any) -> "ImageRef | None":
+        """None - user has no avatar"""
+        if not user.avatar_image_name:
+            return None
+        return cls(filename=user.avatar_image_name, variants=user.avatar_image_variants)
+
+class MediaURLs(NamedTuple):
+    """URLs of one response page resolved at once. Images and avatars that don't exist are absent"""
+    post_images: Dict[str, str]
+    avatars: Dict[str, str]
+
+# Process-wide S3 client. Creating client resolves credentials and endpoints - too costly to do per operation
+_s3_client: Any = None
+_s3_client_stack: AsyncExitStack | None = None
+_s3_client_lock = asyncio.Lock()
+
+
+async def open_s3_client() -> Any:
+    """
+    Returns shared S3 client. Creates it on first call - open it in FastAPI lifespan \n
+    Keeps up to `S3_MAX_POOL_CONNECTIONS` keep-alive connections. Throttling and transient errors are retried
+    """
+    global _s3_client, _s3_client_stack
+
+    if _s3_client is not None:
+        return _s3_client
+
+    async with _s3_client_lock:
+        # Other coroutine could open client while we were waiting for the lock
+        if _s3_client is None:
+            config = AioConfig(
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                connect_timeout=S3_CONNECT_TIMEOUT_SECONDS,
+                read_timeout=S3_READ_TIMEOUT_SECONDS,
+                retries={"max_attempts": S3_RETRY_MAX_ATTEMPTS, "mode": S3_RETRY_MODE},
+                connector_args={"keepalive_timeout": S3_KEEPALIVE_TIMEOUT_SECONDS},
+            )
+            stack = AsyncExitStack()
+            _s3_client = await stack.enter_async_context(get_session().create_client("s3", config=config))
+            _s3_client_stack = stack
+    return _s3_client
+
+async def close_s3_client() -> None:
+    """Closes shared S3 client connections. Call on app shutdown"""
+    global _s3_client, _s3_client_stack
+
+    if _s3_client_stack is not None:
+        await _s3_client_stack.aclose()
+    _s3_client = None
+    _s3_client_stack = None
+
+def fanout_path(filename: str) -> str:
+    """
+    Local storage path of file relative to media directory - `ab/cd/filename` \n
+    Two levels of 256 subdirectories picked by filename hash keep every directory small whatever the number of images.
+    """
+    digest = hashlib.md5(filename.encode()).hexdigest()
+    return os.path.join(digest[:2], digest[2:4], filename)
+
 # ================================
 
 #TODO: Remove _validate_image_mime duplicates
 #TODO: webp format not working
-#TODO: Redis must save full image name with extension
 
 class ImageStorageABC(ABC):
     @staticmethod
@@ -59,32 +149,66 @@ class ImageStorageABC(ABC):
     def _guess_mime(file_bytes: bytes) -> str:
         return magic.from_buffer(buffer=file_bytes, mime=True)
 
+    @staticmethod
+    def _get_extension(content_type: str, image_name: str) -> str:
+         # Return value is a string giving a filename extension, including the leading dot ('.') / mimetypes.guess_extension()
+        extension = mimetypes.guess_extension(type=content_type)
+        if not extension:
+            raise InvalidFileMimeType(detail=f"Image Storage: User {image_name} tried to upload image with corrupted mime type - {content_type}", client_safe_detail=f"Invalid image type. Allowed only - {ALLOWED_EXTENSIONS}")
+        return extension
+
+    @staticmethod
+    async def _render_variants(contents: bytes, image_name: str) -> List[Tuple[int, bytes]]:
+        """Size variants from process pool. Image that can't be re-encoded is kept as original only"""
+        try:
+            return await generate_variants(contents=contents)
+        except Exception as e:
+            logging.log(level=logging.WARNING, msg=f"Image Storage: Failed to render variants of image {image_name}. Only original is stored. {e}")
+            return []
+
+    @staticmethod
+    def _variant_names(image_name: str, image: ImageRef | None) -> List[str]:
+        """Names (without extension) of all stored variants of image"""
+        if not image or not image.variants:
+            return []
+        return [variant_name(image_name=image_name, width=width) for width in IMAGE_VARIANT_SIZES]
+
     @abstractmethod
-    def upload_images_post(self, contents: bytes, content_type: str, image_name: str):
+    def upload_images_post(self, contents: bytes, content_type: str, image_name: str) -> StoredImage:
         """
         Use for uploading and image updating. \n S3 Has only PUT options. \n
-        N_image indicates number of image uploaded.
+        N_image indicates number of image uploaded. Size variants are generated and stored next to original.
         """
 
     @abstractmethod
-    async def upload_avatar_user(self, contents: bytes, content_type: str, image_name: str) -> None:
-        """Use for uploading and image updating. \n S3 Has only PUT options."""
+    async def upload_avatar_user(self, contents: bytes, content_type: str, image_name: str) -> StoredImage:
+        """Use for uploading and image updating. \n S3 Has only PUT options. Size variants are generated and stored next to original."""
 
     @abstractmethod
-    async def delete_post_images(self, image_name: str) -> None:
-        """Delete n's post image. If no image - pass"""
+    async def delete_post_images(self, post_images: Mapping[str, ImageRef | None]) -> None:
+        """`post_images` - image name -> persisted image. Deletes variants too. Missing images - pass"""
 
     @abstractmethod
-    async def delete_avatar_user(self, user_id: str) -> None:
-        """Deletes user avatar. If not image - pass"""
+    async def delete_avatar_user(self, user_id: str, image: ImageRef | None) -> None:
+        """Deletes avatar with its variants. If not image - pass"""
 
     @abstractmethod
-    async def get_post_image_urls(self, images_names: str) -> List[str]:
+    async def get_media_urls(self, post_images: Mapping[str, ImageRef | None] | None = None, avatars: Mapping[str, ImageRef | None] | None = None, size: int | None = None) -> MediaURLs:
+        """
+        Resolves temporary URLs of all post images and user avatars of response page in one pass \n
+        Keys - image names and user ids, values - persisted images (`ImageRef`). None - not stored. \n
+        `size` - longest side in px the client needs. Nearest covering variant is served. None or image without variants - original.
+        """
+
+    async def get_post_image_urls(self, post_images: Mapping[str, ImageRef | None], size: int | None = None) -> List[str]:
         """Get temprorary n's post image URL with jwt token in URL including. Returns empty list, if not post image"""
+        urls = await self.get_media_urls(post_images=post_images, size=size)
+        return [urls.post_images[image_name] for image_name in post_images if image_name in urls.post_images]
 
-    @abstractmethod
-    async def get_user_avatar_url(self, user_id: str) -> str | None:
+    async def get_user_avatar_url(self, user_id: str, image: ImageRef | None, size: int | None = None) -> str | None:
         """Returns temprorary user avatar URL. Returns None, if no user avatar"""
+        urls = await self.get_media_urls(avatars={user_id: image}, size=size)
+        return urls.avatars.get(user_id)
 
 # =======================
 
@@ -109,8 +233,10 @@ class S3Storage(ImageStorageABC):
         
         return True
 
-    def __init__(self, mode: Literal["prod", "test"]):
-        self._session = get_session()
+    def __init__(self, mode: Literal["prod", "test"], Redis: RedisService | None = None):
+        """`Redis` - shared presigned URLs cache tier. None - only in-process cache is used"""
+        self._Redis = Redis
+        self._url_cache = PresignedURLCache()
 
         if mode == "prod": self._bucket_name = S3_BUCKET_NAME
         elif mode == "test": self._bucket_name = S3_BUCKET_NAME_TEST
@@ -118,100 +244,138 @@ class S3Storage(ImageStorageABC):
 
     @asynccontextmanager
     async def _client(self):
-        async with self._session.create_client("s3") as client:
-            yield client
+        """Shared process-wide client. It isn't closed here"""
+        yield await open_s3_client()
     
     def _define_boto_Params(self, key: str) -> Dict[str, str]:
         return {
             "Bucket": self._bucket_name, "Key": key
         }
 
-    async def upload_images_post(self, contents: bytes, content_type: str, image_name: str) -> None:
-        async with self._client() as s3:
-                mime_type = content_type
-
-                if not self._validate_image_mime(image_bytes=contents, specified_mime=mime_type):
-                    raise InvalidFileMimeType(f"S3 Storage: Invalid image type. Allowed only - {ALLOWED_EXTENSIONS}")
-                
-                if not self._validate_file_size(bytes_obj=contents):
-                    raise InvalidResourceProvided(f"S3 Storage: Image is too big. Size up to {POST_IMAGE_MAX_SIZE_MB}mb")
-                
-                try:
-                    await s3.put_object(
-                        Bucket=self._bucket_name,
-                        Key=image_name,
-                        Body=contents,
-                        ContentType=mime_type
-                    )
-                except Exception as e:
-                    raise MediaError(f"S3 Storage: Failed to upload post image: {e}") from e
+    def _cache_key(self, key: str) -> str:
+        return f"{self._bucket_name}/{key}"
+
+    async def _invalidate_urls(self, key: str) -> None:
+        """Object changed. Cached URL would be served from client caches with old content"""
+        await self._url_cache.invalidate(keys=[self._cache_key(key=key)], Redis=self._Redis)
+
+    async def _presign_cached(self, keys: List[str]) -> Dict[str, str]:
+        """Object key -> URL. Cached URLs with enough time to live are reused, only the rest get signed"""
+        cache_keys = {self._cache_key(key=key): key for key in keys}
+        cached = await self._url_cache.get_many(keys=cache_keys, Redis=self._Redis)
+        urls = {cache_keys[cache_key]: url for cache_key, url in cached.items()}
+
+        missing = [key for cache_key, key in cache_keys.items() if cache_key not in cached]
+        if not missing:
+            return urls
 
-    async def upload_avatar_user(self, contents: bytes, mime_type: str, image_name: str) -> None:
+        # Taken before signing - real expiry is never earlier
+        expires_at = time.time() + S3_PRESIGNED_URL_EXPIRY_SECONDS
+        signed = {}
         async with self._client() as s3:
-            if not self._validate_image_mime(image_bytes=contents, specified_mime=mime_type):
-                raise InvalidFileMimeType(detail=f"S3 Storage: User {image_name} tried to upload avatar with wrong mime type", client_safe_detail=f"Invalid image type. Allowed only - {ALLOWED_EXTENSIONS}")
-            
-            if not self._validate_file_size(bytes_obj=contents):
-                raise InvalidResourceProvided(detail=f"S3 Storage: User {image_name} tried to uploaded avatar bigger than {POST_IMAGE_MAX_SIZE_MB}mb", client_safe_detail=f"Image is too big. Size up to {POST_IMAGE_MAX_SIZE_MB}mb")
-            
-            try:
-                await s3.put_object(
-                    Bucket=self._bucket_name,
-                    Key=image_name,
-                    Body=contents,
-                    ContentType=mime_type
-                )
-            except Exception as e:
-                raise MediaError(f"S3 Storage: Failed to upload user image: {e}") from e
+            for key in missing:
+                signed[key] = await s3.generate_presigned_url("get_object", Params=self._define_boto_Params(key=key), ExpiresIn=S3_PRESIGNED_URL_EXPIRY_SECONDS)
+
+        await self._url_cache.set_many(urls={self._cache_key(key=key): (url, expires_at) for key, url in signed.items()}, Redis=self._Redis)
+        urls.update(signed)
+        return urls
 
-    # TODO: DRY this below    
-    async def delete_post_images(self, image_name: str) -> None:
+    async def _put_object(self, key: str, contents: bytes, content_type: str) -> None:
         async with self._client() as s3:
-            try:
-                await s3.delete_object(
-                    Bucket=self._bucket_name,
-                    Key=image_name
-                )
-            except Exception as e:
-                raise MediaError(f"S3 Storage: Failed to delete post image: {e}") from e
+            await s3.put_object(
+                Bucket=self._bucket_name,
+                Key=key,
+                Body=contents,
+                ContentType=content_type
+            )
+        await self._invalidate_urls(key=key)
+
+    async def _upload(self, contents: bytes, content_type: str, image_name: str) -> StoredImage:
+        """Original under image name, variants under `variant_name()` keys"""
+        extension = self._get_extension(content_type=content_type, image_name=image_name)
+        variants = await self._render_variants(contents=contents, image_name=image_name)
+
+        await self._put_object(key=image_name, contents=contents, content_type=content_type)
+        for width, variant_contents in variants:
+            await self._put_object(key=variant_name(image_name=image_name, width=width), contents=variant_contents, content_type=VARIANT_CONTENT_TYPE)
+
+        # Object key is the image name itself
+        return StoredImage(filename=image_name, extension=extension, size=len(contents), variants=VARIANT_EXTENSION if variants else None)
+
+    async def upload_images_post(self, contents: bytes, content_type: str, image_name: str) -> StoredImage:
+        if not self._validate_image_mime(image_bytes=contents, specified_mime=content_type):
+            raise InvalidFileMimeType(f"S3 Storage: Invalid image type. Allowed only - {ALLOWED_EXTENSIONS}")
+        
+        if not self._validate_file_size(bytes_obj=contents):
+            raise InvalidResourceProvided(f"S3 Storage: Image is too big. Size up to {POST_IMAGE_MAX_SIZE_MB}mb")
+        
+        try:
+            return await self._upload(contents=contents, content_type=content_type, image_name=image_name)
+        except ClientSafeServiceError:
+            raise
+        except Exception as e:
+            raise MediaError(f"S3 Storage: Failed to upload post image: {e}") from e
+
+    async def upload_avatar_user(self, contents: bytes, content_type: str, image_name: str) -> StoredImage:
+        if not self._validate_image_mime(image_bytes=contents, specified_mime=content_type):
+            raise InvalidFileMimeType(detail=f"S3 Storage: User {image_name} tried to upload avatar with wrong mime type", client_safe_detail=f"Invalid image type. Allowed only - {ALLOWED_EXTENSIONS}")
+        
+        if not self._validate_file_size(bytes_obj=contents):
+            raise InvalidResourceProvided(detail=f"S3 Storage: User {image_name} tried to uploaded avatar bigger than {POST_IMAGE_MAX_SIZE_MB}mb", client_safe_detail=f"Image is too big. Size up to {POST_IMAGE_MAX_SIZE_MB}mb")
+        
+        try:
+            return await self._upload(contents=contents, content_type=content_type, image_name=image_name)
+        except ClientSafeServiceError:
+            raise
+        except Exception as e:
+            raise MediaError(f"S3 Storage: Failed to upload user image: {e}") from e
 
-    async def delete_avatar_user(self, user_id: str) -> None:
+    async def _delete_object(self, key: str) -> None:
         async with self._client() as s3:
             try:
                 await s3.delete_object(
                     Bucket=self._bucket_name,
-                    Key=user_id
+                    Key=key
                 )
             except Exception as e:
-                raise MediaError(f"S3 Storage: Failed to delete user avatar: {e}") from e
+                raise MediaError(f"S3 Storage: Failed to delete object {key}: {e}") from e
+            await self._invalidate_urls(key=key)
 
-    async def get_post_image_urls(self, images_names: List[str]) -> List[str]:
-        async with self._client() as s3:
-            urls = []
-            for image_name in images_names:
-                try:
-                    url = await s3.generate_presigned_url(
-                        "get_object",
-                        Params=self._define_boto_Params(key=image_name),
-                        ExpiresIn=IMAGE_VIEW_ACCES_SECONDS
-                    )
-                    if url:
-                        urls.append(url)
-                except Exception as e:
-                    raise MediaError(f"S3 Storage: Failed to get post images presigned URLs. Images names: {images_names}. Exception: {e}") from e
-            
-            return urls
+    async def delete_post_images(self, post_images: Mapping[str, ImageRef | None]) -> None:
+        """Object keys are image names. Rows uploaded before filenames were persisted are deleted too"""
+        for image_name, image in post_images.items():
+            for key in [image_name, *self._variant_names(image_name=image_name, image=image)]:
+                await self._delete_object(key=key)
 
-    async def get_user_avatar_url(self, user_id: str) -> str:
-        async with self._client() as s3:
-            try:
-                return await s3.generate_presigned_url(
-                    "get_object",
-                    Params=self._define_boto_Params(key=user_id),
-                    ExpiresIn=IMAGE_VIEW_ACCES_SECONDS
-                )
-            except Exception as e:
-                raise MediaError(f"S3 Storage: Failed to get user avatar presigned. Image name - {user_id}. Exception: {e}") from e
+    async def delete_avatar_user(self, user_id: str, image: ImageRef | None) -> None:
+        if not image:
+            return
+        for key in [user_id, *self._variant_names(image_name=user_id, image=image)]:
+            await self._delete_object(key=key)
+
+    @staticmethod
+    def _object_key(image_name: str, image: ImageRef | None, size: int | None) -> str:
+        if size and image and image.variants:
+            return variant_name(image_name=image_name, width=pick_variant_width(size=size))
+        return image_name
+
+    async def get_media_urls(self, post_images: Mapping[str, ImageRef | None] | None = None, avatars: Mapping[str, ImageRef | None] | None = None, size: int | None = None) -> MediaURLs:
+        """
+        Presigning is local signing - no S3 requests. Object keys - image names and user ids \n
+        Every post image row has its object. Users without avatar aren't signed
+        """
+        images_keys = {image_name: self._object_key(image_name=image_name, image=image, size=size) for image_name, image in (post_images or {}).items()}
+        avatars_keys = {user_id: self._object_key(image_name=user_id, image=image, size=size) for user_id, image in (avatars or {}).items() if image}
+
+        try:
+            urls = await self._presign_cached(keys=list(images_keys.values()) + list(avatars_keys.values()))
+        except Exception as e:
+            raise MediaError(f"S3 Storage: Failed to get presigned URLs. Images: {images_keys}. Avatars: {avatars_keys}. Exception: {e}") from e
+
+        return MediaURLs(
+            post_images={image_name: urls[key] for image_name, key in images_keys.items()},
+            avatars={user_id: urls[key] for user_id, key in avatars_keys.items()}
+        )
 
 import secrets
 
@@ -258,95 +422,97 @@ class LocalStorage(ImageStorageABC):
             raise InvalidResourceProvided(detail=f"Local Storage: User {image_name} tried to uploaded avatar bigger than {POST_IMAGE_MAX_SIZE_MB}mb", client_safe_detail=f"Image is too big. Size up to {POST_IMAGE_MAX_SIZE_MB}mb")
 
     @staticmethod
-    async def _get_extension(content_type: str, image_name: str) -> str:
-         # Return value is a string giving a filename extension, including the leading dot ('.') / mimetypes.guess_extension()
-        extension = mimetypes.guess_extension(type=content_type)
-        if not extension:
-            raise InvalidFileMimeType(detail=f"Local Storage: User {image_name} tried to upload post image with corrupted mime type - {content_type}", client_safe_detail=f"Invalid image type. Allowed only - {ALLOWED_EXTENSIONS}")
-        return extension
+    async def _write_file(root: str, filename: str, contents: bytes) -> None:
+        """Writes into temporary file and renames it. Readers never see half written image"""
+        filepath = os.path.join(root, fanout_path(filename=filename))
+        temporary_filepath = f"{filepath}.tmp"
 
-    async def upload_images_post(self, contents: bytes, content_type: str, image_name: str) -> None:
-        await self._validate_image(contents=contents, content_type=content_type, image_name=image_name)
-        extension = await self._get_extension(content_type=content_type, image_name=image_name)
+        await aiofiles.os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        async with aiofiles.open(file=temporary_filepath, mode="wb") as file_:
+            await file_.write(contents)
+        await aiofiles.os.replace(temporary_filepath, filepath)
 
+    @staticmethod
+    async def _remove_file(root: str, filename: str) -> None:
         try:
-            async with aiofiles.open(file=f"{self.__media_post_path}/{image_name}{extension}", mode="wb") as file_:
-                await file_.write(contents)
-        except Exception as e:
-                raise MediaError(f"Local Storage: Failed write post image localy. Image name - {image_name}. Exception - {e}") from e
+            await aiofiles.os.remove(os.path.join(root, fanout_path(filename=filename)))
+        except FileNotFoundError:
+            return
 
-    async def upload_avatar_user(self, contents: bytes, content_type: str, image_name: str) -> None:
+    async def _upload(self, root: str, contents: bytes, content_type: str, image_name: str) -> StoredImage:
         await self._validate_image(contents=contents, content_type=content_type, image_name=image_name)
-        extension = await self._get_extension(content_type=content_type, image_name=image_name)
-        
+        extension = self._get_extension(content_type=content_type, image_name=image_name)
+        filename = f"{image_name}{extension}"
+        variants = await self._render_variants(contents=contents, image_name=image_name)
+
         try:
-            async with aiofiles.open(file=f"{self.__media_avatar_path}/{image_name}{extension}", mode="wb") as file_:
-                await file_.write(contents)
+            await self._write_file(root=root, filename=filename, contents=contents)
+            for width, variant_contents in variants:
+                await self._write_file(root=root, filename=f"{variant_name(image_name=image_name, width=width)}{VARIANT_EXTENSION}", contents=variant_contents)
         except Exception as e:
-            raise MediaError(f"Local Storage: Failed write user avatar localy. Image name - {image_name}. Exception - {e}") from e
+            raise MediaError(f"Local Storage: Failed write image localy. Image name - {image_name}. Exception - {e}") from e
 
-    
-    async def delete_post_images(self, base_name: str) -> None:
-        """Pass to `base_name` image name that includes same part, like post_id without image ordinal number"""
-        # Whe don't know file extension. So we need to find it using glob and image_name*
-
-        filenames = glob.glob(f"{base_name}*", root_dir=self.__media_post_path)
-        for filename in filenames:
-            filepath = f"{self.__media_post_path}{filename}"
+        return StoredImage(filename=filename, extension=extension, size=len(contents), variants=VARIANT_EXTENSION if variants else None)
 
-            if os.path.exists(path=filepath):
-                try:
-                    os.remove(path=filepath)
-                except Exception as e:
-                  raise MediaError(f"Local Storage: Failed delete post image localy. Filepath - {filename}. Exception - {e}") from e
-            else:
-                return
+    async def upload_images_post(self, contents: bytes, content_type: str, image_name: str) -> StoredImage:
+        return await self._upload(root=self.__media_post_path, contents=contents, content_type=content_type, image_name=image_name)
 
-    
-    async def delete_avatar_user(self, user_id: str) -> None:
-        # Program does not know the file extension. So we need to find it using glob and image_name*
-        filenames = glob.glob(f"{user_id}*", root_dir=self.__media_avatar_path)
+    async def upload_avatar_user(self, contents: bytes, content_type: str, image_name: str) -> StoredImage:
+        return await self._upload(root=self.__media_avatar_path, contents=contents, content_type=content_type, image_name=image_name)
 
-        if not filenames:
-            return
-        
-        if len(filenames) > 1:
-            raise ValueError("Multiple images was found. Aborting.")
+    def _stored_filenames(self, image_name: str, image: ImageRef | None) -> List[str]:
+        """Original and variants filenames"""
+        if not image or not image.filename:
+            return []
+        return [image.filename, *(f"{name}{image.variants}" for name in self._variant_names(image_name=image_name, image=image))]
 
-        filename = filenames[0]
-        filepath = f"{self.__media_avatar_path}{filename}"
+    async def delete_post_images(self, post_images: Mapping[str, ImageRef | None]) -> None:
+        for image_name, image in post_images.items():
+            for filename in self._stored_filenames(image_name=image_name, image=image):
+                try:
+                    await self._remove_file(root=self.__media_post_path, filename=filename)
+                except Exception as e:
+                    raise MediaError(f"Local Storage: Failed delete post image localy. Filename - {filename}. Exception - {e}") from e
 
-        if os.path.exists(path=filepath):
+    async def delete_avatar_user(self, user_id: str, image: ImageRef | None) -> None:
+        for filename in self._stored_filenames(image_name=user_id, image=image):
             try:
-                os.remove(path=filepath)
+                await self._remove_file(root=self.__media_avatar_path, filename=filename)
             except Exception as e:
-                raise MediaError(f"Local Storage: Failed delete user avatar localy. Filepath - {filename}. Exception - {e}") from e
-        else:
-            return
-
-    async def get_post_image_urls(self, images_names: List[str]) -> List[str]:
-        urls = []
-        for provided_filename in images_names:
-            urfsafe_token = self._generate_url_token()
+                raise MediaError(f"Local Storage: Failed delete user avatar localy. Filename - {filename}. Exception - {e}") from e
 
-            filenames = glob.glob(pathname=f"{provided_filename}*", root_dir=self.__media_post_path)
-            if not filenames:
-                continue
-            filename = filenames[0]
+    @staticmethod
+    def _served_filename(image_name: str, image: ImageRef | None, size: int | None) -> str | None:
+        if not image or not image.filename:
+            return None
+        if size and image.variants:
+            return f"{variant_name(image_name=image_name, width=pick_variant_width(size=size))}{image.variants}"
+        return image.filename
 
-            await self._Redis.save_url_post_token(image_token=urfsafe_token, image_name=filename)
-            url = f"{BASE_URL}{MEDIA_POST_IMAGE_URI}{urfsafe_token}"
-            urls.append(url)
-        return urls
+    async def get_media_urls(self, post_images: Mapping[str, ImageRef | None] | None = None, avatars: Mapping[str, ImageRef | None] | None = None, size: int | None = None) -> MediaURLs:
+        """
+        Every stored image gets own acces token. All tokens are saved in one Redis round trip \n
+        Token points to file path relative to media directory. Disk isn't touched
+        """
+        post_tokens: Dict[str, str] = {}
+        user_tokens: Dict[str, str] = {}
+        urls = MediaURLs(post_images={}, avatars={})
 
-    async def get_user_avatar_url(self, user_id: str) -> str | None:
-        urlsafe_token = self._generate_url_token()
+        for image_name, image in (post_images or {}).items():
+            filename = self._served_filename(image_name=image_name, image=image, size=size)
+            if not filename:
+                continue
+            urlsafe_token = self._generate_url_token()
+            post_tokens[urlsafe_token] = fanout_path(filename=filename)
+            urls.post_images[image_name] = f"{BASE_URL}{MEDIA_POST_IMAGE_URI}{urlsafe_token}"
 
-        # Searching for potential 
-        filenames = glob.glob(f"{user_id}*", root_dir=self.__media_avatar_path)
-        if not filenames:
-            return None
-        filename = filenames[0]
+        for user_id, image in (avatars or {}).items():
+            filename = self._served_filename(image_name=user_id, image=image, size=size)
+            if not filename:
+                continue
+            urlsafe_token = self._generate_url_token()
+            user_tokens[urlsafe_token] = fanout_path(filename=filename)
+            urls.avatars[user_id] = f"{BASE_URL}{USER_AVATAR_URI}{urlsafe_token}"
 
-        await self._Redis.save_url_user_token(image_token=urlsafe_token, image_name=filename)
-        return f"{BASE_URL}{USER_AVATAR_URI}{urlsafe_token}"
+        await self._Redis.save_url_tokens(post_tokens=post_tokens, user_tokens=user_tokens)
+        return urls
@@ -0,0 +1,117 @@
+from services.redis_service import RedisService
+from exceptions.custom_exceptions import RedisError
+
+from collections import OrderedDict
+from typing import Dict, Iterable, Tuple
+from dotenv import load_dotenv
+from os import getenv
+import logging
+import time
+
+load_dotenv()
+
+PRESIGNED_URL_CACHE_MAX_SIZE = int(getenv("PRESIGNED_URL_CACHE_MAX_SIZE", "20000"))
+PRESIGNED_URL_SAFETY_MARGIN_SECONDS = int(getenv("PRESIGNED_URL_SAFETY_MARGIN_SECONDS", "600"))
+PRESIGNED_URL_CACHE_USE_REDIS = getenv("PRESIGNED_URL_CACHE_USE_REDIS", "False").lower().strip() == "true"
+
+
+class PresignedURLCache:
+    """
+    In-process bounded LRU cache of presigned URLs. Key - object key, value - (URL, expiry unix timestamp) \n
+    URL is reused only while it has more than `PRESIGNED_URL_SAFETY_MARGIN_SECONDS` to live, so client always has time to load it. \n
+    Pass `Redis` to share URLs between workers. Redis tier is optional - if it fails, only in-process cache is used.
+    """
+
+    _instance = None
+    _isinitialized = False
+
+    def __new__(cls):
+        if not cls._instance:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if self._isinitialized:
+            return
+        self._isinitialized = True
+
+        self._entries: OrderedDict[str, Tuple[str, float]] = OrderedDict()
+
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _is_usable(expires_at: float) -> bool:
+        return expires_at - time.time() > PRESIGNED_URL_SAFETY_MARGIN_SECONDS
+
+    def _set(self, key: str, url: str, expires_at: float) -> None:
+        self._entries[key] = (url, expires_at)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > PRESIGNED_URL_CACHE_MAX_SIZE:
+            self._entries.popitem(last=False)
+
+    async def get_many(self, keys: Iterable[str], Redis: RedisService | None = None) -> Dict[str, str]:
+        """Returns usable URLs of found keys. Missing keys must be signed and `set_many()`"""
+        found: Dict[str, str] = {}
+        missing = []
+
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry and self._is_usable(expires_at=entry[1]):
+                self._entries.move_to_end(key)
+                found[key] = entry[0]
+                self.hits += 1
+                continue
+
+            if entry: del self._entries[key]
+            missing.append(key)
+
+        if missing and Redis:
+            try:
+                shared_entries = await Redis.get_presigned_urls(keys=missing)
+            except RedisError as e:
+                logging.log(level=logging.WARNING, msg=f"PresignedURLCache: Redis tier read failed: {e}")
+                shared_entries = {}
+
+            for key, (url, expires_at) in shared_entries.items():
+                if self._is_usable(expires_at=expires_at):
+                    self._set(key=key, url=url, expires_at=expires_at)
+                    found[key] = url
+                    self.redis_hits += 1
+
+        self.misses += len([key for key in missing if key not in found])
+        return found
+
+    async def set_many(self, urls: Dict[str, Tuple[str, float]], Redis: RedisService | None = None) -> None:
+        """`urls` - key -> (URL, expiry unix timestamp)"""
+        for key, (url, expires_at) in urls.items():
+            self._set(key=key, url=url, expires_at=expires_at)
+
+        if urls and Redis:
+            try:
+                await Redis.save_presigned_urls(urls=urls, safety_margin_seconds=PRESIGNED_URL_SAFETY_MARGIN_SECONDS)
+            except RedisError as e:
+                logging.log(level=logging.WARNING, msg=f"PresignedURLCache: Redis tier write failed: {e}")
+
+    async def invalidate(self, keys: Iterable[str], Redis: RedisService | None = None) -> None:
+        """Object got overwritten or deleted"""
+        keys = list(keys)
+        for key in keys:
+            self._entries.pop(key, None)
+
+        if keys and Redis:
+            try:
+                await Redis.delete_presigned_urls(keys=keys)
+            except RedisError as e:
+                logging.log(level=logging.WARNING, msg=f"PresignedURLCache: Redis tier invalidation failed: {e}")
+
+    def get_statistics(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": PRESIGNED_URL_CACHE_MAX_SIZE,
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+        }
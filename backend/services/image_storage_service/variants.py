@@ -0,0 +1,124 @@
+from PIL import Image, ImageOps
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+from dotenv import load_dotenv
+from os import getenv
+import multiprocessing
+import asyncio
+import io
+
+load_dotenv()
+
+# Longest side of generated variants, px. Original is always kept too
+IMAGE_VARIANT_SIZES = sorted(int(size) for size in getenv("IMAGE_VARIANT_SIZES", "160,480,1080").split(","))
+IMAGE_VARIANT_FORMAT = getenv("IMAGE_VARIANT_FORMAT", "WEBP").upper().strip()
+IMAGE_VARIANT_QUALITY = int(getenv("IMAGE_VARIANT_QUALITY", "80"))
+# Decoding and encoding hold GIL. So processes, not threads
+IMAGE_PROCESSING_WORKERS = int(getenv("IMAGE_PROCESSING_WORKERS", "2"))
+
+# Sizes callers request. Nearest bigger variant is served
+IMAGE_SIZE_AVATAR = int(getenv("IMAGE_SIZE_AVATAR", "160"))
+IMAGE_SIZE_POST_CARD = int(getenv("IMAGE_SIZE_POST_CARD", "480"))
+IMAGE_SIZE_POST_DETAIL = int(getenv("IMAGE_SIZE_POST_DETAIL", "1080"))
+
+# Format -> (extension, content type, encoder options)
+VARIANT_FORMATS: Dict[str, Tuple[str, str, Dict[str, Any]]] = {
+    "WEBP": (".webp", "image/webp", {"method": 4}),
+    "JPEG": (".jpg", "image/jpeg", {"optimize": True, "progressive": True}),
+}
+if IMAGE_VARIANT_FORMAT not in VARIANT_FORMATS:
+    raise ValueError(f"Invalid IMAGE_VARIANT_FORMAT dotenv variable value. Allowed - {list(VARIANT_FORMATS)}")
+
+VARIANT_EXTENSION, VARIANT_CONTENT_TYPE, _VARIANT_ENCODER_OPTIONS = VARIANT_FORMATS[IMAGE_VARIANT_FORMAT]
+
+_executor: ProcessPoolExecutor | None = None
+_semaphore = asyncio.Semaphore(IMAGE_PROCESSING_WORKERS)
+_statistics = {"queued": 0, "in_progress": 0, "failed": 0}
+
+
+def variant_name(image_name: str, width: int) -> str:
+    """Storage name of variant without extension. S3 object key / local filename stem"""
+    return f"{image_name}_{width}"
+
+def pick_variant_width(size: int) -> int:
+    """Smallest variant that still covers requested size. Largest one, if none does"""
+    for width in IMAGE_VARIANT_SIZES:
+        if width >= size:
+            return width
+    return IMAGE_VARIANT_SIZES[-1]
+
+def render_variants(contents: bytes) -> List[Tuple[int, bytes]]:
+    """
+    Runs in worker process. Returns (width, encoded bytes) of every variant size \n
+    Orientation from EXIF is applied to pixels, then all metadata (EXIF, ICC, XMP) is dropped - it's never passed to encoder.
+    Images smaller than variant size aren't upscaled, only re-encoded.
+    """
+    with Image.open(io.BytesIO(contents)) as image:
+        image = ImageOps.exif_transpose(image)
+
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        if IMAGE_VARIANT_FORMAT == "JPEG" or not has_alpha:
+            if has_alpha:
+                # JPEG has no alpha. Transparent areas become white, not black
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", image.size, (255, 255, 255))
+                image.paste(rgba, mask=rgba.getchannel("A"))
+            else:
+                image = image.convert("RGB")
+        else:
+            image = image.convert("RGBA")
+
+        variants = []
+        # Biggest first - every next one is resized from previous, not from original
+        for width in reversed(IMAGE_VARIANT_SIZES):
+            image.thumbnail((width, width), Image.Resampling.LANCZOS)
+
+            output = io.BytesIO()
+            image.save(output, format=IMAGE_VARIANT_FORMAT, quality=IMAGE_VARIANT_QUALITY, **_VARIANT_ENCODER_OPTIONS)
+            variants.append((width, output.getvalue()))
+
+    return variants[::-1]
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+
+    if _executor is None:
+        # Forking process with running event loop and threads isn't safe
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_PROCESSING_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+async def generate_variants(contents: bytes) -> List[Tuple[int, bytes]]:
+    """Renders variants in bounded process pool. Event loop stays free. Raises if image can't be decoded"""
+    _statistics["queued"] += 1
+    try:
+        await _semaphore.acquire()
+    finally:
+        _statistics["queued"] -= 1
+
+    _statistics["in_progress"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), render_variants, contents)
+    except Exception:
+        _statistics["failed"] += 1
+        raise
+    finally:
+        _statistics["in_progress"] -= 1
+        _semaphore.release()
+
+def shutdown_image_processing() -> None:
+    """Stops worker processes. Call on app shutdown"""
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+
+def get_image_processing_statistics() -> Dict[str, int]:
+    """`queued` - uploads waiting for free worker, `in_progress` - images being rendered right now"""
+    return {
+        "workers": IMAGE_PROCESSING_WORKERS,
+        "queued": _statistics["queued"],
+        "in_progress": _statistics["in_progress"],
+        "failed": _statistics["failed"],
+    }
@@ -5,13 +5,23 @@ from dotenv import load_dotenv
 from os import getenv    
 from .models import Base
 import asyncio
-from typing import Tuple
+from typing import Tuple, Dict
 
 load_dotenv()
 
 RETRIES = int(getenv("RETRIES"))
 DELAY = int(getenv("DELAY"))
 
+POSTGRES_POOL_SIZE = int(getenv("POSTGRES_POOL_SIZE", "10"))
+POSTGRES_MAX_OVERFLOW = int(getenv("POSTGRES_MAX_OVERFLOW", "20"))
+POSTGRES_POOL_TIMEOUT_SECONDS = int(getenv("POSTGRES_POOL_TIMEOUT_SECONDS", "30"))
+POSTGRES_POOL_RECYCLE_SECONDS = int(getenv("POSTGRES_POOL_RECYCLE_SECONDS", "1800"))
+POSTGRES_POOL_PRE_PING = getenv("POSTGRES_POOL_PRE_PING", "True").lower().strip() == "true"
+
+# Process-wide engine and sessionmaker. Built once in FastAPI lifespan via `init_engine()`
+_engine: AsyncEngine | None = None
+_sessionmaker: async_sessionmaker[AsyncSession] | None = None
+
 def define_database_url(mode: str) -> str:
     """ Set mode - "prod" to main database | "test" to test database """
     if mode not in ("prod", "test"):
@@ -28,7 +38,12 @@ async def create_engine(mode: str = "prod", echo=False) -> AsyncEngine:
             print(DATABASE_URL)
             engine = create_async_engine(
                 url=DATABASE_URL,
-                echo=echo
+                echo=echo,
+                pool_size=POSTGRES_POOL_SIZE,
+                max_overflow=POSTGRES_MAX_OVERFLOW,
+                pool_timeout=POSTGRES_POOL_TIMEOUT_SECONDS,
+                pool_recycle=POSTGRES_POOL_RECYCLE_SECONDS,
+                pool_pre_ping=POSTGRES_POOL_PRE_PING
             )
             async with engine.connect() as conn:
                 await conn.execute(text("SELECT 1"))
@@ -54,9 +69,49 @@ async def initialize_models(engine: AsyncEngine, Base: Base) -> None:
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
+async def init_engine(mode: str = "prod") -> AsyncEngine:
+    """
+    Builds process-wide engine and sessionmaker. Call once in FastAPI lifespan. \n
+    Repeated calls return already created engine.
+    """
+    global _engine, _sessionmaker
+
+    if _engine is None:
+        _engine = await create_engine(mode=mode)
+        _sessionmaker = create_sessionmaker(engine=_engine)
+    return _engine
+
+async def dispose_engine() -> None:
+    """Closes all pooled connections. Call on app shutdown."""
+    global _engine, _sessionmaker
+
+    if _engine is not None:
+        await _engine.dispose()
+    _engine = None
+    _sessionmaker = None
+
 async def get_engine() -> AsyncEngine:
-    return await create_engine(mode="prod") 
+    """Returns shared engine. If it wasn't initialized yet (scripts, scheduler before startup) - initializes it in prod mode"""
+    return await init_engine(mode="prod")
 
+async def get_shared_sessionmaker() -> async_sessionmaker[AsyncSession]:
+    await get_engine()
+    return _sessionmaker
 
 def get_sessionlocal(engine: AsyncEngine) -> async_sessionmaker[AsyncSession]:
-    return create_sessionmaker(engine=engine)
\ No newline at end of file
+    return create_sessionmaker(engine=engine)
+
+def get_pool_statistics() -> Dict[str, int | str]:
+    """Returns shared engine connection pool statistics. Empty dict if engine not initialized"""
+    if _engine is None:
+        return {}
+
+    pool = _engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": POSTGRES_MAX_OVERFLOW,
+        "status": pool.status()
+    }
@@ -1,5 +1,5 @@
 from .models import Base
-from .database import get_engine, get_sessionlocal
+from .database import get_shared_sessionmaker
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -43,13 +43,9 @@ async def get_session_depends():
     Automatically closes session.\n
     Use with fastAPI Depends()!
     """
-    try:
-        engine = await get_engine()
-        SessionLocal = get_sessionlocal(engine=engine)
-        async with SessionLocal() as conn:
-            yield conn
-    finally:
-        await engine.dispose()
+    SessionLocal = await get_shared_sessionmaker()
+    async with SessionLocal() as conn:
+        yield conn
 
 def postgres_exception_handler(action: str = "Unknown action with the database"):
     def decorator(func):
@@ -69,12 +65,9 @@ def postgres_exception_handler(action: str = "Unknown action with the database")
     return decorator
 
 async def get_session() -> AsyncSession:
-    try:
-        engine = await get_engine()
-        SessionLocal = get_sessionlocal(engine=engine)
-        return SessionLocal()
-    finally:
-        await engine.dispose()
+    """Returns session from shared pool. Session requires outer close handling!"""
+    SessionLocal = await get_shared_sessionmaker()
+    return SessionLocal()
 
 async def merge_model(postgres_session: AsyncSession, model_obj: ModelT) -> ModelT:
     """Caution! When merging old model. It can clear all loaded relationsghips!"""
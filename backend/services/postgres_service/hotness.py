@@ -0,0 +1,29 @@
+from datetime import datetime
+from dotenv import load_dotenv
+from os import getenv
+import math
+
+load_dotenv()
+
+HOTNESS_HALF_LIFE_SECONDS = int(getenv("HOTNESS_HALF_LIFE_SECONDS", "43200"))
+HOTNESS_NEW_POST_WEIGHT = float(getenv("HOTNESS_NEW_POST_WEIGHT", "5"))
+
+# Fixed reference point of all scores. Never change it - stored scores would become incomparable with new ones
+HOTNESS_EPOCH = datetime(2025, 1, 1)
+
+# Terms that smaller than 2^-60 of the score don't change it in float precision
+HOTNESS_MIN_EXPONENT_DIFF = -60
+
+# Hot score - decayed sum of action weights: sum(weight * 2^(-(now - action_time) / half_life))
+# Instead of decaying all scores every tick, each weight gets scaled up by 2^((action_time - epoch) / half_life) once.
+# Common factor 2^(-(now - epoch) / half_life) doesn't change the order, so plain ORDER BY hot_score is always actual.
+# Stored in log2 space to not overflow: hot_score = log2(sum(weight * 2^((action_time - epoch) / half_life)))
+
+
+def hot_score_exponent(weight: float, at: datetime) -> float:
+    """log2 of scaled action weight. Add it to post score with `PostgresService.add_post_hot_score`"""
+    return math.log2(weight) + (at - HOTNESS_EPOCH).total_seconds() / HOTNESS_HALF_LIFE_SECONDS
+
+def initial_hot_score() -> float:
+    """Fresh post starts with `HOTNESS_NEW_POST_WEIGHT` given at publish time"""
+    return hot_score_exponent(weight=HOTNESS_NEW_POST_WEIGHT, at=datetime.utcnow())
@@ -0,0 +1,34 @@
+from sqlalchemy.orm import selectinload, joinedload
+from .models import Post, User, PostActions, ChatRoom, Message
+
+# Named loader profiles. Each PostgresService method that returns models applies one of them explicitly.
+# Relationship that isn't in profile stays not loaded and raises on access (read LAZY_LOADING in models.py)
+
+# Post card in feeds and lists. Owner, images and short parent post
+POST_FEED_CARD = (
+    joinedload(Post.owner),
+    selectinload(Post.images),
+    selectinload(Post.parent_post).options(joinedload(Post.owner), selectinload(Post.images)),
+)
+
+# Single post page. Replies are loaded separately with pagination
+POST_DETAIL = POST_FEED_CARD
+
+# User profile page, friendship checks and follow/unfollow. Posts are loaded separately with pagination
+USER_PROFILE = (
+    selectinload(User.followers),
+    selectinload(User.followed),
+)
+
+# User history. Only posts columns are used
+ACTION_WITH_POST = (
+    joinedload(PostActions.post),
+)
+
+CHAT_ROOM_PARTICIPANTS = (
+    selectinload(ChatRoom.participants),
+)
+
+MESSAGE_WITH_OWNER = (
+    joinedload(Message.owner),
+)
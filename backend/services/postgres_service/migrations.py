@@ -0,0 +1,168 @@
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.schema import CreateColumn, CreateIndex, Index
+from sqlalchemy.sql import Executable
+from sqlalchemy import func, select, text, union_all, update
+from typing import Dict, List
+import asyncio
+import math
+import re
+import sys
+
+from .models import Base, ChatRoom, Message, Post, PostActions, POSTGRES_EXTENSIONS
+from .database import create_engine
+from .hotness import HOTNESS_EPOCH, HOTNESS_HALF_LIFE_SECONDS, HOTNESS_NEW_POST_WEIGHT, HOTNESS_MIN_EXPONENT_DIFF
+from post_popularity_rate_task.popularity_rate import ACTION_COST
+
+# Builds model indexes on already populated database without blocking writes.
+# `initialize_models()` (create_all) only creates indexes together with new tables, so existing databases need this.
+# Same goes for columns added to existing models - they are added (and backfilled) here first.
+# Run: python -m services.postgres_service.migrations prod
+
+# Non-nullable columns without server default that existing rows can be computed for. `table.column` -> backfill statements.
+# Column is added nullable, statements fill it, then it becomes NOT NULL. They run after all missing columns are added
+COLUMN_BACKFILLS: Dict[str, List[Executable]] = {}
+
+# Already sent messages are numbered in room by send time. Room counter continues from the last number.
+# Runs before ix_message_room_seq (unique) gets built
+_numbered_messages = select(
+    Message.message_id,
+    func.row_number().over(partition_by=Message.room_id, order_by=(Message.sent, Message.message_id)).label("seq")
+).subquery()
+_rooms_last_seq = select(Message.room_id, func.max(Message.seq).label("seq")).group_by(Message.room_id).subquery()
+
+COLUMN_BACKFILLS["message.seq"] = [
+    update(Message)
+    .where(Message.message_id == _numbered_messages.c.message_id)
+    .values(seq=_numbered_messages.c.seq),
+    update(ChatRoom)
+    .where(ChatRoom.room_id == _rooms_last_seq.c.room_id)
+    # Setting last_message_time to itself. Otherwise onupdate marks every room as just active
+    .values(last_message_seq=_rooms_last_seq.c.seq, last_message_time=ChatRoom.last_message_time),
+]
+
+def _hot_score_exponent(weight, at):
+    """SQL side `hot_score_exponent()`"""
+    return func.ln(weight) / math.log(2) + func.extract("epoch", at - HOTNESS_EPOCH) / HOTNESS_HALF_LIFE_SECONDS
+
+# Hot score of existing post - publish weight at `published` plus every action it has, each at its own date.
+# Summed in log2 space: log2(sum(2^e)) = max(e) + log2(sum(2^(e - max(e))))
+_hot_score_terms = union_all(
+    select(Post.post_id, _hot_score_exponent(HOTNESS_NEW_POST_WEIGHT, Post.published).label("exponent")),
+    select(PostActions.post_id, _hot_score_exponent(ACTION_COST, PostActions.date)).where(ACTION_COST > 0),
+).subquery()
+_hot_score_top = select(
+    _hot_score_terms.c.post_id,
+    _hot_score_terms.c.exponent,
+    func.max(_hot_score_terms.c.exponent).over(partition_by=_hot_score_terms.c.post_id).label("top")
+).subquery()
+_hot_scores = select(
+    _hot_score_top.c.post_id,
+    (func.max(_hot_score_top.c.top) + func.ln(func.sum(func.power(2.0, func.greatest(_hot_score_top.c.exponent - _hot_score_top.c.top, HOTNESS_MIN_EXPONENT_DIFF)))) / math.log(2)).label("hot_score")
+).group_by(_hot_score_top.c.post_id).subquery()
+
+COLUMN_BACKFILLS["posts.hot_score"] = [
+    update(Post)
+    .where(Post.post_id == _hot_scores.c.post_id)
+    # Setting last_updated to itself. Otherwise onupdate marks every post as edited
+    .values(hot_score=_hot_scores.c.hot_score, last_updated=Post.last_updated),
+]
+
+
+def _concurrent_index_ddl(index: Index, engine: AsyncEngine) -> str:
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+    return re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl)
+
+async def create_indexes_concurrently(engine: AsyncEngine, Base=Base) -> List[str]:
+    """
+    Creates every model index that is missing or was left invalid by interrupted build. Safe to rerun. \n
+    Returns names of built indexes.
+    """
+    built = []
+
+    # CONCURRENTLY can't run inside transaction block
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+
+        # Operator classes used by indexes (gin_trgm_ops) come from extensions
+        for extension in POSTGRES_EXTENSIONS:
+            await conn.execute(text(f"CREATE EXTENSION IF NOT EXISTS {extension}"))
+
+        for table in Base.metadata.sorted_tables:
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                state = (await conn.execute(
+                    text("SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = :name"),
+                    {"name": index.name}
+                )).scalar()
+
+                if state is True:
+                    continue
+                if state is False:
+                    await conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+
+                print(f"Building index {index.name} on {table.name}")
+                await conn.execute(text(_concurrent_index_ddl(index=index, engine=engine)))
+                built.append(index.name)
+
+    return built
+
+async def add_missing_columns(engine: AsyncEngine, Base=Base) -> List[str]:
+    """
+    Adds model columns missing in existing tables. Nullable ones and ones with server default are added as declared,
+    ones from `COLUMN_BACKFILLS` - nullable, backfilled, then set NOT NULL. Others need manual data migration - they are reported, not added. \n
+    Returns added columns as `table.column`.
+    """
+    added = []
+    backfill = []
+
+    # One transaction - ALTER TABLE lock is held till commit, so app can't write NULLs between backfill and SET NOT NULL
+    async with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = set((await conn.execute(
+                text("SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = :name"),
+                {"name": table.name}
+            )).scalars())
+
+            # Table doesn't exist yet - create_all makes it whole
+            if not existing:
+                continue
+
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                name = f"{table.name}.{column.name}"
+
+                if column.nullable or column.server_default is not None:
+                    # Name, type, DEFAULT and NOT NULL as declared. Existing rows get server default
+                    ddl = str(CreateColumn(column).compile(dialect=engine.dialect))
+                elif name in COLUMN_BACKFILLS:
+                    ddl = f'"{column.name}" {column.type.compile(dialect=engine.dialect)}'
+                    backfill.append((table.name, column.name))
+                else:
+                    print(f"Column {name} is missing, not nullable and has neither server default nor backfill. Add it manually")
+                    continue
+
+                print(f"Adding column {name}")
+                await conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN IF NOT EXISTS {ddl}'))
+                added.append(name)
+
+        for table_name, column_name in backfill:
+            print(f"Backfilling column {table_name}.{column_name}")
+            for statement in COLUMN_BACKFILLS[f"{table_name}.{column_name}"]:
+                await conn.execute(statement)
+            await conn.execute(text(f'ALTER TABLE "{table_name}" ALTER COLUMN "{column_name}" SET NOT NULL'))
+
+    return added
+
+async def main(mode: str) -> None:
+    engine = await create_engine(mode=mode)
+    try:
+        added = await add_missing_columns(engine=engine)
+        print(f"Columns added: {added or 'none, all up to date'}")
+        built = await create_indexes_concurrently(engine=engine)
+        print(f"Indexes built: {built or 'none, all up to date'}")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(mode=sys.argv[1] if len(sys.argv) > 1 else "prod"))
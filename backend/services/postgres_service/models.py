@@ -1,5 +1,6 @@
 from sqlalchemy.orm import DeclarativeBase, Mapped, validates, mapped_column, relationship
-from sqlalchemy import ForeignKey, text
+from sqlalchemy import ForeignKey, Index, DDL, event, text
+from .hotness import initial_hot_score
 from uuid import uuid4
 from datetime import datetime
 from typing import List
@@ -10,14 +11,33 @@ import enum
 
 load_dotenv()
 
+# Relationships never load implicitly. Every PostgresService method applies loader profile explicitly - read loader_profiles.py
+# Debug mode raises on any access to not loaded relationship. Otherwise only if access would emit SQL (object already in session is fine)
+POSTGRES_DEBUG_LAZY_LOADS = getenv("POSTGRES_DEBUG_LAZY_LOADS", "False").lower().strip() == "true"
+LAZY_LOADING = "raise" if POSTGRES_DEBUG_LAZY_LOADS else "raise_on_sql"
+
 def validate_field_range():
     """Soon. To get rid of repetative @validates logic"""
 
 class Base(DeclarativeBase):
     pass
 
+# Trigram operator classes for fuzzy username search. Extension must exist before tables and indexes get created
+POSTGRES_EXTENSIONS = ("pg_trgm",)
+
+for extension in POSTGRES_EXTENSIONS:
+    event.listen(
+        Base.metadata,
+        "before_create",
+        DDL(f"CREATE EXTENSION IF NOT EXISTS {extension}").execute_if(dialect="postgresql")
+    )
+
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Users search. Serves both similarity (%) and ILIKE '%prompt%' filters
+        Index("ix_users_username_trgm", "username", postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"}),
+    )
 
     user_id: Mapped[str] = mapped_column(primary_key=True)
     image_path: Mapped[str] = mapped_column(nullable=True)
@@ -26,18 +46,25 @@ class User(Base):
     password_hash: Mapped[str]
     joined: Mapped[datetime] = mapped_column(default=datetime.utcnow)
 
+    # Stored filename (with extension) as returned by image storage. None - no avatar
     avatar_image_name: Mapped[str] = mapped_column(nullable=True)
+    avatar_image_extension: Mapped[str] = mapped_column(nullable=True)
+    avatar_image_size: Mapped[int] = mapped_column(nullable=True)
+    # Extension of generated size variants. None - only original
+    avatar_image_variants: Mapped[str] = mapped_column(nullable=True)
 
     posts: Mapped[List["Post"]] = relationship(
         "Post",
         back_populates="owner",
-        lazy="selectin"
+        lazy=LAZY_LOADING,
+        passive_deletes=True
     )
 
     actions: Mapped[List["PostActions"]] = relationship(
         "PostActions",
         back_populates="owner",
-        lazy="selectin"
+        lazy=LAZY_LOADING,
+        passive_deletes=True
     )
 
     # Self referable many-2-many https://stackoverflow.com/questions/9116924/how-can-i-achieve-a-self-referencing-many-to-many-relationship-on-the-sqlalchemy
@@ -47,7 +74,8 @@ class User(Base):
         primaryjoin="User.user_id == Friendship.follower_id",
         secondaryjoin="User.user_id == Friendship.followed_id",
         back_populates="followers",
-        lazy="selectin"
+        lazy=LAZY_LOADING,
+        passive_deletes=True
     )
     followers: Mapped[List["User"]] = relationship(
         "User",
@@ -55,14 +83,16 @@ class User(Base):
         primaryjoin="User.user_id == Friendship.followed_id",
         secondaryjoin="User.user_id == Friendship.follower_id",
         back_populates="followed",
-        lazy="selectin"
+        lazy=LAZY_LOADING,
+        passive_deletes=True
     )
 
     chat_rooms: Mapped[List["ChatRoom"]] = relationship(
         "ChatRoom",
         secondary="userroom",
         back_populates="participants",
-        lazy="selectin"
+        lazy=LAZY_LOADING,
+        passive_deletes=True
     )
 
 
@@ -78,6 +108,12 @@ class User(Base):
 
 class Post(Base):
     __tablename__ = "posts"
+    __table_args__ = (
+        # Keyset pagination. Read pagination.py. Btree is scanned backwards for DESC order
+        Index("ix_posts_hot_keyset", "hot_score", "published", "post_id"),
+        Index("ix_posts_owner_keyset", "owner_id", "published", "post_id"),
+        Index("ix_posts_replies_keyset", "parent_post_id", "published", "post_id"),
+    )
 
     post_id: Mapped[str] = mapped_column(primary_key=True)
     owner_id: Mapped[str] = mapped_column(ForeignKey("users.user_id", ondelete="SET NULL"), nullable=True)
@@ -93,21 +129,31 @@ class Post(Base):
 
     images: Mapped[List["PostImage"]] = relationship(
         "PostImage",
-        lazy="selectin"
+        lazy=LAZY_LOADING,
+        passive_deletes=True
     )
 
     owner: Mapped["User"] = relationship(
         "User",
         back_populates="posts",
-        lazy="selectin"
+        lazy=LAZY_LOADING
     )
 
     popularity_rate: Mapped[int] = mapped_column(default=0)
     last_rate_calculated: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+
+    # Time decayed rate. Updated in place on every action. Read services/postgres_service/hotness.py
+    hot_score: Mapped[float] = mapped_column(default=initial_hot_score)
+
+    # Denormalized counters. Changed in the same transaction as actions/replies. Drift gets repaired by post_popularity_rate_task/post_counters.py
+    likes_count: Mapped[int] = mapped_column(default=0, server_default=text("0"))
+    views_count: Mapped[int] = mapped_column(default=0, server_default=text("0"))
+    replies_count: Mapped[int] = mapped_column(default=0, server_default=text("0"))
     actions: Mapped[List["PostActions"]] = relationship(
         "PostActions",
         back_populates="post",
-        lazy="selectin"
+        lazy=LAZY_LOADING,
+        passive_deletes=True
     )
 
 
@@ -116,13 +162,14 @@ class Post(Base):
         "Post",
         back_populates="replies",
         remote_side=[post_id],
-        lazy="selectin",
+        lazy=LAZY_LOADING,
     )
 
     replies: Mapped[List["Post"]] = relationship(
         "Post",
         back_populates="parent_post",
-        lazy="selectin"
+        lazy=LAZY_LOADING,
+        passive_deletes=True
     )
 
 
@@ -143,15 +190,29 @@ class Post(Base):
 
 class PostImage(Base):
     __tablename__ = "postimages"
+    __table_args__ = (
+        # Primary key starts with image_id. Post images are loaded by post_id
+        Index("ix_postimages_post_id", "post_id"),
+    )
 
     image_id: Mapped[str] = mapped_column(primary_key=True)
 
     post_id: Mapped[str] = mapped_column(ForeignKey("posts.post_id", ondelete="CASCADE"), primary_key=True)
     image_name: Mapped[str]
+    # What image storage wrote. None - row is older than these columns, run media migration tool
+    image_filename: Mapped[str] = mapped_column(nullable=True)
+    image_extension: Mapped[str] = mapped_column(nullable=True)
+    image_size: Mapped[int] = mapped_column(nullable=True)
+    # Extension of generated size variants. None - only original
+    image_variants: Mapped[str] = mapped_column(nullable=True)
 
 # Self referential m2m
 class Friendship(Base):
     __tablename__ = "friendship"
+    __table_args__ = (
+        # Primary key covers lookups by follower. This one - followers of user
+        Index("ix_friendship_followed_id", "followed_id"),
+    )
 
     follower_id: Mapped[str] = mapped_column(ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
     followed_id: Mapped[str] = mapped_column(ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
@@ -166,6 +227,14 @@ class ActionType(enum.Enum):
 
 class PostActions(Base):
     __tablename__ = "postactions"
+    __table_args__ = (
+        # User history and "did user already like/view this post"
+        Index("ix_postactions_owner_action_date", "owner_id", "action", "date"),
+        # Post actions by type. Counters reconciliation
+        Index("ix_postactions_post_action", "post_id", "action"),
+        # Actions leaving popularity rating window
+        Index("ix_postactions_date", "date"),
+    )
 
     action_id: Mapped[str] = mapped_column(primary_key=True)
 
@@ -177,13 +246,13 @@ class PostActions(Base):
     post: Mapped[Post] = relationship(
         "Post",
         back_populates="actions",
-        lazy="selectin"
+        lazy=LAZY_LOADING
     )
 
     owner: Mapped[User] = relationship(
         "User",
         back_populates="actions",
-        lazy="selectin"
+        lazy=LAZY_LOADING
     )
 
 
@@ -192,6 +261,10 @@ class PostActions(Base):
 # Room represents group or chat between users. Contain participants data and messages
 class ChatRoom(Base):
     __tablename__ = "chatroom"
+    __table_args__ = (
+        # User chats list ordered by last message
+        Index("ix_chatroom_approved_last_message_time", "approved", "last_message_time"),
+    )
 
     room_id: Mapped[str] = mapped_column(primary_key=True)
     approval_sent: Mapped[datetime] = mapped_column(default=datetime.utcnow)
@@ -209,16 +282,24 @@ class ChatRoom(Base):
     # Only for dialogues, for groups must always be setted on `True``
     approved: Mapped[bool]
 
+    # Last given Message.seq. Incremented under row lock - read PostgresService.next_message_seq()
+    last_message_seq: Mapped[int] = mapped_column(default=0, server_default=text("0"))
+
     participants: Mapped[List[User]] = relationship(
         "User",
         secondary="userroom",
         back_populates="chat_rooms",
-        lazy="selectin"
+        lazy=LAZY_LOADING,
+        passive_deletes=True
     )
 
 
 class UserRoom(Base):
     __tablename__ = "userroom"
+    __table_args__ = (
+        # Primary key covers lookups by user. This one - room participants
+        Index("ix_userroom_room_id", "room_id"),
+    )
 
     user_id: Mapped[str] = mapped_column(ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
     room_id: Mapped[str] = mapped_column(ForeignKey("chatroom.room_id", ondelete="CASCADE"), primary_key=True)
@@ -226,10 +307,17 @@ class UserRoom(Base):
 
 class Message(Base):
     __tablename__ = "message"
+    __table_args__ = (
+        # History pages: "messages before seq X" in room
+        Index("ix_message_room_seq", "room_id", "seq", unique=True),
+    )
 
     message_id: Mapped[str] = mapped_column(primary_key=True)
 
     room_id: Mapped[str] = mapped_column(ForeignKey("chatroom.room_id", ondelete="CASCADE"))
+
+    # Monotonically increasing inside the room. Gaps are left by deleted messages
+    seq: Mapped[int]
     owner_id: Mapped[str | None] = mapped_column(ForeignKey("users.user_id", ondelete="SET NULL"), nullable=True)
 
     text: Mapped[str]
@@ -237,10 +325,10 @@ class Message(Base):
 
     owner: Mapped[User | None] = relationship(
         "User",
-        lazy="selectin"
+        lazy=LAZY_LOADING
     )
 
     room = relationship(
         "ChatRoom",
-        lazy="selectin"
+        lazy=LAZY_LOADING
     )
\ No newline at end of file
@@ -0,0 +1,94 @@
+from datetime import datetime, timezone
+from typing import NamedTuple, Type, TypeVar, Dict, Any
+import base64
+import json
+
+from .models import Post
+
+# Keyset pagination. Client gets opaque cursor - sort key of last returned row - and sends it back to get next page.
+# Query continues right after that key using composite index, so any page costs as much as the first one.
+
+
+class HotPostKey(NamedTuple):
+    """Sort key of posts ordered by hot score. Fresh and followed feeds"""
+    hot_score: float
+    published: datetime
+    post_id: str
+
+class TimePostKey(NamedTuple):
+    """Sort key of posts ordered by publish time. User posts and replies"""
+    published: datetime
+    post_id: str
+
+class UserRankKey(NamedTuple):
+    """Sort key of users search results. Rank is computed by query, so it can't use index - only filter does"""
+    rank: float
+    user_id: str
+
+class FeedKey(NamedTuple):
+    """
+    Mixed feed position. Each posts source continues from its own key \n
+    While user pages precomputed feed - `snapshot_id` and offset inside it are set instead
+    """
+    related_page: int
+    followed: HotPostKey | None
+    fresh: HotPostKey | None
+    snapshot_id: str | None = None
+    snapshot_offset: int = 0
+
+
+Key = TypeVar("Key", HotPostKey, TimePostKey, UserRankKey, FeedKey)
+
+
+def hot_post_key(post: Post) -> HotPostKey:
+    return HotPostKey(hot_score=post.hot_score, published=post.published, post_id=post.post_id)
+
+def time_post_key(post: Post) -> TimePostKey:
+    return TimePostKey(published=post.published, post_id=post.post_id)
+
+def timeline_score(published: datetime) -> float:
+    """Score of post in Redis timeline. Timelines are paged with `TimePostKey` too, so it must follow publish time exactly"""
+    return published.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, datetime): return value.isoformat()
+    if isinstance(value, tuple): return [_to_json(item) for item in value]
+    return value
+
+def _from_json(value: Any, annotation: Any) -> Any:
+    if value is None:
+        return None
+
+    for KeyType in (HotPostKey, TimePostKey, UserRankKey, FeedKey):
+        if annotation in (KeyType, KeyType | None):
+            return _build_key(value, KeyType)
+
+    if annotation is datetime: return datetime.fromisoformat(value)
+    if annotation is float and isinstance(value, int): return float(value)
+    if not isinstance(value, annotation):
+        raise ValueError(f"Cursor value {value} isn't {annotation}")
+    return value
+
+def _build_key(values: Any, KeyType: Type[Key]) -> Key:
+    annotations: Dict[str, Any] = KeyType.__annotations__
+    if not isinstance(values, list) or len(values) != len(annotations):
+        raise ValueError(f"Cursor doesn't match {KeyType.__name__}")
+    return KeyType(*(_from_json(value, annotation) for value, annotation in zip(values, annotations.values())))
+
+def encode_cursor(key: Key | None) -> str | None:
+    """None - there is no next page"""
+    if key is None:
+        return None
+    raw = json.dumps(_to_json(key), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str | None, KeyType: Type[Key]) -> Key | None:
+    """Raises ValueError if cursor is corrupted. None cursor - first page"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return _build_key(json.loads(raw), KeyType)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Cursor isn't valid: {e}")
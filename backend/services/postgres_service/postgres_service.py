@@ -1,14 +1,17 @@
-from sqlalchemy import select, delete, update, or_, inspect, and_, func
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, delete, update, or_, inspect, and_, func, case, tuple_, cast, Float, Row
 from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 from os import getenv
 from typing import Type, TypeVar, List, Union, Literal
 from pydantic_schemas.pydantic_schemas_social import PostDataSchemaID
 from uuid import UUID
+import math
 from .models import *
 from .models import ActionType
 from .database_utils import postgres_exception_handler
+from .loader_profiles import *
+from .pagination import HotPostKey, TimePostKey, UserRankKey
+from .hotness import HOTNESS_MIN_EXPONENT_DIFF
 
 from exceptions.custom_exceptions import PostgresError
 
@@ -26,11 +29,21 @@ BASE_PAGINATION = int(getenv("BASE_PAGINATION"))
 DIVIDE_BASE_PAG_BY = int(getenv("DIVIDE_BASE_PAG_BY"))
 SMALL_PAGINATION = int(getenv("SMALL_PAGINATION"))
 
+# Added to trigram similarity (0..1) of usernames that start with prompt. 1 - prefix matches always go first
+USERS_SEARCH_PREFIX_BOOST = float(getenv("USERS_SEARCH_PREFIX_BOOST", "1"))
+
 class PostgresService:
     def __init__(self, postgres_session: AsyncSession):
         # We don't need to close session. Because Depends func will handle it in endpoints.
         self.__session = postgres_session
 
+    def fork(self) -> "PostgresService":
+        """
+        New service with own session from the same engine pool. One session can't run queries concurrently, forks can \n
+        Close fork after use.
+        """
+        return PostgresService(postgres_session=AsyncSession(bind=self.__session.bind, autoflush=False))
+
     @postgres_exception_handler(action="Close session")
     async def close(self) -> None:
         await self.__session.aclose()
@@ -44,8 +57,9 @@ class PostgresService:
         await self.__session.rollback()
 
     @postgres_exception_handler(action="Refresh session model")
-    async def refresh_model(self, model_obj: Base) -> None:
-        await self.__session.refresh(model_obj)
+    async def refresh_model(self, model_obj: Base, attribute_names: List[str] | None = None) -> None:
+        """Pass `attribute_names` to keep loaded relationships. Full refresh expires them"""
+        await self.__session.refresh(model_obj, attribute_names=attribute_names)
 
     @postgres_exception_handler(action="Flush session")
     async def flush(self) -> None:
@@ -66,19 +80,74 @@ class PostgresService:
     async def get_user_by_id(self, user_id: str) -> User | None:
         result = await self.__session.execute(
             select(User)
-            .options(selectinload(User.followed), selectinload(User.followers)) # Manually passing selection load. Because of self ref. m2m2
             .where(User.user_id == user_id)
         )
         return result.scalar()
 
+    @postgres_exception_handler(action="Get user principal columns by id")
+    async def get_user_principal_columns(self, user_id: str) -> Row | None:
+        """Loads only columns needed to authorize request. No relationships touched. Returns Row(user_id, username, avatar_image_name) or None"""
+        result = await self.__session.execute(
+            select(User.user_id, User.username, User.avatar_image_name)
+            .where(User.user_id == user_id)
+        )
+        return result.first()
+
+    @postgres_exception_handler(action="Change post hot score")
+    async def add_post_hot_score(self, post_id: str, exponent: float, add: bool = True) -> None:
+        """
+        Adds (or subtracts) 2^exponent to post hot score in linear space. Computed by database - concurrent actions don't overwrite each other. \n
+        Get exponent with `hot_score_exponent()`
+        """
+        diff = Post.hot_score - exponent
+
+        if add:
+            # log2(2^a + 2^b) = max(a, b) + log2(1 + 2^-|a - b|)
+            new_score = func.greatest(Post.hot_score, exponent) + func.ln(1 + func.power(2.0, func.greatest(-func.abs(diff), HOTNESS_MIN_EXPONENT_DIFF))) / math.log(2)
+        else:
+            # log2(2^a - 2^b) = a + log2(1 - 2^(b - a)). Post publish weight is always in the sum, so a > b
+            new_score = case(
+                (diff > -HOTNESS_MIN_EXPONENT_DIFF, Post.hot_score),
+                (diff > 0, Post.hot_score + func.ln(1 - func.power(2.0, -diff)) / math.log(2)),
+                else_=Post.hot_score
+            )
+
+        await self.__session.execute(
+            update(Post)
+            .where(Post.post_id == post_id)
+            # Setting last_updated to itself. Otherwise onupdate marks post as edited
+            .values(hot_score=new_score, last_updated=Post.last_updated)
+            .execution_options(synchronize_session=False)
+        )
+
+    @postgres_exception_handler(action="Change post counters")
+    async def change_post_counters(self, post_id: str, likes: int = 0, views: int = 0, replies: int = 0) -> None:
+        """Increments counters in database, so concurrent actions don't overwrite each other. Pass negative values to decrement"""
+        await self.__session.execute(
+            update(Post)
+            .where(Post.post_id == post_id)
+            .values(
+                likes_count=Post.likes_count + likes,
+                views_count=Post.views_count + views,
+                replies_count=Post.replies_count + replies,
+                last_updated=Post.last_updated
+            )
+            .execution_options(synchronize_session=False)
+        )
+
     @postgres_exception_handler(action="Get fresh feed")
-    async def get_fresh_posts(self, user: User, page: int, n: int, exclude_ids: List[str]) -> List[Post]:
+    async def get_fresh_posts(self, user: User, n: int, exclude_ids: List[str], after: HotPostKey | None = None) -> List[Post]:
+        """`after` - key of the last post of previous page. None - first page"""
+        where_stmt = [Post.owner_id != user.user_id, Post.post_id.not_in(exclude_ids)]
+        if after:
+            where_stmt.append(tuple_(Post.hot_score, Post.published, Post.post_id) < tuple_(*after))
+
         result = await self.__session.execute(
             select(Post)
-            .where(and_(Post.owner_id != user.user_id, Post.post_id.not_in(exclude_ids)))
-            .order_by(Post.popularity_rate.desc(), Post.published.desc())
-            .offset((page*n))
+            .where(and_(*where_stmt))
+            .order_by(Post.hot_score.desc(), Post.published.desc(), Post.post_id.desc())
             .limit(n)
+            .options(*POST_FEED_CARD)
         )
         return result.scalars().all()
 
@@ -98,12 +167,13 @@ class PostgresService:
             result = await self.__session.execute(
                 select(User)
                 .where(User.user_id.in_(ids))
-                .options(selectinload(User.followed), selectinload(User.followers))
+                .options(*USER_PROFILE)
             )
         elif ModelType == Post:
             result = await self.__session.execute(
                 select(Post)
                 .where(Post.post_id.in_(ids))
+                .options(*POST_FEED_CARD)
             )
         else:
             raise TypeError("Unsupported model type!")
@@ -115,30 +185,55 @@ class PostgresService:
             result = await self.__session.execute(
                 select(User)
                 .where(User.user_id == id_)
-                .options(selectinload(User.followers), selectinload(User.followed), selectinload(User.posts))
+                .options(*USER_PROFILE)
             )
         elif ModelType == Post:
             result = await self.__session.execute(
                 select(Post)
                 .where(Post.post_id == id_)
-                .options(selectinload(Post.replies))
+                .options(*POST_DETAIL)
             )
         else:
             raise TypeError("Unsupported model type!")
         return result.scalar()
 
-    # https://stackoverflow.com/questions/3325467/sqlalchemy-equivalent-to-sql-like-statement
-    @postgres_exception_handler(action="Get users by LIKE statement")
-    async def get_users_by_username(self, prompt: str, page: int, n: int) -> List[User]:
-        print(prompt)
+    @postgres_exception_handler(action="Search users by username similarity")
+    async def get_users_by_username(self, prompt: str, n: int, exclude_user_id: str | None = None, after: UserRankKey | None = None) -> List[Row]:
+        """
+        Lean rows: `user_id`, `username`, `followers_count`, `rank`. Best matches first. \n
+        Candidates come from trigram GIN index - similar (%) usernames or usernames that contain prompt. Prefix matches are boosted.
+        """
+        prompt = prompt.strip()
+        # Pattern is built here, not concatenated in SQL - planner needs it as a constant to use trigram index
+        escaped_prompt = prompt.replace("/", "//").replace("%", "/%").replace("_", "/_")
+
+        followers_count = (
+            select(func.count())
+            .select_from(Friendship)
+            .where(Friendship.followed_id == User.user_id)
+            .correlate(User)
+            .scalar_subquery()
+        )
+        rank = (
+            cast(func.similarity(User.username, prompt), Float)
+            + case((User.username.ilike(f"{escaped_prompt}%", escape="/"), USERS_SEARCH_PREFIX_BOOST), else_=0.0)
+        )
+
+        query = (
+            select(User.user_id, User.username, followers_count.label("followers_count"), rank.label("rank"))
+            .where(or_(User.username.op("%")(prompt), User.username.ilike(f"%{escaped_prompt}%", escape="/")))
+        )
+        if exclude_user_id:
+            query = query.where(User.user_id != exclude_user_id)
+        if after:
+            query = query.where(tuple_(rank, User.user_id) < tuple_(after.rank, after.user_id))
+
         result = await self.__session.execute(
-            select(User)
-            .where(User.username.ilike(f"%{prompt.strip()}%"))
-            .options(selectinload(User.followers))
-            .offset((page*n))
+            query
+            .order_by(rank.desc(), User.user_id.desc())
             .limit(n)
         )
-        return result.scalars().all()
+        return result.all()
 
     @postgres_exception_handler(action="Change field and flush")
     async def change_field_and_flush(self, model: Base, **kwargs) -> None:
@@ -165,24 +260,71 @@ class PostgresService:
         return result.scalar()
     
     @postgres_exception_handler(action="Get followed users posts")
-    async def get_followed_posts(self, user: User, n: int, page: int, exclude_ids: List[str] = []) -> List[Post]:
-        """If user not following anyone - returns empty list"""
+    async def get_followed_posts(self, user: User, n: int, exclude_ids: List[str] = [], after: HotPostKey | None = None) -> List[Post]:
+        """If user not following anyone - returns empty list. `after` - key of the last post of previous page"""
 
-        # Getting new user, because merged instances may not include loaded relationships
-        user = await self.get_user_by_id(user_id=user.user_id)
+        followed_ids = (
+            select(Friendship.followed_id)
+            .where(Friendship.follower_id == user.user_id)
+        )
 
-        followed_ids = [followed.user_id for followed in user.followed]
+        where_stmt = [Post.owner_id.in_(followed_ids), Post.post_id.not_in(exclude_ids)]
+        if after:
+            where_stmt.append(tuple_(Post.hot_score, Post.published, Post.post_id) < tuple_(*after))
 
         result = await self.__session.execute(
             select(Post)
-            .where(and_(Post.owner_id.in_(followed_ids), Post.post_id.not_in(exclude_ids)))
-            .order_by(Post.popularity_rate.desc(), Post.published.desc())
-            .offset(page*n)
-            .limit((page*n) + n)
+            .where(and_(*where_stmt))
+            .order_by(Post.hot_score.desc(), Post.published.desc(), Post.post_id.desc())
+            .limit(n)
+            .options(*POST_FEED_CARD)
         )
         return result.scalars().all()
 
 
+    @postgres_exception_handler(action="Get followed users posts by publish time")
+    async def get_followed_posts_by_time(self, follower_id: str, n: int, after: TimePostKey | None = None, owner_ids: List[str] | None = None) -> List[Post]:
+        """
+        Newest first. Timelines backfill, pages older than timeline and celebrities posts pull \n
+        `owner_ids` - take only these of followed users
+        """
+        followed_ids = (
+            select(Friendship.followed_id)
+            .where(Friendship.follower_id == follower_id)
+        )
+        if owner_ids is not None:
+            followed_ids = followed_ids.where(Friendship.followed_id.in_(owner_ids))
+
+        where_stmt = [Post.owner_id.in_(followed_ids)]
+        if after:
+            where_stmt.append(tuple_(Post.published, Post.post_id) < tuple_(*after))
+
+        result = await self.__session.execute(
+            select(Post)
+            .where(and_(*where_stmt))
+            .order_by(Post.published.desc(), Post.post_id.desc())
+            .limit(n)
+            .options(*POST_FEED_CARD)
+        )
+        return result.scalars().all()
+
+    @postgres_exception_handler(action="Get user follower ids")
+    async def get_follower_ids(self, user_id: str) -> List[str]:
+        result = await self.__session.execute(
+            select(Friendship.follower_id)
+            .where(Friendship.followed_id == user_id)
+        )
+        return result.scalars().all()
+
+    @postgres_exception_handler(action="Count user followers")
+    async def count_followers(self, user_id: str) -> int:
+        result = await self.__session.execute(
+            select(func.count())
+            .select_from(Friendship)
+            .where(Friendship.followed_id == user_id)
+        )
+        return result.scalar()
+
     @postgres_exception_handler(action="Update post values nad return post is needed")
     async def update_post_fields(self, post_data: PostDataSchemaID, return_updated_post: bool = False) -> Post | None:
         post_data_dict = post_data.model_dump(exclude_defaults=True, exclude_none=True, exclude={"post_id"})
@@ -198,7 +340,7 @@ class PostgresService:
             result = await self.__session.execute(
                 select(Post)
                 .where(Post.post_id == post_data.post_id)
-                .options(selectinload(Post.replies))
+                .options(*POST_DETAIL)
             )
             return result.scalar()
 
@@ -228,6 +370,7 @@ class PostgresService:
             .where(and_(PostActions.owner_id == user_id, PostActions.action == action_type))
             .order_by(PostActions.date.desc())
             .limit(n_most_fresh) # limit an integer LIMIT parameter, or a SQL expression that provides an integer result. Pass None to reset it.
+            .options(*ACTION_WITH_POST)
         )
         actions = result.scalars().all()
 
@@ -235,31 +378,34 @@ class PostgresService:
         else: return actions
 
     @postgres_exception_handler(action="Get post replies")
-    async def get_post_replies(self, post_id: str, page: int, n: int) -> List[Post]:
-        likes_subq = (
-            select(func.count(PostActions.action_id))
-            .where(and_(PostActions.post_id == post_id, PostActions.action == "like"))
-            .scalar_subquery()
-        )
+    async def get_post_replies(self, post_id: str, n: int, after: TimePostKey | None = None) -> List[Post]:
+        """Newest first. `after` - key of the last reply of previous page"""
+        where_stmt = [Post.parent_post_id == post_id]
+        if after:
+            where_stmt.append(tuple_(Post.published, Post.post_id) < tuple_(*after))
+
         result = await self.__session.execute(
-            select(Post, likes_subq)
-            .where(Post.parent_post_id == post_id)
-            .order_by(Post.published.desc(), Post.popularity_rate.desc(), likes_subq.desc())
-            .offset(page*n)
+            select(Post)
+            .where(and_(*where_stmt))
+            .order_by(Post.published.desc(), Post.post_id.desc())
             .limit(n)
+            .options(*POST_FEED_CARD)
         )
         return result.scalars().all()
     
     @postgres_exception_handler(action="Get user's posts")
-    async def get_user_posts(self, user_id: str, page: int, n: int):
+    async def get_user_posts(self, user_id: str, n: int, after: TimePostKey | None = None) -> List[Post]:
+        """Newest first. `after` - key of the last post of previous page"""
+        where_stmt = [Post.owner_id == user_id]
+        if after:
+            where_stmt.append(tuple_(Post.published, Post.post_id) < tuple_(*after))
+
         result = await self.__session.execute(
             select(Post)
-            .where(and_(Post.owner_id == user_id))
-            .limit(LOAD_MAX_USERS_POST)
-            .order_by(Post.published.desc())
-            .options(selectinload(Post.parent_post))
-            .offset(page*n)
+            .where(and_(*where_stmt))
+            .order_by(Post.published.desc(), Post.post_id.desc())
             .limit(n)
+            .options(*POST_FEED_CARD)
         )
         return result.scalars().all()
 
@@ -268,6 +414,7 @@ class PostgresService:
         result = await self.__session.execute(
             select(ChatRoom)
             .where(ChatRoom.room_id == room_id)
+            .options(*CHAT_ROOM_PARTICIPANTS)
         )
         return result.scalar()
     
@@ -275,23 +422,40 @@ class PostgresService:
     async def get_dialogue_by_users(self, user_1: User, user_2: User) -> ChatRoom | None:
         result = await self.__session.execute(
             select(ChatRoom)
-            .where(and_(ChatRoom.is_group == False, ChatRoom.participants.contains(user_1), ChatRoom.participants.contains(user_2)))
+            .where(and_(ChatRoom.is_group == False, ChatRoom.participants.any(User.user_id == user_1.user_id), ChatRoom.participants.any(User.user_id == user_2.user_id)))
         )
         return result.scalar()
 
-    @postgres_exception_handler(action="Get n chat room messages excluding exclude_ids list")
-    async def get_chat_n_fresh_chat_messages(self, room_id: str, page: int,  n: int = int(getenv("MESSAGES_BATCH_SIZE", "50")), pagination_normalization: int = 0) -> List[Message]:
+    @postgres_exception_handler(action="Reserve next chat room message sequence number")
+    async def next_message_seq(self, room_id: str) -> int:
+        """Chat room row stays locked until transaction ends, so concurrent senders get ordered numbers"""
+        result = await self.__session.execute(
+            update(ChatRoom)
+            .where(ChatRoom.room_id == room_id)
+            .values(last_message_seq=ChatRoom.last_message_seq + 1)
+            .returning(ChatRoom.last_message_seq)
+            .execution_options(synchronize_session=False)
+        )
+        return result.scalar_one()
+
+    @postgres_exception_handler(action="Get n chat room messages before sequence number")
+    async def get_chat_messages_before(self, room_id: str, n: int = int(getenv("MESSAGES_BATCH_SIZE", "50")), before_seq: int | None = None) -> List[Message]:
+        """Newest first. `before_seq` - smallest seq client already has. None - latest messages"""
+        where_stmt = [Message.room_id == room_id]
+        if before_seq is not None:
+            where_stmt.append(Message.seq < before_seq)
+
         result = await self.__session.execute(
             select(Message)
-            .where(Message.room_id == room_id)
-            .order_by(Message.sent.desc())
-            .offset((page*n) + pagination_normalization)
+            .where(and_(*where_stmt))
+            .order_by(Message.seq.desc())
             .limit(n)
+            .options(*MESSAGE_WITH_OWNER)
         )
         return result.scalars().all()
     
     @postgres_exception_handler(action="Get n user chat rooms excluding exclude_ids list")
-    async def get_n_user_chats(self, user: User, n, page: int, pagination_normalization: int, chat_type: Literal["chat", "not-approved"]) -> List[ChatRoom]:
+    async def get_n_user_chats(self, user: User, n, page: int, chat_type: Literal["chat", "not-approved"]) -> List[ChatRoom]:
         if chat_type == "chat":
             where_stmt = ChatRoom.approved.is_(True)
         elif chat_type == "not-approved":
@@ -299,10 +463,11 @@ class PostgresService:
 
         result = await self.__session.execute(
             select(ChatRoom)
-            .where(and_(ChatRoom.participants.contains(user), where_stmt))
+            .where(and_(ChatRoom.participants.any(User.user_id == user.user_id), where_stmt))
             .order_by(ChatRoom.last_message_time.desc())
-            .offset((page*n) + pagination_normalization)
+            .offset(page*n)
             .limit(n)
+            .options(*CHAT_ROOM_PARTICIPANTS)
         )
 
         return result.scalars().all() 
@@ -5,10 +5,11 @@ from exceptions.custom_exceptions import RedisError
 
 from dotenv import load_dotenv
 from os import getenv
-from typing import Optional, Literal, List
+from typing import Optional, Literal, List, Dict, Set, Tuple, AsyncIterator
 from functools import wraps
 from datetime import datetime
 from uuid import UUID
+import time
 
 load_dotenv()
 ACCES_JWT_EXPIRY_SECONDS = int(getenv("ACCES_JWT_EXPIRY_SECONDS"))
@@ -23,11 +24,84 @@ EXCLUDE_VIEWED_POSTS_TIMEOUT = int(getenv("EXCLUDE_VIEWED_POSTS_TIMEOUT"))
 
 CHAT_TOKEN_EXPIRY_SECONDS = int(getenv("CHAT_TOKEN_EXPIRY_SECONDS"))
 
+MAX_SESSIONS_PER_USER = int(getenv("MAX_SESSIONS_PER_USER", "10"))
+
+FEED_SNAPSHOT_FRESH_SECONDS = int(getenv("FEED_SNAPSHOT_FRESH_SECONDS", "300"))
+FEED_SNAPSHOT_TTL_SECONDS = int(getenv("FEED_SNAPSHOT_TTL_SECONDS", "1800"))
+
+TIMELINE_MAX_LENGTH = int(getenv("TIMELINE_MAX_LENGTH", "800"))
+TIMELINE_TTL_SECONDS = int(getenv("TIMELINE_TTL_SECONDS", "259200"))
+
 REDIS_HOST = getenv("REDIS_HOST")
 REDIS_PORT = int(getenv("REDIS_PORT"))
 
+REDIS_MAX_CONNECTIONS = int(getenv("REDIS_MAX_CONNECTIONS", "100"))
+REDIS_POOL_TIMEOUT_SECONDS = int(getenv("REDIS_POOL_TIMEOUT_SECONDS", "5"))
+REDIS_HEALTH_CHECK_INTERVAL_SECONDS = int(getenv("REDIS_HEALTH_CHECK_INTERVAL_SECONDS", "30"))
+
 ImageType = Literal["post", "user"]
 
+class TrackedConnectionPool(async_redis.BlockingConnectionPool):
+    """Counts checked out connections through public `get_connection`/`release`. Pool internals change between redis-py versions"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._checked_out: Set[int] = set()
+        self.peak_in_use = 0
+
+    async def get_connection(self, *args, **kwargs):
+        connection = await super().get_connection(*args, **kwargs)
+        self._checked_out.add(id(connection))
+        self.peak_in_use = max(self.peak_in_use, len(self._checked_out))
+        return connection
+
+    async def release(self, connection) -> None:
+        # Failed connection check releases connection that was never handed out
+        self._checked_out.discard(id(connection))
+        await super().release(connection)
+
+    @property
+    def in_use(self) -> int:
+        return len(self._checked_out)
+
+# Process-wide connection pools. One per db index
+_pools: Dict[int, TrackedConnectionPool] = {}
+
+
+def get_redis_pool(db: int) -> async_redis.ConnectionPool:
+    """
+    Returns shared connection pool for db index. Creates it on first call \n
+    When all `REDIS_MAX_CONNECTIONS` are in use - waits up to `REDIS_POOL_TIMEOUT_SECONDS` for free one instead of opening new
+    """
+    if db not in _pools:
+        _pools[db] = TrackedConnectionPool(
+            host=REDIS_HOST or "localhost",
+            port=REDIS_PORT,
+            db=db,
+            decode_responses=True,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT_SECONDS,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL_SECONDS
+        )
+    return _pools[db]
+
+async def close_redis_pools() -> None:
+    """Disconnects all shared pools. Call on app shutdown"""
+    for pool in _pools.values():
+        await pool.disconnect()
+    _pools.clear()
+
+def get_redis_pool_statistics() -> Dict[str, Dict[str, int]]:
+    """Returns connections usage of each shared pool. Keys - db indexes"""
+    return {
+        str(db): {
+            "max_connections": pool.max_connections,
+            "in_use": pool.in_use,
+            "peak_in_use": pool.peak_in_use,
+        }
+        for db, pool in _pools.items()
+    }
+
 
 def redis_error_handler(func):
     @wraps(func)
@@ -61,35 +135,71 @@ class RedisService:
     
     @redis_error_handler
     async def finish(self) -> None:
+        """Releases client. Shared connection pool stays open - it gets closed with `close_redis_pools()`"""
         await self.__client.aclose()
 
-    def __init__(self, db_pool: str = "prod"):
+    def __init__(self, db_pool: str = "prod", connection_pool: async_redis.ConnectionPool | None = None):
         """
         To switch to the test pool - assign db_pool to "test" \n
+        If `connection_pool` not provided - process-wide pool of chosen db is used
         """
 
         self.__client = async_redis.Redis(
-            host=REDIS_HOST,
-            port=REDIS_PORT,
-            db=self._chose_pool(db_pool),
-            decode_responses=True,
+            connection_pool=connection_pool or get_redis_pool(db=self._chose_pool(db_pool))
         )
 
         # Jwt
         self.__jwt_acces_prefix = "acces-jwt-token:"
         self.__jwt_refresh_prefix = "refresh-jwt-token:"
 
+        # Per-user token indexes. Sorted sets: member - token, score - expiry unix timestamp
+        self.__user_acces_tokens_prefix = "user-acces-jwt-tokens:"
+        self.__user_refresh_tokens_prefix = "user-refresh-jwt-tokens:"
+
+        # Refresh token -> acces token issued together with it (same device)
+        self.__jwt_pair_prefix = "refresh-acces-jwt-pair:"
+
+        # Pub/sub channel. Messages: "token:{token_hash}" | "user:{user_id}"
+        self.__acces_token_revocations_channel = "acces-jwt-revocations"
+
 
         self._viewed_post_prefix = "viewed-posts:"
+        self.__post_view_timeout_prefix_1 = "post-view-timeout-user:"
+        self.__post_view_timeout_prefix_2 = ":post:"
+
+        # Popularity recompute
+        self.__dirty_posts_key = "popularity-dirty-posts"
+        self.__popularity_last_run_key = "popularity-last-run"
+
+        # Precomputed feeds. Snapshot - sorted set: member - post id, score - position in feed
+        self.__feed_snapshot_prefix = "feed-snapshot:"
+        # Live feed cursor to continue with after snapshot end
+        self.__feed_continuation_prefix = "feed-continuation:"
+        # User id -> current snapshot id. Expires when feed gets stale
+        self.__feed_current_prefix = "feed-current:"
+        # Sorted set: member - user id, score - last feed request unix timestamp
+        self.__feed_active_users_key = "feed-active-users"
+        self.__feed_stale_users_key = "feed-stale-users"
+        # Sorted set: member - active user id, score - last snapshot build unix timestamp. 0 - never built
+        self.__feed_built_at_key = "feed-built-at"
+
+        # Following timelines. Sorted set: member - post id, score - publish timestamp
+        self.__timeline_prefix = "timeline:"
+        # Member of every built timeline, lowest score. Timeline of user whose followees have no posts still exists - not backfilled on each read
+        self.__timeline_built_marker = "-built-"
+        # Users whose posts aren't pushed to followers timelines, but pulled on read
+        self.__timeline_celebrities_key = "timeline-celebrities"
 
 
         # Chat
         self.__chat_token_prefix = "chat-jwt-token:"
-        self.__user_chat_pagination_prefix = "chat-pagination-user-"
 
         self.__chat_connection_prefix = "chat-connections-room:"
  
 
+        # S3 presigned URLs shared by workers. Value - "{expiry unix timestamp} {url}"
+        self.__presigned_url_prefix = "presigned-url:"
+
         # Image acces tokens prefix
         self.__post_image_acces_prefix = "post-image-acces:"
         self.__user_image_acces_prefix = "user-image-acces:"
@@ -99,33 +209,65 @@ class RedisService:
     # JWT tokens logic
     # ==============
 
+    def _define_token_prefixes(self, token_type: str) -> Tuple[str, str]:
+        """Returns (token key prefix, per-user index key prefix)"""
+        if token_type == "acces": return (self.__jwt_acces_prefix, self.__user_acces_tokens_prefix)
+        elif token_type == "refresh": return (self.__jwt_refresh_prefix, self.__user_refresh_tokens_prefix)
+        else:
+            raise ValueError("Unsuported token type!")
+
+    async def _save_indexed_jwt(self, jwt_token: str, user_id: str, token_type: str, expiry_seconds: int, replaces: str | None = None) -> List[str]:
+        """
+        Saves token and adds it to user's token index in one transaction. `replaces` - token of the same device, revoked in that transaction. \n
+        Expired index entries get pruned. If user exceeds `MAX_SESSIONS_PER_USER` - the oldest tokens get revoked. Returns them.
+        """
+        token_prefix, index_prefix = self._define_token_prefixes(token_type=token_type)
+        index_key = f"{index_prefix}{user_id}"
+        now = time.time()
+
+        async with self.__client.pipeline(transaction=True) as pipe:
+            # Replaced token leaves index before cap check. Otherwise it's counted and other device's session gets evicted
+            if replaces:
+                pipe.delete(f"{token_prefix}{replaces}")
+                pipe.zrem(index_key, replaces)
+            pipe.setex(name=f"{token_prefix}{jwt_token}", time=expiry_seconds, value=user_id)
+            pipe.zadd(index_key, {jwt_token: now + expiry_seconds})
+            pipe.zremrangebyscore(index_key, "-inf", now)
+            pipe.expire(index_key, expiry_seconds)
+            pipe.zcard(index_key)
+            *_, sessions_number = await pipe.execute()
+
+        if sessions_number <= MAX_SESSIONS_PER_USER:
+            return []
+
+        oldest = [token for token, _ in await self.__client.zpopmin(index_key, count=sessions_number - MAX_SESSIONS_PER_USER)]
+        if oldest:
+            keys = [f"{token_prefix}{token}" for token in oldest]
+            if token_type == "refresh":
+                keys.extend(f"{self.__jwt_pair_prefix}{token}" for token in oldest)
+            await self.__client.delete(*keys)
+        return oldest
+
     @redis_error_handler
-    async def save_acces_jwt(self, jwt_token: str, user_id: str) -> str:
-        await self.__client.setex(
-            name=f"{self.__jwt_acces_prefix}{str(jwt_token)}",
-            time=ACCES_JWT_EXPIRY_SECONDS,
-            value=user_id
-        )
-        return self._get_expiry(ACCES_JWT_EXPIRY_SECONDS)
+    async def save_acces_jwt(self, jwt_token: str, user_id: str, replaces: str | None = None) -> Tuple[str, List[str]]:
+        """Returns (expiry, acces tokens evicted by sessions limit). Evicted ones must be dropped from workers token caches"""
+        evicted = await self._save_indexed_jwt(jwt_token=str(jwt_token), user_id=user_id, token_type="acces", expiry_seconds=ACCES_JWT_EXPIRY_SECONDS, replaces=replaces)
+        return (self._get_expiry(ACCES_JWT_EXPIRY_SECONDS), evicted)
     
     @redis_error_handler
-    async def save_refresh_jwt(self, jwt_token: str, user_id: str) -> str:
-        await self.__client.setex(
-            name=f"{(self.__jwt_refresh_prefix)}{jwt_token}",
-            time=REFRESH_JWT_EXPIRY_SECONDS,
-            value=user_id
-        )
-        return self._get_expiry(REFRESH_JWT_EXPIRY_SECONDS)
+    async def save_refresh_jwt(self, jwt_token: str, user_id: str) -> Tuple[str, List[str]]:
+        """Returns (expiry, refresh tokens evicted by sessions limit)"""
+        evicted = await self._save_indexed_jwt(jwt_token=jwt_token, user_id=user_id, token_type="refresh", expiry_seconds=REFRESH_JWT_EXPIRY_SECONDS)
+        return (self._get_expiry(REFRESH_JWT_EXPIRY_SECONDS), evicted)
 
     @redis_error_handler
-    async def refresh_acces_token(self, old_token, new_token: str, user_id: str) -> str:
-        await self.delete_jwt(jwt_token=old_token, token_type="acces")
-        await self.__client.setex(
-            name=f"{self.__jwt_acces_prefix}{new_token}",
-            time=ACCES_JWT_EXPIRY_SECONDS,
-            value=user_id
-        )
-        return new_token
+    async def pair_tokens(self, refresh_token: str, acces_token: str) -> None:
+        """Remember which acces token was issued with refresh token. To revoke exactly that device's acces token on refresh"""
+        await self.__client.setex(f"{self.__jwt_pair_prefix}{refresh_token}", REFRESH_JWT_EXPIRY_SECONDS, acces_token)
+
+    @redis_error_handler
+    async def get_paired_acces_token(self, refresh_token: str) -> str | None:
+        return await self.__client.get(f"{self.__jwt_pair_prefix}{refresh_token}")
 
     @redis_error_handler    
     async def get_jwt_time_to_expiry(self, jwt_token: str) -> Optional[int]:
@@ -139,10 +281,17 @@ class RedisService:
     async def delete_jwt(self, jwt_token: str, token_type: str) -> None:
         if not token_type:
             raise ValueError("Token type is None!")
-        if token_type == "acces": prefix = self.__jwt_acces_prefix
-        elif token_type == "refresh": prefix = self.__jwt_refresh_prefix
-   
-        await self.__client.delete(f"{prefix}{jwt_token}")
+        token_prefix, index_prefix = self._define_token_prefixes(token_type=token_type)
+
+        user_id = await self.__client.get(f"{token_prefix}{jwt_token}")
+
+        async with self.__client.pipeline(transaction=True) as pipe:
+            pipe.delete(f"{token_prefix}{jwt_token}")
+            if user_id:
+                pipe.zrem(f"{index_prefix}{user_id}", jwt_token)
+            if token_type == "refresh":
+                pipe.delete(f"{self.__jwt_pair_prefix}{jwt_token}")
+            await pipe.execute()
 
     @redis_error_handler
     async def check_jwt_existence(self, jwt_token: str, token_type: str) -> bool:
@@ -156,26 +305,63 @@ class RedisService:
         return bool(potential_token)
     
     @redis_error_handler
-    async def get_token_by_user_id(self, user_id: str, token_type: str) -> str | None:
+    async def get_tokens_by_user_id(self, user_id: str, token_type: str) -> List[str]:
+        """Returns all user's active tokens (one per device), the newest last"""
         if not user_id or not token_type:
             raise ValueError("user_id or toket_type is None!")
 
-        if token_type == "acces": prefix = self.__jwt_acces_prefix
-        elif token_type == "refresh": prefix = self.__jwt_refresh_prefix
-        else:
-            raise ValueError("Unsuported token type!")
+        _, index_prefix = self._define_token_prefixes(token_type=token_type)
+        index_key = f"{index_prefix}{user_id}"
 
-        async for key in self.__client.scan_iter(match=f"{prefix}*"):
-            value = await self.__client.get(key)
-            if value == str(user_id):
-                return key.removeprefix(prefix)
+        async with self.__client.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(index_key, "-inf", time.time())
+            pipe.zrange(index_key, 0, -1)
+            _, tokens = await pipe.execute()
+        return tokens
+
+    @redis_error_handler
+    async def get_token_by_user_id(self, user_id: str, token_type: str) -> str | None:
+        """Returns user's newest active token. If no tokens - None"""
+        tokens = await self.get_tokens_by_user_id(user_id=user_id, token_type=token_type)
+        return tokens[-1] if tokens else None
 
     @redis_error_handler
     async def deactivate_tokens_by_id(self, user_id: str) -> None:
-        access_pattern = f"{self.__jwt_acces_prefix}{user_id}"
-        refresh_pattern = f"{self.__jwt_refresh_prefix}{user_id}"
+        """Revokes all user's acces and refresh tokens on all devices"""
+        acces_index_key = f"{self.__user_acces_tokens_prefix}{user_id}"
+        refresh_index_key = f"{self.__user_refresh_tokens_prefix}{user_id}"
+
+        async with self.__client.pipeline(transaction=False) as pipe:
+            pipe.zrange(acces_index_key, 0, -1)
+            pipe.zrange(refresh_index_key, 0, -1)
+            acces_tokens, refresh_tokens = await pipe.execute()
 
-        await self.__client.delete(access_pattern, refresh_pattern)
+        keys = [acces_index_key, refresh_index_key]
+        keys.extend(f"{self.__jwt_acces_prefix}{token}" for token in acces_tokens)
+        keys.extend(f"{self.__jwt_refresh_prefix}{token}" for token in refresh_tokens)
+        keys.extend(f"{self.__jwt_pair_prefix}{token}" for token in refresh_tokens)
+
+        await self.__client.delete(*keys)
+
+    @redis_error_handler
+    async def publish_acces_token_revocation(self, token_hash: str | None = None, user_id: str | None = None) -> None:
+        """Notifies all workers to drop cached acces token (by it's hash) or all cached tokens of user"""
+        if token_hash:
+            await self.__client.publish(self.__acces_token_revocations_channel, f"token:{token_hash}")
+        if user_id:
+            await self.__client.publish(self.__acces_token_revocations_channel, f"user:{user_id}")
+
+    async def listen_acces_token_revocations(self) -> AsyncIterator[Tuple[str, str]]:
+        """Yields (kind, value) where kind - "token" | "user". Holds one pool connection while iterating"""
+        pubsub = self.__client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.__acces_token_revocations_channel)
+        try:
+            async for message in pubsub.listen():
+                kind, _, value = str(message["data"]).partition(":")
+                if value:
+                    yield (kind, value)
+        finally:
+            await pubsub.aclose()
 
     # # ===============
     # # Post excluding logic
@@ -207,19 +393,229 @@ class RedisService:
         return not bool(await self.__client.exists(pattern))
     
     # ===============
-    # LocalStorage images token acces
+    # Popularity recompute logic
     # ==============
 
     @redis_error_handler
-    async def save_url_user_token(self, image_token: str, image_name: str) -> None:
-        pattern = f"{self.__user_image_acces_prefix}{image_token}"
-        await self.__client.setex(pattern, IMAGE_VIEW_ACCES_SECONDS, image_name)
+    async def mark_posts_dirty(self, post_ids: List[str]) -> None:
+        """Mark posts that gained or lost actions. Their popularity rate gets recomputed on next job tick"""
+        if post_ids:
+            await self.__client.sadd(self.__dirty_posts_key, *post_ids)
 
     @redis_error_handler
-    async def save_url_post_token(self, image_token: str, image_name: str) -> None:
-        pattern = f"{self.__post_image_acces_prefix}{image_token}"
-        await self.__client.setex(pattern, IMAGE_VIEW_ACCES_SECONDS, image_name)
-        
+    async def pop_dirty_posts(self, count: int) -> List[str]:
+        """Atomically takes up to `count` dirty posts ids. Same id never gets taken by two workers"""
+        return await self.__client.spop(self.__dirty_posts_key, count=count) or []
+
+    @redis_error_handler
+    async def get_popularity_last_run(self) -> float | None:
+        value = await self.__client.get(self.__popularity_last_run_key)
+        return float(value) if value else None
+
+    @redis_error_handler
+    async def set_popularity_last_run(self, timestamp: float) -> None:
+        await self.__client.set(self.__popularity_last_run_key, timestamp)
+
+    # ===============
+    # Precomputed feeds logic
+    # ==============
+
+    @redis_error_handler
+    async def save_feed_snapshot(self, user_id: str, post_ids: List[str], continuation_cursor: str | None) -> str:
+        """
+        Stores ranked post ids as user's current feed. Returns snapshot id \n
+        Previous snapshot stays readable until it expires, so clients that page it don't get shifted results.
+        """
+        snapshot_id = str(time.time_ns())
+        snapshot_key = f"{self.__feed_snapshot_prefix}{user_id}:{snapshot_id}"
+
+        async with self.__client.pipeline(transaction=True) as pipe:
+            if post_ids:
+                pipe.zadd(snapshot_key, {post_id: position for position, post_id in enumerate(post_ids)})
+                pipe.expire(snapshot_key, FEED_SNAPSHOT_TTL_SECONDS)
+            if continuation_cursor:
+                pipe.setex(f"{self.__feed_continuation_prefix}{user_id}:{snapshot_id}", FEED_SNAPSHOT_TTL_SECONDS, continuation_cursor)
+            pipe.setex(f"{self.__feed_current_prefix}{user_id}", FEED_SNAPSHOT_FRESH_SECONDS, snapshot_id)
+            pipe.srem(self.__feed_stale_users_key, user_id)
+            # Only active users are indexed. Forgotten one isn't brought back
+            pipe.zadd(self.__feed_built_at_key, {user_id: time.time()}, xx=True)
+            await pipe.execute()
+        return snapshot_id
+
+    @redis_error_handler
+    async def get_current_feed_snapshot(self, user_id: str) -> str | None:
+        return await self.__client.get(f"{self.__feed_current_prefix}{user_id}")
+
+    @redis_error_handler
+    async def get_feed_snapshot_page(self, user_id: str, snapshot_id: str, offset: int, n: int) -> Tuple[List[str], int, str | None] | None:
+        """Returns (post ids, snapshot size, continuation cursor). None - snapshot expired or empty"""
+        async with self.__client.pipeline(transaction=False) as pipe:
+            pipe.zrange(f"{self.__feed_snapshot_prefix}{user_id}:{snapshot_id}", offset, offset + n - 1)
+            pipe.zcard(f"{self.__feed_snapshot_prefix}{user_id}:{snapshot_id}")
+            pipe.get(f"{self.__feed_continuation_prefix}{user_id}:{snapshot_id}")
+            post_ids, size, continuation_cursor = await pipe.execute()
+
+        if not size:
+            return None
+        return (post_ids, size, continuation_cursor)
+
+    @redis_error_handler
+    async def touch_feed_user(self, user_id: str) -> None:
+        """Only feeds of users that requested it recently get precomputed"""
+        async with self.__client.pipeline(transaction=False) as pipe:
+            pipe.zadd(self.__feed_active_users_key, {user_id: time.time()})
+            pipe.zadd(self.__feed_built_at_key, {user_id: 0}, nx=True)
+            await pipe.execute()
+
+    @redis_error_handler
+    async def forget_feed_users(self, user_ids: List[str]) -> None:
+        """Stops precomputing feeds of users. Next feed request makes them active again"""
+        if user_ids:
+            async with self.__client.pipeline(transaction=False) as pipe:
+                pipe.zrem(self.__feed_active_users_key, *user_ids)
+                pipe.zrem(self.__feed_built_at_key, *user_ids)
+                await pipe.execute()
+
+    @redis_error_handler
+    async def mark_feeds_stale(self, user_ids: List[str]) -> None:
+        """Feeds get rebuilt on next worker tick"""
+        if user_ids:
+            await self.__client.sadd(self.__feed_stale_users_key, *user_ids)
+
+    @redis_error_handler
+    async def get_feed_users_to_refresh(self, active_since: float, count: int) -> List[str]:
+        """
+        Returns up to `count` active users whose feed is stale by activity or has no fresh snapshot (TTL) - never built and oldest first \n
+        Users that weren't active since `active_since` are forgotten. Cost doesn't depend on number of active users.
+        """
+        inactive_ids = await self.__client.zrange(self.__feed_active_users_key, "-inf", active_since, byscore=True)
+        await self.forget_feed_users(user_ids=inactive_ids)
+
+        user_ids = []
+        stale_ids = await self.__client.spop(self.__feed_stale_users_key, count=count) or []
+        if stale_ids:
+            last_requests = await self.__client.zmscore(self.__feed_active_users_key, stale_ids)
+            user_ids = [user_id for user_id, last_request in zip(stale_ids, last_requests) if last_request is not None]
+
+        if len(user_ids) < count:
+            # Snapshot built before that is expired - same moment `feed-current` key expires
+            expired_ids = await self.__client.zrange(
+                self.__feed_built_at_key, "-inf", f"({time.time() - FEED_SNAPSHOT_FRESH_SECONDS}", byscore=True, offset=0, num=count
+            )
+            user_ids.extend(user_id for user_id in expired_ids if user_id not in user_ids)
+
+        return user_ids[:count]
+
+    # ===============
+    # Following timelines logic
+    # ==============
+
+    @redis_error_handler
+    async def push_to_timelines(self, user_ids: List[str], post_id: str, score: float) -> None:
+        """
+        Adds post to already built timelines of users. Each timeline keeps `TIMELINE_MAX_LENGTH` newest posts \n
+        Not built timelines are skipped - they get backfilled from database on first read.
+        """
+        if not user_ids:
+            return
+
+        async with self.__client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.exists(f"{self.__timeline_prefix}{user_id}")
+            built = await pipe.execute()
+
+        async with self.__client.pipeline(transaction=False) as pipe:
+            for user_id, exists in zip(user_ids, built):
+                if not exists:
+                    continue
+                key = f"{self.__timeline_prefix}{user_id}"
+                pipe.zadd(key, {post_id: score})
+                pipe.zremrangebyrank(key, 0, -TIMELINE_MAX_LENGTH - 1)
+            await pipe.execute()
+
+    @redis_error_handler
+    async def remove_from_timelines(self, user_ids: List[str], post_id: str) -> None:
+        if not user_ids:
+            return
+
+        async with self.__client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zrem(f"{self.__timeline_prefix}{user_id}", post_id)
+            await pipe.execute()
+
+    @redis_error_handler
+    async def save_timeline(self, user_id: str, posts: Dict[str, float]) -> None:
+        """Replaces user's timeline. `posts` - post id -> score. Empty `posts` is saved too - timeline is built, just has nothing"""
+        key = f"{self.__timeline_prefix}{user_id}"
+        async with self.__client.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.zadd(key, {self.__timeline_built_marker: float("-inf"), **posts})
+            pipe.zremrangebyrank(key, 0, -TIMELINE_MAX_LENGTH - 1)
+            pipe.expire(key, TIMELINE_TTL_SECONDS)
+            await pipe.execute()
+
+    @redis_error_handler
+    async def delete_timeline(self, user_id: str) -> None:
+        """Followed users changed. Timeline gets backfilled on next read"""
+        await self.__client.delete(f"{self.__timeline_prefix}{user_id}")
+
+    @redis_error_handler
+    async def get_timeline_page(self, user_id: str, n: int, before: Tuple[float, str] | None = None) -> Tuple[List[Tuple[str, float]], int] | None:
+        """
+        Returns ([(post id, score)], timeline size). Newest first, strictly after `before` - (score, post id) of previous page last post \n
+        None - timeline isn't built. Empty list - built, but has no posts (after `before`)
+        """
+        key = f"{self.__timeline_prefix}{user_id}"
+
+        async with self.__client.pipeline(transaction=False) as pipe:
+            pipe.zcard(key)
+            pipe.zscore(key, self.__timeline_built_marker)
+            pipe.expire(key, TIMELINE_TTL_SECONDS)
+            if before:
+                pipe.zcount(key, before[0], before[0])
+            size, marker, _, *tied = await pipe.execute()
+
+        if not size:
+            return None
+        # Full timeline has marker trimmed away. Not full one - counted without it
+        size -= marker is not None
+
+        if not before:
+            items = await self.__client.zrange(key, 0, n - 1, desc=True, withscores=True)
+            return ([item for item in items if item[0] != self.__timeline_built_marker], size)
+
+        # Posts with the same score as cursor are ordered by id. Those that were already returned are skipped
+        score, post_id = before
+        items = await self.__client.zrange(key, score, "-inf", desc=True, byscore=True, offset=0, num=n + tied[0], withscores=True)
+        items = [(member, member_score) for member, member_score in items if not (member_score == score and member >= post_id) and member != self.__timeline_built_marker]
+        return (items[:n], size)
+
+    @redis_error_handler
+    async def set_timeline_celebrity(self, user_id: str, is_celebrity: bool) -> None:
+        if is_celebrity: await self.__client.sadd(self.__timeline_celebrities_key, user_id)
+        else: await self.__client.srem(self.__timeline_celebrities_key, user_id)
+
+    @redis_error_handler
+    async def get_timeline_celebrities(self) -> List[str]:
+        return list(await self.__client.smembers(self.__timeline_celebrities_key))
+
+    # ===============
+    # LocalStorage images token acces
+    # ==============
+
+    @redis_error_handler
+    async def save_url_tokens(self, post_tokens: Dict[str, str], user_tokens: Dict[str, str]) -> None:
+        """Batch of image acces tokens in one pipeline. Token -> image name"""
+        if not post_tokens and not user_tokens:
+            return
+
+        async with self.__client.pipeline(transaction=False) as pipe:
+            for image_token, image_name in post_tokens.items():
+                pipe.setex(f"{self.__post_image_acces_prefix}{image_token}", IMAGE_VIEW_ACCES_SECONDS, image_name)
+            for image_token, image_name in user_tokens.items():
+                pipe.setex(f"{self.__user_image_acces_prefix}{image_token}", IMAGE_VIEW_ACCES_SECONDS, image_name)
+            await pipe.execute()
+
     @redis_error_handler
     async def check_image_access(self, url_image_token: str, image_type: ImageType) -> str | None:
         """
@@ -236,6 +632,37 @@ class RedisService:
 
         return await self.__client.get(pattern)
     
+    # ===============
+    # S3 presigned URLs cache
+    # ==============
+
+    @redis_error_handler
+    async def get_presigned_urls(self, keys: List[str]) -> Dict[str, Tuple[str, float]]:
+        """Returns key -> (URL, expiry unix timestamp) of found keys"""
+        values = await self.__client.mget([f"{self.__presigned_url_prefix}{key}" for key in keys])
+
+        found = {}
+        for key, value in zip(keys, values):
+            if value:
+                expires_at, _, url = value.partition(" ")
+                found[key] = (url, float(expires_at))
+        return found
+
+    @redis_error_handler
+    async def save_presigned_urls(self, urls: Dict[str, Tuple[str, float]], safety_margin_seconds: int) -> None:
+        """Entry lives until URL has only `safety_margin_seconds` left"""
+        now = time.time()
+        async with self.__client.pipeline(transaction=False) as pipe:
+            for key, (url, expires_at) in urls.items():
+                ttl = int(expires_at - now - safety_margin_seconds)
+                if ttl > 0:
+                    pipe.setex(f"{self.__presigned_url_prefix}{key}", ttl, f"{expires_at} {url}")
+            await pipe.execute()
+
+    @redis_error_handler
+    async def delete_presigned_urls(self, keys: List[str]) -> None:
+        await self.__client.delete(*[f"{self.__presigned_url_prefix}{key}" for key in keys])
+
     # ==============
     # Chat
     # ==============
@@ -272,32 +699,3 @@ class RedisService:
         pattern = f"{self.__chat_connection_prefix}{room_id}"
         return await self.__client.lrange(pattern, 0, -1)
 
-    @redis_error_handler
-    async def get_user_chat_pagination(self, user_id: str) -> int:
-        pattern = f"{self.__user_chat_pagination_prefix}{user_id}"
-
-        value_str = await self.__client.get(pattern)
-        if not value_str:
-            await self.__client.set(pattern, 0)
-            return 0
-
-        return int(value_str)
-
-    @redis_error_handler
-    async def reset_user_chat_pagination(self, user_id: str) -> int:
-        pattern = f"{self.__user_chat_pagination_prefix}{user_id}"
-        await self.__client.set(pattern, 0)
-
-    @redis_error_handler
-    async def user_chat_pagination_action(self, user_id: str, room_id: str, increment: bool):
-        """Set `increment` to True to increment value. False - to decrement"""
-        pattern = f"{self.__user_chat_pagination_prefix}{user_id}"
-        print("INCREMENTING")
-        if increment:
-            await self.__client.incr(pattern, amount=1)
-        else:
-            await self.__client.decr(pattern)
-            new_value = await self.__client.get(pattern)
-            if int(new_value) < 0:
-                await self.__client.set(pattern, 0)
-
@@ -1,6 +1,7 @@
-from fastapi import WebSocket, WebSocketDisconnect, APIRouter, Depends, Body
+from fastapi import WebSocket, WebSocketDisconnect, APIRouter, Depends, Body, Query
 from authorization import authorize_request_depends, authorize_chat_token, JWTService
-from services.postgres_service import User, get_session_depends, merge_model
+from services.postgres_service import User, get_session_depends
+from pydantic_schemas.pydantic_schemas_auth import AuthorizedUser
 from services.core_services.main_services import MainChatService
 from services.core_services.core_services import MainServiceContextManager
 from websockets_chat.connection_manager import WebsocketConnectionManager
@@ -21,33 +22,30 @@ connection = WebsocketConnectionManager()
 # @endpoint_exception_handler
 async def get_chat_token_participants_avatar_urls(
     chat_id: str,
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
 ) -> ChatTokenResponse:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainChatService].create(MainServiceType=MainChatService, postgres_session=session) as chat:
         return await chat.get_chat_token_participants_avatar_urls(room_id=chat_id, user=user)
 
-@chat.get("/chat/{chat_id}/messages/{page}")
+@chat.get("/chat/{chat_id}/messages")
 @endpoint_exception_handler
 async def get_batch_of_chat_messages(
     chat_id: str,
-    page: int = Depends(page_validator),
-    user_: User = Depends(authorize_request_depends),
+    before_seq: int | None = Query(default=None, ge=1),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
 ) -> List[MessageSchema]:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainChatService].create(MainServiceType=MainChatService, postgres_session=session) as chat:
-        return await chat.get_messages_batch(room_id=chat_id, user=user, page=page)
+        return await chat.get_messages_batch(room_id=chat_id, user=user, before_seq=before_seq)
 
 @chat.post("/chat/dialoque")
 @endpoint_exception_handler
 async def create_dialoque_chat(
     data: CreateDialoqueRoomBody = Body(...),  
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
 ) -> None:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainChatService].create(MainServiceType=MainChatService, postgres_session=session) as chat:
         return await chat.create_dialogue_chat(data=data, user=user)
 
@@ -55,10 +53,9 @@ async def create_dialoque_chat(
 @endpoint_exception_handler
 async def create_group_chat(
     data: CreateGroupRoomBody,
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
 ) -> None:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainChatService].create(MainServiceType=MainChatService, postgres_session=session) as chat:
         await chat.create_group_chat(data=data, user=user)
 
@@ -66,10 +63,9 @@ async def create_group_chat(
 @endpoint_exception_handler
 async def get_my_chats(
     page: int = Depends(page_validator),
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)  
 ) -> List[Chat]:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainChatService].create(MainServiceType=MainChatService, postgres_session=session) as chat:
         return await chat.get_chat_batch(user=user, page=page, chat_type="chat")
 
@@ -77,10 +73,9 @@ async def get_my_chats(
 @endpoint_exception_handler
 async def get_not_approved_chats(
     page: int = Depends(page_validator),
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)  
 ) -> List[Chat]:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainChatService].create(MainServiceType=MainChatService, postgres_session=session) as chat:
         return await chat.get_chat_batch(user=user, page=page, chat_type="not-approved")
 
@@ -88,10 +83,9 @@ async def get_not_approved_chats(
 @endpoint_exception_handler
 async def approve_chat(
     chat_id: str,
-    user_: User = Depends(authorize_request_depends),
+    user: AuthorizedUser = Depends(authorize_request_depends),
     session: AsyncSession = Depends(get_session_depends)
 ) -> None:
-    user = await merge_model(postgres_session=session, model_obj=user_)
     async with await MainServiceContextManager[MainChatService].create(MainServiceType=MainChatService, postgres_session=session) as chat:
         return await chat.approve_chat(room_id=chat_id, user=user)
 
@@ -36,12 +36,13 @@ class WebsocketConnectionManager:
 
         Switch to mode='test' to connect to test Redis pool
         """
-        self._redis: RedisService = RedisService(db_pool=mode)
-
         if self._isinitialized:
             return
         self._isinitialized = True
 
+        # Backed by process-wide Redis pool. Creating it once is enough
+        self._redis: RedisService = RedisService(db_pool=mode)
+
         self._rooms = {}
 
 